@@ -0,0 +1,279 @@
+# admission.py
+"""
+分析请求的准入控制与调度：有界排队、过载时拒绝（503 + Retry-After）、按客户端公平、分优先级通道。
+
+原先 /api/analyze 与 /web/analyze 来多少收多少，流量高峰时任务在线程池 / 模型网关里越堆越多，
+排在后面的请求全部超时。现在所有分析都先经过这里：
+- 同时运行的分析数不超过 ADMISSION_MAX_ACTIVE，其余在调度器中排队（排队的任务只是一条记录，不占线程）；
+- 通道（lane）：web（Web 界面，用户在页面上等待）、api（/api/analyze）、batch（/api/batch 的条目）。
+  有空位时按权重（ADMISSION_LANE_WEIGHTS，默认 web=6,api=3,batch=1）做平滑加权轮询选择通道：
+  Web 用户优先，但 API 与批量任务不会被完全饿死；
+- 公平：同一通道内按客户端分队列轮流出队，一个批量调用方提交再多任务，也只是在轮转中占一个位置；
+  客户端标识见 app.client_key：来源 IP，或受信任网关（TRUSTED_PROXIES）设置的 X-Client-Id；
+- 有界：每个通道最多排队 ADMISSION_MAX_QUEUE 个，单个客户端最多 ADMISSION_MAX_QUEUE_PER_CLIENT 个，
+  超出时抛出 Saturated，由接口返回 503 并带上 Retry-After（按排在前面的任务数与近期平均处理时间估算）；
+- 同步等待的调用方（Web 接口在请求线程内分析）最多等 ADMISSION_WAIT_TIMEOUT 秒，仍未轮到时同样返回 503。
+
+导出的指标：admission_active、admission_queue_depth{lane}、admission_wait_seconds{lane}（排队时间直方图）、
+admission_rejected_total{lane,reason}、admission_service_seconds（近期平均处理时间，用于估算容量）。
+
+配置（环境变量）：
+- ADMISSION_MAX_ACTIVE：同时运行的分析数，默认为模型并发上限（LLM_MAX_CONCURRENCY）的 2 倍；
+  线程池模式下另不超过 ANALYSIS_WORKERS（由 app.py 传入）
+- ADMISSION_MAX_QUEUE：每个通道的排队上限，默认 1000
+- ADMISSION_MAX_QUEUE_PER_CLIENT：单个客户端在一个通道内的排队上限，默认 200
+- ADMISSION_LANE_WEIGHTS：通道权重，默认 web=6,api=3,batch=1
+- ADMISSION_WAIT_TIMEOUT：同步等待的最长时间（秒），默认 30
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+ADMISSION_WAIT_TIMEOUT = float(os.environ.get("ADMISSION_WAIT_TIMEOUT", "30"))
+LANES = ("web", "api", "batch")
+DEFAULT_SERVICE_SECONDS = 30.0  # 还没有完成过任务时，估算 Retry-After 用的处理时间
+SERVICE_EWMA_ALPHA = 0.2
+RETRY_AFTER_MIN, RETRY_AFTER_MAX = 1, 300
+
+
+class Saturated(RuntimeError):
+    """排队已满或等待超时；retry_after 为建议的重试间隔（秒）。"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """一个排队中 / 运行中的分析。release() 可重复调用，只生效一次。"""
+    __slots__ = ("scheduler", "lane", "client", "start", "enqueued_at", "started_at", "_released")
+
+    def __init__(self, scheduler, lane, client, start):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.client = client
+        self.start = start
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self._released = False
+
+    def release(self):
+        self.scheduler._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FairScheduler:
+    def __init__(self, max_active, max_queue=1000, max_queue_per_client=200, lane_weights=None):
+        self.max_active = max(1, max_active)
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.lane_weights = dict(lane_weights or {"web": 6, "api": 3, "batch": 1})
+        self.active = 0
+        # lane -> OrderedDict(client -> deque[Ticket])；出队时取第一个客户端的队首，再把该客户端移到末尾
+        self._queues = {lane: OrderedDict() for lane in self.lane_weights}
+        self._depth = {lane: 0 for lane in self.lane_weights}
+        self._credit = {lane: 0 for lane in self.lane_weights}
+        self._service_seconds = None
+        self._lock = threading.Lock()
+
+    # ---------- 提交 ----------
+
+    def check(self, lane, client):
+        """预检：当前排队已满时抛出 Saturated（不占位置），用于在接收上传等较重的处理之前尽早拒绝。"""
+        with self._lock:
+            self._check_locked(lane, client)
+
+    def submit(self, lane, client, launch):
+        """
+        提交后台任务：轮到时调用 launch()，它应启动任务并返回 concurrent.futures.Future，
+        Future 结束时自动释放名额。排队已满时抛出 Saturated。
+        """
+        ticket = Ticket(self, lane, client, None)
+
+        def start():
+            try:
+                future = launch()
+            except Exception as e:
+                print(f"分析任务启动失败: {e}")
+                ticket.release()
+                return
+            future.add_done_callback(lambda _: ticket.release())
+
+        ticket.start = start
+        self._enqueue(ticket, bounded=True)
+        return ticket
+
+    def hold(self, lane, client, timeout=None, bounded=True):
+        """
+        同步占用一个名额（在调用线程内执行分析），返回 Ticket（可用作 with 语句，或结束时调用 release）。
+        排队已满（bounded 为 True 时）或 timeout 秒内未轮到时抛出 Saturated。
+        """
+        started = threading.Event()
+        ticket = Ticket(self, lane, client, started.set)
+        self._enqueue(ticket, bounded=bounded)
+        if started.wait(timeout):
+            return ticket
+        with self._lock:
+            queued = self._remove_locked(ticket)
+        if not queued:
+            # 超时的同时刚好轮到
+            return ticket
+        metrics.inc("admission_rejected_total", help="因排队已满或等待超时被拒绝的分析请求数",
+                    lane=lane, reason="timeout")
+        raise Saturated("服务繁忙，排队超时，请稍后再试", self.retry_after(lane))
+
+    # ---------- 内部 ----------
+
+    def _check_locked(self, lane, client):
+        if lane not in self._queues:
+            raise ValueError(f"未知的通道: {lane}")
+        if self._depth[lane] >= self.max_queue:
+            reason = "queue_full"
+        elif len(self._queues[lane].get(client, ())) >= self.max_queue_per_client:
+            reason = "client_limit"
+        else:
+            return
+        metrics.inc("admission_rejected_total", help="因排队已满或等待超时被拒绝的分析请求数",
+                    lane=lane, reason=reason)
+        raise Saturated("服务繁忙，请稍后再试" if reason == "queue_full" else "提交的任务过多，请等待已提交的任务完成",
+                        self._retry_after_locked(lane))
+
+    def _enqueue(self, ticket, bounded):
+        with self._lock:
+            if bounded:
+                self._check_locked(ticket.lane, ticket.client)
+            self._queues[ticket.lane].setdefault(ticket.client, deque()).append(ticket)
+            self._depth[ticket.lane] += 1
+            ready = self._dispatch_locked()
+        self._start(ready)
+
+    def _remove_locked(self, ticket):
+        """把仍在排队的 ticket 移出队列；已经开始运行时返回 False。"""
+        if ticket.started_at is not None:
+            return False
+        clients = self._queues[ticket.lane]
+        tickets = clients[ticket.client]
+        tickets.remove(ticket)
+        if not tickets:
+            del clients[ticket.client]
+        self._depth[ticket.lane] -= 1
+        ticket._released = True
+        return True
+
+    def _dispatch_locked(self):
+        """有空位时按通道权重与客户端轮转取出下一批任务（在锁外启动）。"""
+        ready = []
+        while self.active < self.max_active:
+            lane = self._pick_lane_locked()
+            if lane is None:
+                break
+            clients = self._queues[lane]
+            client, tickets = next(iter(clients.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            self._depth[lane] -= 1
+            self.active += 1
+            ticket.started_at = time.monotonic()
+            ready.append(ticket)
+        return ready
+
+    def _pick_lane_locked(self):
+        """平滑加权轮询：非空通道各加上自身权重，取最大者，再减去本轮的权重和。"""
+        candidates = [lane for lane, depth in self._depth.items() if depth]
+        if not candidates:
+            return None
+        total = 0
+        for lane in candidates:
+            self._credit[lane] += self.lane_weights[lane]
+            total += self.lane_weights[lane]
+        lane = max(candidates, key=lambda l: self._credit[l])
+        self._credit[lane] -= total
+        return lane
+
+    def _start(self, tickets):
+        for ticket in tickets:
+            metrics.observe("admission_wait_seconds", ticket.started_at - ticket.enqueued_at,
+                            help="分析请求在调度器中的排队时间（秒）", lane=ticket.lane)
+            ticket.start()
+
+    def _release(self, ticket):
+        with self._lock:
+            if ticket._released:
+                return
+            ticket._released = True
+            if ticket.started_at is None:
+                self._remove_locked(ticket)
+                return
+            elapsed = time.monotonic() - ticket.started_at
+            if self._service_seconds is None:
+                self._service_seconds = elapsed
+            else:
+                self._service_seconds += SERVICE_EWMA_ALPHA * (elapsed - self._service_seconds)
+            self.active -= 1
+            ready = self._dispatch_locked()
+        self._start(ready)
+
+    def retry_after(self, lane):
+        with self._lock:
+            return self._retry_after_locked(lane)
+
+    def _retry_after_locked(self, lane):
+        """估算排到的时间：前面的任务数 / 并发数 × 平均处理时间（秒，取整并限制在合理范围内）。"""
+        ahead = self._depth.get(lane, 0) + self.active
+        service = self._service_seconds or DEFAULT_SERVICE_SECONDS
+        seconds = math.ceil(ahead / self.max_active * service)
+        return min(RETRY_AFTER_MAX, max(RETRY_AFTER_MIN, seconds))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "max_active": self.max_active,
+                "queued": dict(self._depth),
+                "clients": {lane: len(clients) for lane, clients in self._queues.items()},
+                "service_seconds": self._service_seconds,
+            }
+
+    def collect_metrics(self):
+        stats = self.stats()
+        yield "admission_active", "gauge", "正在运行的分析数", {}, stats["active"]
+        yield "admission_max_active", "gauge", "同时运行的分析数上限", {}, stats["max_active"]
+        for lane, depth in stats["queued"].items():
+            yield "admission_queue_depth", "gauge", "调度器中排队的分析数", {"lane": lane}, depth
+            yield "admission_queue_clients", "gauge", "有任务在排队的客户端数", {"lane": lane}, stats["clients"][lane]
+        if stats["service_seconds"] is not None:
+            yield "admission_service_seconds", "gauge", "近期平均处理时间（秒，指数加权）", {}, stats["service_seconds"]
+
+
+def parse_lane_weights(text):
+    """"web=6,api=3,batch=1" -> {"web": 6, "api": 3, "batch": 1}；未写出的通道权重为 1。"""
+    weights = {lane: 1 for lane in LANES}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        lane, _, weight = part.partition("=")
+        if lane.strip() not in weights:
+            raise ValueError(f"未知的通道: {lane}")
+        weights[lane.strip()] = max(1, int(weight))
+    return weights
+
+
+def create_scheduler(default_max_active):
+    """按环境变量（见模块说明）创建调度器；default_max_active 为未设置 ADMISSION_MAX_ACTIVE 时的并发数。"""
+    env = os.environ.get
+    return FairScheduler(
+        max_active=int(env("ADMISSION_MAX_ACTIVE", str(default_max_active))),
+        max_queue=int(env("ADMISSION_MAX_QUEUE", "1000")),
+        max_queue_per_client=int(env("ADMISSION_MAX_QUEUE_PER_CLIENT", "200")),
+        lane_weights=parse_lane_weights(env("ADMISSION_LANE_WEIGHTS", "web=6,api=3,batch=1")),
+    )
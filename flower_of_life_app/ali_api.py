@@ -1,43 +1,101 @@
 import os
+import asyncio
 import base64
 from datetime import datetime
-from openai import OpenAI
+import metrics
+import profiling
+from llm_gateway import create_llm_gateway
+from analysis_cache import create_analysis_cache, make_cache_key
+from singleflight import SingleFlight
+from imaging import normalize_for_model
+from report import Report, json_path_for, write_report_json
+from downloads import record_digest
+from artifacts import store as artifact_store
+from near_duplicates import create_near_duplicate_index, scope_key
 
 # ----------------------------
-# 原有客户端初始化（保留）；建议使用环境变量传入 KEY
+# 模型调用网关（连接池、限流、重试、超时、熔断，见 llm_gateway.py）
+# DASHSCOPE_API_KEY / DASHSCOPE_BASE_URL 可覆盖默认值（如指向本地模拟服务做基准测试）
 # ----------------------------
-client = OpenAI(
-    api_key="sk-005adc9aad0245a78164ba3d3e066bd2",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+gateway = create_llm_gateway(
+    api_key=os.environ.get("DASHSCOPE_API_KEY", "sk-005adc9aad0245a78164ba3d3e066bd2"),
+    base_url=os.environ.get("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
 )
 
 MAX_IMAGE_SIZE = 19_000_000  # 平台限制约 20MB
+MODEL_NAME = "qwen-vl-max-latest"
 
-def get_image_url_or_base64(image_path: str):
-    """保留原有：支持 http(s) URL 或本地文件转 base64。"""
+# 分析结果缓存：同一图片 + 提示词 + 模型 命中时不再调用模型
+analysis_cache = create_analysis_cache()
+# 近似重复：重新拍照 / 裁剪 / 压缩的同一幅画复用之前的分析结果（见 near_duplicates.py）
+near_duplicate_index = create_near_duplicate_index(analysis_cache)
+# 相同请求合并：同一 cache key 的模型调用同时只进行一次；线程中的同步分析（do）与
+# 事件循环中的异步分析（ado）共用同一张表，Web 与 API 同时提交同一张图片也只调用一次模型
+analysis_flight = SingleFlight("analyze_image")
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def collect_metrics():
+    """导出分析缓存与模型网关的统计（见 metrics.register_collector）。"""
+    if analysis_cache is not None:
+        yield "analysis_cache_hits_total", "counter", "分析缓存命中次数", {}, analysis_cache.hits
+        yield "analysis_cache_misses_total", "counter", "分析缓存未命中次数", {}, analysis_cache.misses
+    stats = gateway.stats()
+    if near_duplicate_index is not None:
+        yield "near_duplicate_index_size", "gauge", "近似重复索引中的图片数", {}, near_duplicate_index.size()
+    yield "llm_active_calls", "gauge", "正在进行的模型调用数", {}, stats["active"]
+    yield "llm_waiting_calls", "gauge", "等待并发名额的模型调用数", {}, stats["waiting"]
+    yield "llm_calls_total", "counter", "发往模型接口的请求数（含重试）", {}, stats["calls"]
+    yield "llm_retries_total", "counter", "模型调用重试次数", {}, stats["retries"]
+    yield "llm_failures_total", "counter", "模型调用失败次数", {}, stats["failures"]
+    yield "llm_rejected_total", "counter", "因熔断或排队超时未发出的调用数", {}, stats["rejected"]
+    yield "llm_circuit_state", "gauge", "熔断状态：0 关闭，1 半开，2 打开", {}, CIRCUIT_STATES[stats["circuit"]]
+
+metrics.register_collector(collect_metrics)
+metrics.register_collector(metrics.singleflight_collector(analysis_flight))
+
+def get_image_url_or_base64(image_path: str, image=None):
+    """
+    支持 http(s) URL 或本地文件转 base64；本地文件先规范化（缩放、去元数据、正确的 MIME）。
+    image 为 uploads.ImageSource 时直接使用其内存中的内容与哈希。
+    """
     if image_path.startswith("http://") or image_path.startswith("https://"):
         return {"url": image_path}
-    with open(image_path, "rb") as f:
-        data = f.read()
+    with metrics.span("normalize_image"):
+        if image is not None:
+            data, mime = normalize_for_model(image_path, image.data, image.sha256)
+        else:
+            data, mime = normalize_for_model(image_path)
     if len(data) > MAX_IMAGE_SIZE:
         raise ValueError("图片过大，请压缩后再试")
-    b64 = base64.b64encode(data).decode("utf-8")
-    return {"url": f"data:image/png;base64,{b64}"}
-
-def ensure_output_dir() -> str:
-    out = os.path.join(os.getcwd(), "output")
-    os.makedirs(out, exist_ok=True)
-    return out
+    with metrics.span("base64_encode"):
+        b64 = base64.b64encode(data).decode("ascii")
+    return {"url": f"data:{mime};base64,{b64}"}
 
 def save_txt_report(text: str, name: str, image_path: str) -> str:
-    """将结果落盘到 output 目录。"""
-    out = ensure_output_dir()
+    """将结果落盘到报告存储（见 artifacts.py）。"""
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     base = os.path.splitext(os.path.basename(image_path))[0] or "report"
     fname = f"{ts}_{name}_{base}.txt"
-    path = os.path.join(out, fname)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(text)
+    path = artifact_store.report_path(fname)
+    with metrics.span("save_txt_report"):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        record_digest(path)
+    artifact_store.add(path)
+    return path
+
+def save_report(report: Report, image_path: str) -> str:
+    """
+    报告的旁路输出：TXT（模型原文，供下载）与同名 JSON（结构化结果，重新渲染时免解析）。
+    返回 TXT 路径；JSON 写入失败不影响本次请求。
+    """
+    path = save_txt_report(report.to_text(), report.name, image_path)
+    try:
+        write_report_json(report, json_path_for(path))
+        artifact_store.add(json_path_for(path))
+    except OSError as e:
+        print(f"警告: 报告 JSON 写入失败: {e}")
     return path
 
 # ----------------------------
@@ -51,23 +109,21 @@ DEFAULT_PROMPT = (
     '不要出现敏感词：灵性'
 )
 
-def analyze_image(image_path: str, name: str, prompt_override: str | None = None):
+def build_user_prompt(prompt_override: str | None = None) -> str:
     """
-    新增：prompt_override 为可选提示词。
+    prompt_override 为可选提示词。
     - 当提供时：完全替换 DEFAULT_PROMPT；并在末尾自动追加“请不要以表格的形式出现回答”。
     - 未提供：继续使用 DEFAULT_PROMPT（保持原行为）。
     """
-    image_url_obj = get_image_url_or_base64(image_path)
-
-    # 处理可选提示词并自动追加“不要表格”
     if prompt_override and prompt_override.strip():
         user_prompt = prompt_override.strip()
         if "不要以表格的形式" not in user_prompt and "不要以表格的形式出现回答" not in user_prompt:
             user_prompt += "。请不要以表格的形式出现回答"
-    else:
-        user_prompt = DEFAULT_PROMPT
+        return user_prompt
+    return DEFAULT_PROMPT
 
-    messages = [
+def build_messages(image_url_obj: dict, user_prompt: str) -> list:
+    return [
         {"role": "system", "content": [{"type": "text", "text": "You are a helpful assistant."}]},
         {
             "role": "user",
@@ -78,14 +134,157 @@ def analyze_image(image_path: str, name: str, prompt_override: str | None = None
         },
     ]
 
+def lookup_cache(image_path: str, user_prompt: str, image=None):
+    """
+    返回 (cache_key, 缓存文本)；无法计算 key 或未命中时对应项为 None。
+    精确缓存未命中时再查近似重复的图片（见 lookup_near_duplicate）。
+    """
+    try:
+        cache_key = make_cache_key(image_path, user_prompt, MODEL_NAME, image.sha256 if image else None)
+    except OSError:
+        return None, None
+    if analysis_cache is None:
+        return cache_key, None
+    try:
+        cached = analysis_cache.get(cache_key)
+    except OSError:
+        cached = None
+    if cached is not None:
+        print(f"分析缓存命中: {cache_key[:12]}")
+        return cache_key, cached
+    return cache_key, lookup_near_duplicate(image_path, user_prompt, cache_key, image)
+
+def lookup_near_duplicate(image_path: str, user_prompt: str, cache_key: str, image=None):
+    """
+    查找阈值内最相近、且报告仍在缓存中的图片，返回其报告文本（同时以本图的缓存键写入缓存）；没有时返回 None。
+    """
+    if near_duplicate_index is None:
+        return None
+    value_hash = near_duplicate_index.image_hash(image_path, image)
+    if value_hash is None:
+        return None
+    for distance, other_key in near_duplicate_index.lookup(value_hash, scope_key(user_prompt, MODEL_NAME)):
+        try:
+            text = analysis_cache.get(other_key)
+        except OSError:
+            text = None
+        if text is None:
+            continue
+        print(f"近似重复命中: 距离 {distance}，复用 {other_key[:12]}")
+        metrics.inc("near_duplicate_lookups_total", help="近似重复查找次数（按结果）", outcome="hit")
+        try:
+            analysis_cache.put(cache_key, text)
+        except OSError as e:
+            print(f"警告: 分析缓存写入失败: {e}")
+        return text
+    metrics.inc("near_duplicate_lookups_total", help="近似重复查找次数（按结果）", outcome="miss")
+    return None
+
+def remember_analysis(cache_key: str | None, analysis_result: str, image_path: str, user_prompt: str, image=None):
+    """模型返回结果后：写入分析缓存，并在近似重复索引中登记本图。"""
+    if not cache_key or analysis_cache is None or not analysis_result:
+        return
+    # 模型调用已经成功，缓存写入失败（磁盘满、权限等）不影响本次请求
+    try:
+        analysis_cache.put(cache_key, analysis_result)
+    except OSError as e:
+        print(f"警告: 分析缓存写入失败: {e}")
+        return
+    if near_duplicate_index is not None:
+        value_hash = near_duplicate_index.image_hash(image_path, image)
+        if value_hash is not None:
+            near_duplicate_index.add(value_hash, scope_key(user_prompt, MODEL_NAME), cache_key)
+
+def request_analysis(image_path: str, user_prompt: str, cache_key: str | None = None, image=None) -> str:
+    """实际调用模型，返回报告文本；成功时写入缓存。"""
+    image_url_obj = get_image_url_or_base64(image_path, image)
+    with metrics.span("llm_call"):
+        completion = gateway.chat(MODEL_NAME, build_messages(image_url_obj, user_prompt))
+    # DashScope 兼容模式 message.content 为纯文本
+    analysis_result = completion.choices[0].message.content
+    remember_analysis(cache_key, analysis_result, image_path, user_prompt, image)
+    return analysis_result
+
+def parse_report(text: str, name: str) -> Report:
+    """解析模型输出；被选中剖析时（见 profiling.py）解析在 cProfile 下执行，之后的 PDF 渲染沿用同一个 profile_id。"""
+    profile_id = profiling.new_profile_id() if profiling.should_profile() else None
+    with metrics.span("parse_report"), profiling.capture(profile_id, "parse", report=name):
+        report = Report.from_text(text, name)
+    report.profile_id = profile_id
+    return report
+
+async def request_analysis_async(image_path: str, user_prompt: str, cache_key: str | None = None, image=None) -> str:
+    """request_analysis 的 asyncio 版本：等待模型时不占线程，图片规范化与缓存 / 索引读写放到线程池（asyncio.to_thread）。"""
+    image_url_obj = await asyncio.to_thread(get_image_url_or_base64, image_path, image)
+    with metrics.span("llm_call"):
+        completion = await gateway.achat(MODEL_NAME, build_messages(image_url_obj, user_prompt))
+    analysis_result = completion.choices[0].message.content
+    await asyncio.to_thread(remember_analysis, cache_key, analysis_result, image_path, user_prompt, image)
+    return analysis_result
+
+async def analyze_report_async(image_path: str, name: str, prompt_override: str | None = None, image=None):
+    """
+    analyze_report 的 asyncio 版本（经 gateway.achat 调用模型），返回 (Report, error)。
+    缓存、请求合并与解析规则相同；阻塞的步骤（读缓存、规范化图片、解析报告）在线程池中执行。
+    """
+    user_prompt = build_user_prompt(prompt_override)
+    cache_key, cached = await asyncio.to_thread(lookup_cache, image_path, user_prompt, image)
+    if cached is not None:
+        return await asyncio.to_thread(parse_report, cached, name), None
+    try:
+        if cache_key:
+            analysis_result = await analysis_flight.ado(cache_key, request_analysis_async,
+                                                        image_path, user_prompt, cache_key, image)
+        else:
+            analysis_result = await request_analysis_async(image_path, user_prompt, image=image)
+        return await asyncio.to_thread(parse_report, analysis_result, name), None
+    except Exception as e:
+        return None, str(e)
+
+def analyze_report(image_path: str, name: str, prompt_override: str | None = None, image=None):
+    """
+    调用模型分析图片，返回 (Report, error)；报告在内存中解析一次，可直接交给 pdf.generate_pdf，
+    TXT / JSON 由调用方经 save_report 另行输出。
+    提示词规则见 build_user_prompt；相同图片 + 提示词 + 模型命中缓存时直接使用缓存文本，不访问网络；
+    相同请求正在进行时等待并共享其结果，不重复调用模型。
+    image 为可选的 uploads.ImageSource（已在内存中的上传内容与哈希）。
+    """
+    user_prompt = build_user_prompt(prompt_override)
+    cache_key, cached = lookup_cache(image_path, user_prompt, image)
+    if cached is not None:
+        return parse_report(cached, name), None
+
     try:
-        completion = client.chat.completions.create(
-            model="qwen-vl-max-latest",
-            messages=messages,
-        )
-        # DashScope 兼容模式 message.content 为纯文本
-        analysis_result = completion.choices[0].message.content
-        txt_file_path = save_txt_report(analysis_result, name, image_path)
-        return txt_file_path, None
+        if cache_key:
+            analysis_result = analysis_flight.do(cache_key, request_analysis, image_path, user_prompt, cache_key, image)
+        else:
+            analysis_result = request_analysis(image_path, user_prompt, image=image)
+        return parse_report(analysis_result, name), None
     except Exception as e:
         return None, str(e)
+
+def stream_analysis(image_path: str, prompt_override: str | None = None, image=None):
+    """
+    流式调用模型（stream=True），逐段产出文本增量；命中缓存时一次性产出全文。
+    完整生成结束后写入缓存。出错时直接抛出异常，由调用方处理。
+    """
+    user_prompt = build_user_prompt(prompt_override)
+    cache_key, cached = lookup_cache(image_path, user_prompt, image)
+    if cached is not None:
+        yield cached
+        return
+
+    image_url_obj = get_image_url_or_base64(image_path, image)
+    parts = []
+    # 流式调用的耗时包含调用方处理每个增量的时间
+    with metrics.span("llm_call"):
+        for chunk in gateway.stream(MODEL_NAME, build_messages(image_url_obj, user_prompt)):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+
+    analysis_result = "".join(parts)
+    remember_analysis(cache_key, analysis_result, image_path, user_prompt, image)
@@ -0,0 +1,162 @@
+# analysis_cache.py
+"""
+AI 分析结果缓存（内容寻址）。
+
+键 = sha256(图片内容哈希 或 规范化 URL + 实际提示词 + 模型名)，值为模型返回的报告文本。
+两级结构：
+- 内存热层：OrderedDict 实现的 LRU，按条目数限制；
+- 磁盘层：output/cache/analysis/<前两位>/<key>.txt，按总字节数限制，命中时刷新 mtime，超限时淘汰最久未用的文件。
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+
+def is_remote(image_path: str) -> bool:
+    return image_path.startswith("http://") or image_path.startswith("https://")
+
+
+def normalize_url(url: str) -> str:
+    """规范化 URL：协议与主机名小写，去掉片段（#...）。"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_fingerprint(image_path: str, image_sha256: str | None = None) -> str:
+    """本地文件取内容哈希（已知时直接使用），远程图片取规范化 URL。"""
+    if is_remote(image_path):
+        return "url:" + normalize_url(image_path)
+    return "sha256:" + (image_sha256 or file_sha256(image_path))
+
+
+def make_cache_key(image_path: str, prompt: str, model: str, image_sha256: str | None = None) -> str:
+    h = hashlib.sha256()
+    for part in (image_fingerprint(image_path, image_sha256), prompt, model):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, memory_items=256):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None  # 首次写入时再统计
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return text
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)  # 刷新 mtime，作为 LRU 依据
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        self._remember(key, text)
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        self._remember(key, text)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        # 覆盖已有条目时只计入大小的差值
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)  # 原子替换，避免并发读到半个文件
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan()[1]
+            else:
+                self._disk_bytes += os.path.getsize(path) - old_size
+            over_budget = self._disk_bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def _scan(self):
+        entries, total = [], 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".txt"):
+                    continue
+                p = os.path.join(root, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+        return entries, total
+
+    def _evict(self):
+        """按 mtime 从旧到新删除，直到总大小降到上限的 90%。"""
+        entries, total = self._scan()
+        entries.sort()
+        target = int(self.max_bytes * 0.9)
+        for _, size, p in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(p)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+
+def create_analysis_cache():
+    """
+    根据环境变量创建缓存；ANALYSIS_CACHE=0 时返回 None（关闭缓存）。
+    - ANALYSIS_CACHE_DIR：默认 output/cache/analysis
+    - ANALYSIS_CACHE_MAX_MB：磁盘上限，默认 512
+    - ANALYSIS_CACHE_MEMORY_ITEMS：内存热层条目数，默认 256
+    """
+    if os.environ.get("ANALYSIS_CACHE", "1") == "0":
+        return None
+    return AnalysisCache(
+        os.environ.get("ANALYSIS_CACHE_DIR", os.path.join("output", "cache", "analysis")),
+        max_bytes=int(os.environ.get("ANALYSIS_CACHE_MAX_MB", "512")) * 1024 * 1024,
+        memory_items=int(os.environ.get("ANALYSIS_CACHE_MEMORY_ITEMS", "256")),
+    )
@@ -1,80 +1,306 @@
 import os
 import sys
+import json
+import hmac
+import asyncio
 import tempfile
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for
-from werkzeug.utils import secure_filename
-from ali_api import analyze_image
-from pdf import generate_pdf_from_txt
+from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, Response, stream_with_context, g
+from werkzeug.middleware.proxy_fix import ProxyFix
+from ali_api import analyze_report, analyze_report_async, stream_analysis, save_report, gateway
+from pdf import generate_pdf, warm_pdf_assets
+from report import IncrementalSectionParser, Report, json_path_for
+from task_store import create_task_store
+from pdf_workers import install_render_pool
+from uploads import ImageSource, UnsupportedImageError, receive_upload, compress_upload
+from batch import BatchJob, ManifestError, normalize_items, parse_manifest, parse_parallelism
+from downloads import send_download, is_digest_file
+import artifacts
+from artifacts import store as artifact_store
+from remote_images import prefetch as prefetch_remote_image
+from async_runtime import create_async_runtime
+from admission import ADMISSION_WAIT_TIMEOUT, Saturated, create_scheduler
+import time
 import uuid
-from PIL import Image
-import io
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import profiling
+import contextvars
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'flower-of-life-secret-key'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 最大16MB文件
+# 部署在反向代理后面时设置 PROXY_FIX_HOPS（代理层数），request.remote_addr 取 X-Forwarded-For 中的客户端地址
+PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', '0'))
+if PROXY_FIX_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS)
+# 可以代客户端声明 X-Client-Id 的网关地址（逗号分隔的 IP，按直连的对端地址判断）；默认不采信该头
+TRUSTED_PROXIES = frozenset(filter(None, (p.strip() for p in os.environ.get('TRUSTED_PROXIES', '').split(','))))
+# 按需剖析与剖析结果接口的管理令牌（请求头 X-Profile-Token）；未设置时只有 TRUSTED_PROXIES 可用
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', '')
 
 # 确保output目录存在
 if not os.path.exists('output'):
     os.makedirs('output')
 
-# 存储分析任务的状态
-analysis_tasks = {}
+# 预加载 PDF 字体与背景图（进程内只加载一次）
+warm_pdf_assets()
+# PDF 渲染进程池（PDF_WORKERS=0 时在请求线程内渲染）
+install_render_pool()
 
-def compress_image_if_needed(image_path, max_size_bytes=10 * 1024 * 1024):
+# 存储分析任务的状态（默认 SQLite，多个 worker 进程共享；见 task_store.py）
+task_store = create_task_store()
+
+# 生成文件的分片存储与后台清理（见 artifacts.py）
+artifact_store.start_sweeper()
+metrics.register_collector(artifacts.collect_metrics)
+
+# 后台分析：默认在事件循环中以协程运行（ANALYSIS_MODE=async，等待模型时不占线程，见 async_runtime.py）；
+# ANALYSIS_MODE=thread 时使用线程池，每个进行中的分析占一个线程，并发数可通过环境变量调整
+analysis_runtime = create_async_runtime()
+if analysis_runtime is not None:
+    analysis_runtime.start()
+    metrics.register_collector(analysis_runtime.collect_metrics)
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', '8'))
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='analysis')
+# 批量任务：同时运行的批次数（每个批次内部再按 parallelism 并发处理条目）
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '2'))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch-runner')
+
+# 准入控制：所有分析先经调度器排队（有界、按客户端公平、Web 优先），过载时返回 503（见 admission.py）。
+# 默认并发为模型并发上限的 2 倍（部分任务处于压缩 / 渲染阶段）；线程池模式下不超过线程数
+default_max_active = 2 * gateway.slots.limit
+if analysis_runtime is None:
+    default_max_active = min(default_max_active, ANALYSIS_WORKERS)
+scheduler = create_scheduler(default_max_active)
+metrics.register_collector(scheduler.collect_metrics)
+
+def from_trusted_proxy():
+    """直连的对端（ProxyFix 还原之前的 REMOTE_ADDR）是否在 TRUSTED_PROXIES 中。"""
+    peer = request.environ.get('werkzeug.proxy_fix.orig', request.environ).get('REMOTE_ADDR')
+    return peer in TRUSTED_PROXIES
+
+def client_key():
     """
-    如果图片超过指定大小，则进行压缩
+    公平调度用的客户端标识：来源 IP（经 PROXY_FIX_HOPS 还原）。请求直接来自 TRUSTED_PROXIES 中的网关时，
+    采信网关设置的 X-Client-Id；其他来源的该头以及表单中的姓名等都由调用方随意填写，不能用来换取新的排队名额。
     """
-    if not os.path.exists(image_path):
-        return image_path
-    
-    # 检查文件大小
-    file_size = os.path.getsize(image_path)
-    if file_size <= max_size_bytes:
-        return image_path  # 文件大小已经在限制内
-    
-    try:
-        # 打开图片
-        with Image.open(image_path) as img:
-            # 转换为RGB模式（如果需要）
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
-            
-            # 计算压缩比例
-            # 我们需要将文件大小压缩到max_size_bytes以下
-            # 这里使用一个简化的计算方法
-            quality = 85
-            while quality > 10:
-                # 保存到内存缓冲区
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=quality, optimize=True)
-                size = buffer.tell()
-                
-                if size <= max_size_bytes:
-                    # 保存压缩后的图片
-                    compressed_path = image_path.replace('.', '_compressed.')
-                    with open(compressed_path, 'wb') as f:
-                        f.write(buffer.getvalue())
-                    return compressed_path
-                else:
-                    quality -= 5  # 降低质量继续尝试
-            
-            # 如果即使质量降到10 still太大，强制调整尺寸
-            width, height = img.size
-            ratio = (max_size_bytes / file_size) ** 0.5 * 0.9  # 留一些余量
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            
-            # 重采样图片
-            img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # 保存压缩后的图片
-            compressed_path = image_path.replace('.', '_compressed.')
-            img_resized.save(compressed_path, 'JPEG', quality=70, optimize=True)
-            return compressed_path
-                
-    except Exception as e:
-        print(f"图片压缩失败: {e}")
-        return image_path  # 返回原始路径，让后续处理决定
+    client_id = request.headers.get('X-Client-Id')
+    if client_id and from_trusted_proxy():
+        return f"id:{client_id}"
+    return request.remote_addr or 'unknown'
+
+def profiling_allowed():
+    """
+    按需剖析与剖析结果只对受信任的调用方开放：带有正确的 X-Profile-Token（PROFILE_ADMIN_TOKEN），
+    或直接来自 TRUSTED_PROXIES 中的网关（网关需自行过滤外部客户端的 X-Profile 头与 profile 参数）。
+    剖析开销大且结果包含内部实现细节，不能让匿名客户端随意触发或查看。
+    """
+    token = request.headers.get('X-Profile-Token', '')
+    if PROFILE_ADMIN_TOKEN and hmac.compare_digest(token.encode('utf-8'), PROFILE_ADMIN_TOKEN.encode('utf-8')):
+        return True
+    return from_trusted_proxy()
+
+def busy_response(error, body=None):
+    """过载时的 503 响应，带 Retry-After。"""
+    response = jsonify(body or {"error": "服务繁忙", "message": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def collect_queue_metrics():
+    """后台线程池中等待执行的任务数。"""
+    yield "executor_queue_depth", "gauge", "线程池中等待执行的任务数", {"pool": "analysis"}, analysis_executor._work_queue.qsize()
+    yield "executor_queue_depth", "gauge", "线程池中等待执行的任务数", {"pool": "batch"}, batch_executor._work_queue.qsize()
+
+metrics.register_collector(collect_queue_metrics)
+
+# 请求级追踪与 HTTP 指标（METRICS_TRACE=1 时每个请求输出一行 JSON 追踪日志，见 metrics.py）
+@app.before_request
+def start_request_trace():
+    g.request_started = time.perf_counter()
+    g.trace_token = metrics.start_trace(request.endpoint or "unknown", method=request.method, path=request.path)
+    # PROFILE_ON_DEMAND=1 时，受信任的调用方（见 profiling_allowed）带 X-Profile: 1 头或 profile=1 参数的请求
+    # 会剖析其报告解析与 PDF 生成（见 profiling.py）
+    if (profiling.PROFILE_ON_DEMAND and (request.headers.get('X-Profile') == '1' or request.values.get('profile') == '1')
+            and profiling_allowed()):
+        g.profile_token = profiling.request_profiling()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    metrics.inc("http_requests_total", help="HTTP 请求数", endpoint=endpoint, method=request.method,
+                status=response.status_code)
+    metrics.observe("http_request_seconds", time.perf_counter() - g.request_started,
+                    help="HTTP 请求处理耗时（秒，流式响应只计到开始输出）", endpoint=endpoint)
+    trace_id = metrics.current_trace_id()
+    if trace_id:
+        response.headers['X-Trace-Id'] = trace_id
+    return response
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        metrics.finish_trace(token)
+    profile_token = g.pop('profile_token', None)
+    if profile_token is not None:
+        profiling.reset_request(profile_token)
+
+@app.route('/api/profiles')
+def list_profiles():
+    """
+    最近的剖析结果（需开启 PROFILE_SAMPLE_RATE 或 PROFILE_ON_DEMAND；只对受信任的调用方开放，见 profiling_allowed）
+    ---
+    tags:
+      - 诊断接口
+    responses:
+      200:
+        description: 返回 profiles 列表（profile_id、各阶段耗时、文件名），新的在前
+      403:
+        description: 调用方不受信任（缺少或错误的 X-Profile-Token）
+      404:
+        description: 未开启剖析
+    """
+    if not profiling_allowed():
+        return jsonify({"error": "无权访问", "message": "需要 X-Profile-Token"}), 403
+    if not profiling.ENABLED:
+        return jsonify({"error": "未开启", "message": "未开启性能剖析"}), 404
+    return jsonify({"profiles": profiling.list_profiles(request.args.get('limit', 20, type=int))})
+
+@app.route('/api/profiles/<profile_id>/<filename>')
+def download_profile(profile_id, filename):
+    """
+    下载剖析产物（parse.txt / parse.prof / render.txt / render.prof / meta.json）
+    ---
+    tags:
+      - 诊断接口
+    parameters:
+      - name: profile_id
+        in: path
+        type: string
+        required: true
+      - name: filename
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: 文件内容
+      403:
+        description: 调用方不受信任（缺少或错误的 X-Profile-Token）
+      404:
+        description: 不存在
+    """
+    if not profiling_allowed():
+        return jsonify({"error": "无权访问", "message": "需要 X-Profile-Token"}), 403
+    path = profiling.artifact_path(profile_id, filename) if profiling.ENABLED else None
+    if path is None:
+        return jsonify({"error": "文件不存在", "message": f"未找到剖析结果: {profile_id}/{filename}"}), 404
+    return send_file(os.path.abspath(path), as_attachment=filename.endswith('.prof'))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 文本格式的指标"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# 各阶段对应的进度（百分比）
+TASK_STAGES = {
+    "queued":     (0,   "任务已提交，等待处理"),
+    "compressing": (10, "正在压缩图片"),
+    "analyzing":  (20,  "正在调用AI模型分析图片"),
+    "rendering":  (80,  "正在生成PDF报告"),
+    "completed":  (100, "分析完成"),
+}
+
+def stage_fields(stage, **extra):
+    """返回切换到某阶段时需要写入的字段（状态、进度与提示信息）。"""
+    progress, message = TASK_STAGES[stage]
+    status = "completed" if stage == "completed" else ("queued" if stage == "queued" else "processing")
+    return dict(status=status, stage=stage, progress=progress, message=message, **extra)
+
+def set_task_stage(task_id, stage, **extra):
+    """切换任务阶段（一次写入）。"""
+    task_store.update(task_id, **stage_fields(stage, **extra))
+
+def finish_analysis_task(task_id, report, image):
+    """分析成功后的收尾：输出 TXT / JSON、生成 PDF、登记产物并标记完成（阻塞，异步模式下在线程池中执行）。"""
+    txt_file_path = save_report(report, image.path)
+
+    set_task_stage(task_id, "rendering")
+    pdf_file_path = generate_pdf(report, image.path)
+    artifact_store.assign(task_id, image.path, txt_file_path, json_path_for(txt_file_path), pdf_file_path)
+
+    set_task_stage(task_id, "completed", result={
+        "txt_file": os.path.basename(txt_file_path),
+        "pdf_file": os.path.basename(pdf_file_path),
+    })
+
+def run_analysis_task(task_id, image, name, prompt_override=None, queued_at=None):
+    """
+    后台执行完整的分析流程：压缩 -> AI 分析 -> 生成 PDF。
+    image 为 uploads.ImageSource；每个阶段都会写回 task_store，供 /api/task/<task_id> 轮询。
+    queued_at 为提交时的 time.perf_counter()，用于统计排队时间。
+    """
+    with metrics.trace("analysis_task", task_id=task_id):
+        if queued_at is not None:
+            metrics.record("queue_wait", time.perf_counter() - queued_at, queued_at)
+        try:
+            if not image.is_remote:
+                set_task_stage(task_id, "compressing")
+                original_size = image.size
+                image = compress_upload(image, max_size_bytes=10 * 1024 * 1024)  # 10MB限制
+                print(f"图片压缩: {original_size} bytes -> {image.size} bytes")
+
+            set_task_stage(task_id, "analyzing")
+            report, error = analyze_report(image.path, name, prompt_override, image=image)
+            if error:
+                task_store.update(task_id, status="failed", message=f"分析失败: {error}")
+                return
+            finish_analysis_task(task_id, report, image)
+        except Exception as e:
+            task_store.update(task_id, status="failed", message=f"处理过程中出错: {str(e)}")
+
+async def run_analysis_task_async(task_id, image, name, prompt_override=None, queued_at=None):
+    """
+    run_analysis_task 的协程版本（ANALYSIS_MODE=async）：模型调用经 analyze_report_async 挂起等待，
+    压缩、任务状态写入与收尾（写报告、渲染 PDF）经 asyncio.to_thread 在运行时的线程池中执行。
+    """
+    with metrics.trace("analysis_task", task_id=task_id):
+        if queued_at is not None:
+            metrics.record("queue_wait", time.perf_counter() - queued_at, queued_at)
+        try:
+            if not image.is_remote:
+                await asyncio.to_thread(set_task_stage, task_id, "compressing")
+                original_size = image.size
+                image = await asyncio.to_thread(compress_upload, image, 10 * 1024 * 1024)  # 10MB限制
+                print(f"图片压缩: {original_size} bytes -> {image.size} bytes")
+
+            await asyncio.to_thread(set_task_stage, task_id, "analyzing")
+            report, error = await analyze_report_async(image.path, name, prompt_override, image=image)
+            if error:
+                await asyncio.to_thread(task_store.update, task_id, status="failed", message=f"分析失败: {error}")
+                return
+            await asyncio.to_thread(finish_analysis_task, task_id, report, image)
+        except Exception as e:
+            await asyncio.to_thread(task_store.update, task_id, status="failed", message=f"处理过程中出错: {str(e)}")
+
+def submit_analysis(task_id, image, name, prompt_override=None, client=None):
+    """
+    经调度器（api 通道）提交分析任务，轮到时交给事件循环（异步模式）或线程池；排队已满时抛出 Saturated。
+    请求级设置（如按需剖析）随任务带到后台；排队中的任务不持有上传内容的映射，用到时再从文件读取。
+    """
+    ctx = contextvars.copy_context()
+    image = image.detach()
+    queued_at = time.perf_counter()
+    if analysis_runtime is not None:
+        def launch():
+            return ctx.run(analysis_runtime.submit, run_analysis_task_async,
+                           task_id, image, name, prompt_override, queued_at)
+    else:
+        def launch():
+            return analysis_executor.submit(ctx.run, run_analysis_task,
+                                            task_id, image, name, prompt_override, queued_at)
+    return scheduler.submit("api", client, launch)
 
 # 添加 favicon 路由
 @app.route('/favicon.ico')
@@ -115,8 +341,8 @@ def api_analyze():
         required: true
         description: 用户姓名
     responses:
-      200:
-        description: 分析成功，返回报告文件信息
+      202:
+        description: 任务已提交，通过 /api/task/{task_id} 查询进度与结果
         schema:
           id: AnalysisResult
           properties:
@@ -131,8 +357,8 @@ def api_analyze():
               description: 状态信息
       400:
         description: 请求参数错误
-      500:
-        description: 服务器内部错误
+      503:
+        description: 服务繁忙（排队已满），Retry-After 头给出建议的重试间隔（秒）
     """
     name = request.form.get('name')
     if not name:
@@ -142,95 +368,40 @@ def api_analyze():
         }), 400
     #读取可选提示词
     prompt_override = request.form.get('prompt', '').strip() or None
-    # # 调用时传入
-    # txt_file_path, error = analyze_image(image_path, name, prompt_override)
+    # 排队已满时在接收图片之前直接拒绝
+    client = client_key()
+    try:
+        scheduler.check("api", client)
+    except Saturated as e:
+        return busy_response(e)
 
-    # 处理图片输入
-    image_path = None
+    # 处理图片输入：上传文件按内容识别格式，边读边落盘，内容留在内存中供后续环节直接使用
     if 'image_url' in request.form and request.form['image_url']:
-        image_path = request.form['image_url']
+        image = ImageSource.from_url(request.form['image_url'])
+        # 模型分析期间在后台把图片取到本地，生成 PDF 时直接使用
+        prefetch_remote_image(image.path)
     elif 'image_file' in request.files and request.files['image_file'].filename != '':
-        # 处理上传的文件
-        file = request.files['image_file']
-        if file:
-            # 保存上传的文件到临时位置
-            filename = secure_filename(file.filename)
-            # 确保扩展名是正确的格式
-            base_name, ext = os.path.splitext(filename)
-            if ext and ext.lower() in ['.png', '.jpg', '.jpeg', '.bmp', '.gif']:
-                image_path = os.path.join('output', f"{uuid.uuid4()}{ext.lower()}")
-                file.save(image_path)
-            else:
-                if not ext:
-                    temp_filename = f"{uuid.uuid4()}_temp"
-                    file_path = os.path.join('output', temp_filename)
-                    file.save(file_path)
-                    try:
-                        with Image.open(file_path) as img:
-                            detected_type = img.format.lower()
-                    except Exception:
-                        detected_type = None
-                    if detected_type and detected_type in ['png', 'jpeg', 'gif', 'bmp']:
-                        correct_ext = '.' + detected_type if detected_type != 'jpeg' else '.jpg'
-                        final_path = file_path + correct_ext
-                        os.rename(file_path, final_path)
-                        image_path = final_path
-                    else:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                        return jsonify({"success": False,"error_message": "不支持的图片格式，只支持 PNG, JPG, JPEG, BMP, GIF 格式"})
-                else:
-                    return jsonify({"error": "参数错误","message": "不支持的图片格式，只支持 PNG, JPG, JPEG, BMP, GIF 格式"}), 400
+        try:
+            image = receive_upload(request.files['image_file'])
+        except UnsupportedImageError as e:
+            return jsonify({"error": "参数错误","message": str(e)}), 400
     else:
         return jsonify({"error": "参数错误","message": "必须提供图片URL或上传图片文件"}), 400
     
-    # 压缩图片（如果需要）
-    if image_path and os.path.exists(image_path):
-        original_size = os.path.getsize(image_path) if os.path.exists(image_path) else 0
-        image_path = compress_image_if_needed(image_path, max_size_bytes=10 * 1024 * 1024)  # 10MB限制
-        if os.path.exists(image_path):
-            compressed_size = os.path.getsize(image_path)
-            print(f"图片压缩: {original_size} bytes -> {compressed_size} bytes")
-    
-    # 生成任务ID
+    # 生成任务ID，提交到后台（事件循环或线程池）后立即返回（202），由客户端轮询任务状态
     task_id = str(uuid.uuid4())
-    analysis_tasks[task_id] = {
-        "status": "processing",
-        "message": "正在处理图片分析"
-    }
-    
+    task_store.create(task_id, **stage_fields("queued"))
     try:
-        # 仅调用一次，并且把可选提示词传递进去  —— FIX: 去重
-        # txt_file_path, error = analyze_image(image_path, name)  # (旧) 多余调用
-        txt_file_path, error = analyze_image(image_path, name, prompt_override)
+        submit_analysis(task_id, image, name, prompt_override, client)
+    except Saturated as e:
+        task_store.update(task_id, status="failed", message=str(e))
+        return busy_response(e)
 
-        if error:
-            analysis_tasks[task_id] = {"status": "failed","message": f"分析失败: {error}"}
-            return jsonify({"task_id": task_id,"status": "failed","message": f"分析失败: {error}"}), 500
-        
-        pdf_file_path = generate_pdf_from_txt(txt_file_path, image_path, name)
-        txt_filename = os.path.basename(txt_file_path)
-        pdf_filename = os.path.basename(pdf_file_path)
-        
-        analysis_tasks[task_id] = {
-            "status": "completed","message": "分析完成",
-            "txt_filename": txt_filename,"pdf_filename": pdf_filename
-        }
-        return jsonify({
-            "task_id": task_id,"status": "completed","message": "分析完成",
-            "result": {"txt_file": txt_filename,"pdf_file": pdf_filename}
-        })
-        
-    except Exception as e:
-        analysis_tasks[task_id] = {
-            "status": "failed",
-            "message": f"处理过程中出错: {str(e)}"
-        }
-        return jsonify({
-            "task_id": task_id,
-            "status": "failed",
-            "message": f"处理过程中出错: {str(e)}"
-        }), 500
+    return jsonify({
+        "task_id": task_id,
+        "status": "queued",
+        "message": TASK_STAGES["queued"][1]
+    }), 202
 
 @app.route('/api/task/<task_id>')
 def get_task_status(task_id):
@@ -257,6 +428,13 @@ def get_task_status(task_id):
               type: string
             status:
               type: string
+              description: queued / processing / completed / failed
+            stage:
+              type: string
+              description: 当前阶段（queued / compressing / analyzing / rendering / completed）
+            progress:
+              type: integer
+              description: 进度百分比
             message:
               type: string
             result:
@@ -269,16 +447,129 @@ def get_task_status(task_id):
       404:
         description: 任务不存在
     """
-    if task_id not in analysis_tasks:
+    task_info = task_store.get(task_id)
+    if task_info is None:
         return jsonify({
             "error": "任务不存在",
             "message": f"未找到任务ID: {task_id}"
         }), 404
     
-    task_info = analysis_tasks[task_id].copy()
     task_info["task_id"] = task_id
     return jsonify(task_info)
 
+def run_batch_job(job):
+    """后台运行批次，进度同步写入 task_store（键为 batch_id），供 /api/batch/<batch_id> 轮询。"""
+    def report(summary):
+        task_store.update(job.batch_id, status="processing", **summary)
+    try:
+        # 每个条目经调度器的 batch 通道占用名额（只等待、不拒绝），优先级低于 Web 与 API
+        summary = job.run(on_progress=report,
+                          admit=lambda: scheduler.hold("batch", job.batch_id, bounded=False))
+        task_store.update(job.batch_id, status="completed", **summary)
+    except Exception as e:
+        task_store.update(job.batch_id, status="failed", message=f"批量处理出错: {str(e)}")
+
+def submit_batch(job):
+    """提交批次到后台运行；并发数为批次创建时的设置（继续处理时沿用）。"""
+    task_store.create(job.batch_id, status="queued", **job.summary())
+    batch_executor.submit(run_batch_job, job)
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """
+    批量分析
+    ---
+    tags:
+      - 批量接口
+    description:
+      提交一批图片（清单），后台并发生成报告，完成后打包为一个 zip。
+      请求体为 JSON {"items":[{"name","image_url","prompt"}], "parallelism"}（parallelism 不超过 BATCH_MAX_PARALLELISM），
+      或以表单上传清单文件 manifest（.csv / .json / .jsonl）。图片只支持网络 URL。
+    responses:
+      202:
+        description: 批次已提交，通过 /api/batch/{batch_id} 查询进度
+      400:
+        description: 清单格式错误或 parallelism 不是整数
+    """
+    try:
+        if 'manifest' in request.files and request.files['manifest'].filename != '':
+            manifest = request.files['manifest']
+            fmt = os.path.splitext(manifest.filename)[1].lstrip('.').lower()
+            items = parse_manifest(manifest.read().decode('utf-8'), fmt)
+            parallelism = parse_parallelism(request.form.get('parallelism'))
+        else:
+            body = request.get_json(silent=True) or {}
+            items = normalize_items(body.get('items'))
+            parallelism = parse_parallelism(body.get('parallelism'))
+    except (ManifestError, ValueError) as e:
+        return jsonify({"error": "参数错误", "message": str(e)}), 400
+
+    # 接口只接受网络图片，避免读取服务器本地文件
+    for i, item in enumerate(items, 1):
+        if not (item['image'].startswith('http://') or item['image'].startswith('https://')):
+            return jsonify({"error": "参数错误", "message": f"第 {i} 条图片必须是 http(s) URL"}), 400
+
+    job = BatchJob.create(items, parallelism=parallelism)
+    submit_batch(job)
+    return jsonify({"batch_id": job.batch_id, "status": "queued", "total": len(items)}), 202
+
+@app.route('/api/batch/<batch_id>')
+def get_batch_status(batch_id):
+    """
+    获取批次进度
+    ---
+    tags:
+      - 批量接口
+    parameters:
+      - name: batch_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: 返回 total / completed / failed / pending / progress，完成后 zip_file 为结果包文件名
+      404:
+        description: 批次不存在
+    """
+    info = task_store.get(batch_id)
+    if info is None:
+        # 任务记录已过期（或服务重启前使用内存存储）时，从批次目录读取
+        job = BatchJob.load(batch_id)
+        if job is None:
+            return jsonify({"error": "批次不存在", "message": f"未找到批次: {batch_id}"}), 404
+        info = dict(job.summary(), status="completed" if not job.pending() else "interrupted")
+    info["batch_id"] = batch_id
+    return jsonify(info)
+
+@app.route('/api/batch/<batch_id>/resume', methods=['POST'])
+def resume_batch(batch_id):
+    """
+    继续处理批次中未完成（含失败）的条目
+    ---
+    tags:
+      - 批量接口
+    parameters:
+      - name: batch_id
+        in: path
+        type: string
+        required: true
+    responses:
+      202:
+        description: 已重新提交
+      404:
+        description: 批次不存在
+      409:
+        description: 批次正在处理中
+    """
+    info = task_store.get(batch_id)
+    if info is not None and info.get("status") in ("queued", "processing"):
+        return jsonify({"error": "批次处理中", "message": "批次正在处理，无需重复提交"}), 409
+    job = BatchJob.load(batch_id)
+    if job is None:
+        return jsonify({"error": "批次不存在", "message": f"未找到批次: {batch_id}"}), 404
+    submit_batch(job)
+    return jsonify({"batch_id": batch_id, "status": "queued", "pending": len(job.pending())}), 202
+
 @app.route('/api/download/<filename>')
 def download_file(filename):
     """
@@ -301,9 +592,10 @@ def download_file(filename):
         description: 文件不存在
     """
     try:
-        file_path = os.path.join('output', filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+        file_path = artifact_store.locate(filename)
+        if file_path and not is_digest_file(filename):
+            artifact_store.touch(file_path)
+            return send_download(file_path)
         else:
             return jsonify({
                 "error": "文件不存在",
@@ -316,79 +608,147 @@ def download_file(filename):
         }), 500
 
 # Web界面路由
+def resolve_web_image():
+    """
+    解析 Web 表单中的图片（URL 或上传文件），上传文件保存到存储中（见 artifacts.py）并按需压缩。
+    返回 (image, error_message)，image 为 uploads.ImageSource，两者之一为 None。
+    """
+    if request.form.get('image_option') == 'url':
+        image_url = request.form.get('image_url')
+        if not image_url:
+            return None, "请输入图片URL"
+        prefetch_remote_image(image_url)
+        return ImageSource.from_url(image_url), None
+
+    if 'image_file' not in request.files:
+        return None, "请选择图片文件"
+    file = request.files['image_file']
+    if file.filename == '':
+        return None, "请选择图片文件"
+    try:
+        image = receive_upload(file)
+    except UnsupportedImageError as e:
+        return None, str(e)
+
+    original_size = image.size
+    image = compress_upload(image, max_size_bytes=10 * 1024 * 1024)
+    print(f"图片压缩: {original_size} bytes -> {image.size} bytes")
+    return image, None
+
+def save_web_report(report, image):
+    """
+    Web 页面的收尾：输出 TXT / JSON、生成 PDF，并像 API 任务一样登记产物（见 finish_analysis_task），
+    所属 ID 为 web- 加随机串（Web 请求没有任务 ID）。返回 (TXT 路径, PDF 路径)。
+    """
+    txt_file_path = save_report(report, image.path)
+    pdf_file_path = generate_pdf(report, image.path)
+    artifact_store.assign(f"web-{uuid.uuid4().hex}", image.path, txt_file_path, json_path_for(txt_file_path),
+                          pdf_file_path)
+    return txt_file_path, pdf_file_path
+
 @app.route('/web/analyze', methods=['POST'])
 def web_analyze():
     user_name = request.form.get('name', '未知用户')
-    
-    image_path = None
-    if request.form.get('image_option') == 'url':
-        image_path = request.form.get('image_url')
-        if not image_path:
-            return jsonify({"success": False, "error_message": "请输入图片URL"})
-    else:
-        if 'image_file' not in request.files:
-            return jsonify({"success": False, "error_message": "请选择图片文件"})
-        file = request.files['image_file']
-        if file.filename == '':
-            return jsonify({"success": False, "error_message": "请选择图片文件"})
-        if file:
-            filename = secure_filename(file.filename)
-            base_name, ext = os.path.splitext(filename)   # <-- 修正：不要用 name 覆盖
-            if ext and ext.lower() in ['.png', '.jpg', '.jpeg', '.bmp', '.gif']:
-                image_path = os.path.join('output', f"{uuid.uuid4()}{ext.lower()}")
-                file.save(image_path)
-            else:
-                if not ext:
-                    temp_filename = f"{uuid.uuid4()}_temp"
-                    file_path = os.path.join('output', temp_filename)
-                    file.save(file_path)
-                    try:
-                        with Image.open(file_path) as img:
-                            detected_type = img.format.lower()
-                    except Exception:
-                        detected_type = None
-                    if detected_type and detected_type in ['png', 'jpeg', 'gif', 'bmp']:
-                        correct_ext = '.' + detected_type if detected_type != 'jpeg' else '.jpg'
-                        final_path = file_path + correct_ext
-                        os.rename(file_path, final_path)
-                        image_path = final_path
-                    else:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                        return jsonify({"success": False,"error_message": "不支持的图片格式，只支持 PNG, JPG, JPEG, BMP, GIF 格式"})
-                else:
-                    return jsonify({"success": False, "error_message": "不支持的图片格式，只支持 PNG, JPG, JPEG, BMP, GIF 格式"})
-    
-    if image_path and os.path.exists(image_path):
-        original_size = os.path.getsize(image_path)
-        image_path = compress_image_if_needed(image_path, max_size_bytes=10 * 1024 * 1024)
-        if os.path.exists(image_path):
-            compressed_size = os.path.getsize(image_path)
-            print(f"图片压缩: {original_size} bytes -> {compressed_size} bytes")
-    
-    # 读取可选提示词，并只调用一次 analyze_image —— FIX: 去重
-    prompt_override = (request.form.get('prompt') or '').strip() or None
-    # txt_file_path, error = analyze_image(image_path, user_name)  # (旧) 多余调用
-    txt_file_path, error = analyze_image(image_path, user_name, prompt_override)
+    try:
+        ticket = scheduler.hold("web", client_key(), timeout=ADMISSION_WAIT_TIMEOUT)
+    except Saturated as e:
+        return busy_response(e, {"success": False, "error_message": str(e)})
 
-    if error:
-        return jsonify({"success": False, "error_message": error})
-    
+    with ticket:
+        image, error_message = resolve_web_image()
+        if error_message:
+            return jsonify({"success": False, "error_message": error_message})
+
+        # 读取可选提示词，并只调用一次 analyze_report —— FIX: 去重
+        prompt_override = (request.form.get('prompt') or '').strip() or None
+        report, error = analyze_report(image.path, user_name, prompt_override, image=image)
+
+        if error:
+            return jsonify({"success": False, "error_message": error})
+
+        try:
+            txt_file_path, pdf_file_path = save_web_report(report, image)
+            txt_filename = os.path.basename(txt_file_path)
+            pdf_filename = os.path.basename(pdf_file_path)
+            return jsonify({"success": True, "txt_filename": txt_filename, "pdf_filename": pdf_filename})
+        except Exception as e:
+            return jsonify({"success": False, "error_message": f"生成PDF时出错: {str(e)}"})
+
+def sse_event(event, data):
+    """格式化一条 Server-Sent Events 消息。"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/web/analyze/stream', methods=['POST'])
+def web_analyze_stream():
+    """
+    流式分析：以 text/event-stream 返回，模型每写完一个章节（出现下一个 “N.” 标题时）即推送一次。
+    事件：section {title, content} / done {txt_filename, pdf_filename} / error {error_message}
+    """
+    user_name = request.form.get('name', '未知用户')
     try:
-        pdf_file_path = generate_pdf_from_txt(txt_file_path, image_path, user_name)
-        txt_filename = os.path.basename(txt_file_path)
-        pdf_filename = os.path.basename(pdf_file_path)
-        return jsonify({"success": True, "txt_filename": txt_filename, "pdf_filename": pdf_filename})
-    except Exception as e:
-        return jsonify({"success": False, "error_message": f"生成PDF时出错: {str(e)}"})
+        ticket = scheduler.hold("web", client_key(), timeout=ADMISSION_WAIT_TIMEOUT)
+    except Saturated as e:
+        return Response(sse_event("error", {"error_message": str(e)}), status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(e.retry_after)})
+    try:
+        image, error_message = resolve_web_image()
+    except BaseException:
+        ticket.release()
+        raise
+    if error_message:
+        ticket.release()
+        return Response(sse_event("error", {"error_message": error_message}), mimetype='text/event-stream')
+    prompt_override = (request.form.get('prompt') or '').strip() or None
+
+    def generate():
+        with metrics.trace("web_analyze_stream"):
+            yield from generate_events()
+
+    def generate_events():
+        parser = IncrementalSectionParser()
+        chunks = []
+        # 被选中剖析时只累计解析本身的耗时（不含等待模型输出），见 profiling.StageProfile
+        profile_id = profiling.new_profile_id() if profiling.should_profile() else None
+        parse_profile = profiling.StageProfile(profile_id, "parse", report=user_name)
+        try:
+            for delta in stream_analysis(image.path, prompt_override, image=image):
+                chunks.append(delta)
+                with parse_profile:
+                    sections = parser.feed(delta)
+                for title, content in sections:
+                    yield sse_event("section", {"title": title, "content": content})
+            with parse_profile:
+                sections = parser.finish()
+            for title, content in sections:
+                yield sse_event("section", {"title": title, "content": content})
+
+            # 章节已在推送过程中解析完毕，直接由解析器构造报告
+            with parse_profile:
+                report = Report.from_parser(parser, ''.join(chunks), user_name)
+            parse_profile.save()
+            report.profile_id = profile_id
+            txt_file_path, pdf_file_path = save_web_report(report, image)
+            yield sse_event("done", {
+                "txt_filename": os.path.basename(txt_file_path),
+                "pdf_filename": os.path.basename(pdf_file_path),
+            })
+        except Exception as e:
+            yield sse_event("error", {"error_message": f"分析失败: {str(e)}"})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 名额一直占到流式输出结束（客户端断开时也会释放）
+    response.call_on_close(ticket.release)
+    return response
 
 @app.route('/web/download/<filename>')
 def web_download_file(filename):
     """Web界面文件下载"""
     try:
-        file_path = os.path.join('output', filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+        file_path = artifact_store.locate(filename)
+        if file_path and not is_digest_file(filename):
+            artifact_store.touch(file_path)
+            return send_download(file_path)
         else:
             return "文件不存在", 404
     except Exception as e:
@@ -452,29 +812,19 @@ def swagger_json():
                         }
                     ],
                     "responses": {
-                        "200": {
-                            "description": "分析成功，返回报告文件信息",
+                        "202": {
+                            "description": "任务已提交，通过 /task/{task_id} 查询进度与结果",
                             "schema": {
                                 "type": "object",
                                 "properties": {
                                     "task_id": {"type": "string"},
                                     "status": {"type": "string"},
-                                    "message": {"type": "string"},
-                                    "result": {
-                                        "type": "object",
-                                        "properties": {
-                                            "txt_file": {"type": "string"},
-                                            "pdf_file": {"type": "string"}
-                                        }
-                                    }
+                                    "message": {"type": "string"}
                                 }
                             }
                         },
                         "400": {
                             "description": "请求参数错误"
-                        },
-                        "500": {
-                            "description": "服务器内部错误"
                         }
                     }
                 }
@@ -501,6 +851,8 @@ def swagger_json():
                                 "properties": {
                                     "task_id": {"type": "string"},
                                     "status": {"type": "string"},
+                                    "stage": {"type": "string"},
+                                    "progress": {"type": "integer"},
                                     "message": {"type": "string"},
                                     "result": {
                                         "type": "object",
@@ -546,4 +898,5 @@ def swagger_json():
     })
 
 if __name__ == '__main__':
+    # 仅用于本地开发；生产环境使用 gunicorn（见 gunicorn.conf.py）：gunicorn -c gunicorn.conf.py app:app
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,392 @@
+# artifacts.py
+"""
+生成文件的存放、索引与定期清理。
+
+原先上传图片、压缩副本、TXT / JSON / PDF 报告和批量结果包都平铺在 output/ 下且从不清理，
+文件数上到几十万后列目录、按文件名查找都会变慢。现在统一放在 ARTIFACT_DIR（默认 output/artifacts）下：
+- uploads/<aa>/<bb>/<sha256><扩展名>：上传图片按内容寻址，相同内容只存一份；
+  压缩副本 <sha256>_compressed.jpg 放在同一目录，同一张大图再次上传时直接复用，不再压缩；
+- reports/<aa>/<bb>/<文件名>：报告与结果包，aa/bb 取“去掉扩展名的文件名”的 sha1 前四位，
+  同一份报告的 TXT 与 JSON 在同一目录；按文件名即可算出位置，下载时不需要列目录；
+- index.db：SQLite 索引，每个文件一行（大小、写入与最后访问时间），另记录任务 / 批次与文件的对应关系；
+- tmp/：写入中的临时文件。
+downloads.py 的 .etag 记录与文件放在一起，清理时一并删除。
+
+清理（sweep）：先删除最后访问超过 ARTIFACT_MAX_AGE_DAYS 天的文件，再按最后访问时间从旧到新删除，
+直到总大小不超过 ARTIFACT_MAX_MB 的 90%；最近 ARTIFACT_GRACE_SECONDS 秒内写入或访问过的文件不删
+（处理中的任务还要读取）。服务进程内由后台线程每 ARTIFACT_SWEEP_INTERVAL 秒检查一次，
+多个进程共用索引中的时间戳，同一时段只有一个进程执行。
+
+升级前平铺在 output/ 下的旧文件仍可下载；`python artifacts.py migrate` 把它们移入分片目录并建立索引。
+命令行：
+    python artifacts.py stats
+    python artifacts.py sweep
+    python artifacts.py show <任务ID / 批次ID>
+    python artifacts.py migrate
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+from downloads import DIGEST_SUFFIX
+
+UPLOADS, REPORTS = "uploads", "reports"
+KINDS = (UPLOADS, REPORTS)
+LEGACY_DIR = "output"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+REPORT_EXTENSIONS = (".txt", ".json", ".pdf", ".zip")
+EVICT_TARGET = 0.9
+
+
+class ArtifactStore:
+    def __init__(self, root, max_bytes=10 * 1024 ** 3, max_age_seconds=30 * 86400,
+                 grace_seconds=3600, sweep_interval=600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.grace_seconds = grace_seconds
+        self.sweep_interval = sweep_interval
+        self.db_path = os.path.join(root, "index.db")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self._abs_root = os.path.abspath(root)
+        self._local = threading.local()
+        self._sweeper = None
+
+    # —— 索引 ——
+    def _conn(self):
+        # sqlite3 连接不能跨线程共享，每个线程各持一个；首次连接时建表（渲染进程中也可能先于服务进程）
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(self.tmp_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    kind        TEXT NOT NULL,
+                    name        TEXT NOT NULL,
+                    size        INTEGER NOT NULL,
+                    created_at  REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (kind, name)
+                );
+                CREATE INDEX IF NOT EXISTS idx_artifacts_accessed ON artifacts(accessed_at);
+                CREATE TABLE IF NOT EXISTS artifact_owners (
+                    owner TEXT NOT NULL,
+                    kind  TEXT NOT NULL,
+                    name  TEXT NOT NULL,
+                    PRIMARY KEY (owner, kind, name)
+                );
+                CREATE INDEX IF NOT EXISTS idx_artifact_owners_file ON artifact_owners(kind, name);
+                CREATE TABLE IF NOT EXISTS artifact_meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+                """
+            )
+            self._local.conn = conn
+        return conn
+
+    # —— 路径 ——
+    def path(self, kind, name):
+        """kind / name 对应的文件路径（只计算，不创建目录）。"""
+        if kind == UPLOADS:
+            key = name  # 以内容哈希开头
+        else:
+            key = hashlib.sha1(os.path.splitext(name)[0].encode("utf-8")).hexdigest()
+        return os.path.join(self.root, kind, key[:2], key[2:4], name)
+
+    def _writable_path(self, kind, name):
+        path = self.path(kind, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def report_path(self, filename):
+        """报告 / 结果包的写入路径（分片目录按需创建）。"""
+        return self._writable_path(REPORTS, filename)
+
+    def upload_path(self, name):
+        """上传图片（及其压缩副本）的写入路径（分片目录按需创建）。"""
+        return self._writable_path(UPLOADS, name)
+
+    def temp_path(self, suffix=""):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}{suffix}")
+
+    def _key(self, path):
+        """由文件路径得到 (kind, name)；不在本存储中时返回 None。"""
+        rel = os.path.relpath(os.path.abspath(path), self._abs_root)
+        parts = rel.split(os.sep)
+        if len(parts) == 4 and parts[0] in KINDS:
+            return parts[0], parts[3]
+        return None
+
+    def relative_path(self, path):
+        """文件相对于存储根目录的路径（用 / 分隔，如 reports/aa/bb/<文件名>）；不在本存储中时返回 None。"""
+        key = self._key(path)
+        if key is None:
+            return None
+        return os.path.relpath(os.path.abspath(path), self._abs_root).replace(os.sep, "/")
+
+    def locate(self, filename):
+        """按文件名查找可下载的报告文件：先查分片目录，再查旧的平铺目录（只限报告类扩展名）；不存在时返回 None。"""
+        if not filename or os.sep in filename or filename.startswith("."):
+            return None
+        path = self.path(REPORTS, filename)
+        if os.path.isfile(path):
+            return path
+        legacy = os.path.join(LEGACY_DIR, filename)
+        if os.path.splitext(filename)[1].lower() in REPORT_EXTENSIONS and os.path.isfile(legacy):
+            return legacy
+        return None
+
+    # —— 写入与访问 ——
+    def add(self, path, owner=None):
+        """登记已写好的文件（重复登记时更新大小与访问时间）；owner 为所属任务 / 批次 ID。"""
+        key = self._key(path)
+        if key is None:
+            return
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO artifacts (kind, name, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(kind, name) DO UPDATE SET size = excluded.size, accessed_at = excluded.accessed_at",
+                (*key, os.path.getsize(path), now, now),
+            )
+            if owner:
+                conn.execute("INSERT OR IGNORE INTO artifact_owners (owner, kind, name) VALUES (?, ?, ?)",
+                             (owner, *key))
+        except (OSError, sqlite3.Error) as e:
+            print(f"警告: 登记文件失败 {path}: {e}")
+
+    def put_upload(self, tmp_path, sha256, ext):
+        """把写好的上传临时文件放入内容寻址目录；已有相同内容时丢弃临时文件。返回最终路径。"""
+        path = self.upload_path(f"{sha256}{ext}")
+        if os.path.isfile(path):
+            os.remove(tmp_path)
+            metrics.inc("artifact_dedup_total", help="内容相同、复用已存文件的上传数")
+        else:
+            os.replace(tmp_path, path)
+        self.add(path)
+        return path
+
+    def assign(self, owner, *paths):
+        """记录任务 / 批次与其文件的对应关系。"""
+        rows = [(owner, *key) for key in map(self._key, filter(None, paths)) if key]
+        if rows:
+            try:
+                self._conn().executemany(
+                    "INSERT OR IGNORE INTO artifact_owners (owner, kind, name) VALUES (?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                print(f"警告: 记录任务文件失败 {owner}: {e}")
+
+    def touch(self, path):
+        """刷新最后访问时间（下载、复用时调用），作为清理的依据。"""
+        key = self._key(path)
+        if key is None:
+            return
+        try:
+            self._conn().execute("UPDATE artifacts SET accessed_at = ? WHERE kind = ? AND name = ?",
+                                 (time.time(), *key))
+        except sqlite3.Error as e:
+            print(f"警告: 更新访问时间失败 {path}: {e}")
+
+    # —— 查询 ——
+    def artifacts_for(self, owner):
+        """任务 / 批次的文件列表 [{kind, name, path, size, created_at, accessed_at}]。"""
+        rows = self._conn().execute(
+            "SELECT a.kind, a.name, a.size, a.created_at, a.accessed_at FROM artifact_owners o "
+            "JOIN artifacts a ON a.kind = o.kind AND a.name = o.name WHERE o.owner = ? ORDER BY a.created_at",
+            (owner,),
+        ).fetchall()
+        return [{"kind": kind, "name": name, "path": self.path(kind, name), "size": size,
+                 "created_at": created_at, "accessed_at": accessed_at}
+                for kind, name, size, created_at, accessed_at in rows]
+
+    def stats(self):
+        """{kind: (文件数, 字节数)}"""
+        rows = self._conn().execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM artifacts GROUP BY kind")
+        result = {kind: (0, 0) for kind in KINDS}
+        result.update({kind: (count, size) for kind, count, size in rows})
+        return result
+
+    # —— 清理 ——
+    def _remove(self, kind, name):
+        path = self.path(kind, name)
+        freed = 0
+        for p in (path, path + DIGEST_SUFFIX):
+            try:
+                freed += os.path.getsize(p)
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+        conn = self._conn()
+        conn.execute("DELETE FROM artifacts WHERE kind = ? AND name = ?", (kind, name))
+        conn.execute("DELETE FROM artifact_owners WHERE kind = ? AND name = ?", (kind, name))
+        return freed
+
+    def sweep(self):
+        """按保留期限与总大小上限删除文件，返回 (删除文件数, 释放字节数)。"""
+        conn = self._conn()
+        now = time.time()
+        protected_since = now - self.grace_seconds
+        victims = []
+        if self.max_age_seconds > 0:
+            victims = conn.execute(
+                "SELECT kind, name, size FROM artifacts WHERE accessed_at < ? AND accessed_at < ?",
+                (now - self.max_age_seconds, protected_since),
+            ).fetchall()
+        if self.max_bytes > 0:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            total -= sum(size for _, _, size in victims)
+            if total > self.max_bytes:
+                expired = {(kind, name) for kind, name, _ in victims}
+                target = int(self.max_bytes * EVICT_TARGET)
+                for kind, name, size in conn.execute(
+                        "SELECT kind, name, size FROM artifacts WHERE accessed_at < ? ORDER BY accessed_at",
+                        (protected_since,)).fetchall():
+                    if total <= target:
+                        break
+                    if (kind, name) not in expired:
+                        victims.append((kind, name, size))
+                        total -= size
+        removed, freed = 0, 0
+        for kind, name, _ in victims:
+            try:
+                freed += self._remove(kind, name)
+                removed += 1
+            except (OSError, sqlite3.Error) as e:
+                print(f"警告: 清理文件失败 {kind}/{name}: {e}")
+        self._sweep_tmp(protected_since)
+        if removed:
+            print(f"清理生成文件: 删除 {removed} 个，释放 {freed / 1024 / 1024:.1f}MB")
+        metrics.inc("artifact_swept_files_total", removed, help="清理删除的生成文件数")
+        metrics.inc("artifact_swept_bytes_total", freed, help="清理释放的字节数")
+        return removed, freed
+
+    def _sweep_tmp(self, before):
+        """删除中断写入留下的临时文件。"""
+        try:
+            names = os.listdir(self.tmp_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            p = os.path.join(self.tmp_dir, name)
+            try:
+                if os.path.getmtime(p) < before:
+                    os.remove(p)
+            except OSError:
+                pass
+
+    def sweep_if_due(self):
+        """距上次清理（任一进程）超过 sweep_interval 时执行一次；由索引中的时间戳保证同一时段只有一个进程执行。"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO artifact_meta (key, value) VALUES ('last_sweep', 0)")
+        claimed = conn.execute("UPDATE artifact_meta SET value = ? WHERE key = 'last_sweep' AND value <= ?",
+                               (now, now - self.sweep_interval)).rowcount
+        if claimed:
+            return self.sweep()
+        return None
+
+    def start_sweeper(self):
+        """启动后台清理线程（每个进程一个，重复调用无效）。"""
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+        def loop():
+            while True:
+                try:
+                    self.sweep_if_due()
+                except Exception as e:
+                    print(f"清理生成文件出错: {e}")
+                time.sleep(self.sweep_interval)
+        self._sweeper = threading.Thread(target=loop, name="artifact-sweeper", daemon=True)
+        self._sweeper.start()
+
+    # —— 旧文件迁移 ——
+    def migrate(self, legacy_dir=LEGACY_DIR):
+        """把平铺在 legacy_dir 下的报告与上传图片移入分片目录并登记，返回移动的文件数。"""
+        moved = 0
+        for name in sorted(os.listdir(legacy_dir)):
+            src = os.path.join(legacy_dir, name)
+            ext = os.path.splitext(name)[1].lower()
+            if not os.path.isfile(src):
+                continue
+            if ext in REPORT_EXTENSIONS:
+                dst = self.report_path(name)
+                os.replace(src, dst)
+                if os.path.exists(src + DIGEST_SUFFIX):
+                    os.replace(src + DIGEST_SUFFIX, dst + DIGEST_SUFFIX)
+                self.add(dst)
+            elif ext in IMAGE_EXTENSIONS:
+                h = hashlib.sha256()
+                with open(src, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        h.update(chunk)
+                self.put_upload(src, h.hexdigest(), ".jpg" if ext == ".jpeg" else ext)
+            else:
+                continue
+            moved += 1
+        return moved
+
+
+def create_artifact_store():
+    """
+    根据环境变量创建存储：
+    - ARTIFACT_DIR：根目录，默认 output/artifacts
+    - ARTIFACT_MAX_MB：总大小上限，默认 10240，0 表示不限
+    - ARTIFACT_MAX_AGE_DAYS：最后访问后的保留天数，默认 30，0 表示不限
+    - ARTIFACT_GRACE_SECONDS：最近写入 / 访问的文件不清理的时长，默认 3600
+    - ARTIFACT_SWEEP_INTERVAL：后台清理间隔（秒），默认 600，0 表示不启动后台清理
+    """
+    return ArtifactStore(
+        os.environ.get("ARTIFACT_DIR", os.path.join("output", "artifacts")),
+        max_bytes=int(os.environ.get("ARTIFACT_MAX_MB", "10240")) * 1024 * 1024,
+        max_age_seconds=float(os.environ.get("ARTIFACT_MAX_AGE_DAYS", "30")) * 86400,
+        grace_seconds=float(os.environ.get("ARTIFACT_GRACE_SECONDS", "3600")),
+        sweep_interval=float(os.environ.get("ARTIFACT_SWEEP_INTERVAL", "600")),
+    )
+
+
+# 进程内共用的存储（服务、渲染进程、批量命令行都使用同一目录与索引）
+store = create_artifact_store()
+
+
+def collect_metrics():
+    """导出各类文件的数量与总大小（见 metrics.register_collector）。"""
+    for kind, (count, size) in store.stats().items():
+        yield "artifact_files", "gauge", "存储中的生成文件数", {"kind": kind}, count
+        yield "artifact_bytes", "gauge", "存储中的生成文件总字节数", {"kind": kind}, size
+
+
+def main():
+    ap = argparse.ArgumentParser(description="生成文件存储：统计、清理与迁移")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="各类文件的数量与总大小")
+    sub.add_parser("sweep", help="立即按保留期限与大小上限清理")
+    show = sub.add_parser("show", help="任务 / 批次对应的文件")
+    show.add_argument("owner")
+    migrate = sub.add_parser("migrate", help="把平铺在 output/ 下的旧文件移入分片目录")
+    migrate.add_argument("--legacy-dir", default=LEGACY_DIR)
+    args = ap.parse_args()
+
+    if args.command == "stats":
+        for kind, (count, size) in store.stats().items():
+            print(f"{kind:<8}{count:>10} 个{size / 1024 / 1024:>12.1f}MB")
+    elif args.command == "sweep":
+        removed, freed = store.sweep()
+        print(f"删除 {removed} 个文件，释放 {freed / 1024 / 1024:.1f}MB")
+    elif args.command == "show":
+        print(json.dumps(store.artifacts_for(args.owner), ensure_ascii=False, indent=1))
+    elif args.command == "migrate":
+        print(f"已迁移 {store.migrate(args.legacy_dir)} 个文件")
+
+
+if __name__ == "__main__":
+    main()
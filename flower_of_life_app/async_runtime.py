@@ -0,0 +1,96 @@
+# async_runtime.py
+"""
+异步分析模式的运行时：每个进程一个后台 asyncio 事件循环（独立线程），分析任务以协程的形式在其中运行。
+
+线程池模式下，每个进行中的分析在模型调用期间一直占用一个线程（ANALYSIS_WORKERS 即同时分析数的上限）；
+异步模式下，等待模型（gateway.achat）与排队等并发名额都只是挂起的协程，不占线程，
+一个进程可以同时挂着成千上万个分析。只有会阻塞的步骤（压缩图片、写报告、渲染 PDF、SQLite 读写）
+经 asyncio.to_thread 交给一个小线程池执行 —— 事件循环的默认 executor 即为该线程池，线程数固定。
+
+submit() 可以从任意线程调用（如 Flask 请求线程），返回 concurrent.futures.Future；
+协程在调用方上下文的副本中运行（contextvars，与线程池模式下 copy_context().run 的效果相同）。
+
+配置（环境变量）：
+- ANALYSIS_MODE：async（默认，事件循环）或 thread（原线程池，ANALYSIS_WORKERS 个线程）
+- ASYNC_BLOCKING_WORKERS：执行阻塞步骤的线程数，默认 4
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ANALYSIS_MODE = os.environ.get("ANALYSIS_MODE", "async")
+ASYNC_BLOCKING_WORKERS = int(os.environ.get("ASYNC_BLOCKING_WORKERS", "4"))
+
+
+class AsyncRuntime:
+    def __init__(self, blocking_workers=4, name="analysis"):
+        self.name = name
+        self.blocking_executor = ThreadPoolExecutor(max_workers=blocking_workers,
+                                                    thread_name_prefix=f"{name}-blocking")
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.finished = 0
+
+    def start(self):
+        """启动事件循环线程（重复调用无副作用），返回 self。"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True,
+                                            name=f"{self.name}-loop")
+            self._thread.start()
+        ready.wait()
+        return self
+
+    def _run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # asyncio.to_thread / run_in_executor(None, ...) 都使用这个线程池
+        self.loop.set_default_executor(self.blocking_executor)
+        self.loop.call_soon(ready.set)
+        self.loop.run_forever()
+
+    def submit(self, coro_fn, *args, **kwargs):
+        """在事件循环中运行 coro_fn(*args, **kwargs)，返回 concurrent.futures.Future（可跨线程等待）。"""
+        self.start()
+        with self._lock:
+            self.submitted += 1
+        return asyncio.run_coroutine_threadsafe(self._track(coro_fn(*args, **kwargs)), self.loop)
+
+    async def _track(self, coro):
+        try:
+            return await coro
+        finally:
+            with self._lock:
+                self.finished += 1
+
+    def stop(self, timeout=None):
+        """停止事件循环（未完成的协程被丢弃），等待线程退出。"""
+        if self._thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self.blocking_executor.shutdown(wait=False)
+
+    def pending(self):
+        """已提交、尚未结束的协程数。"""
+        with self._lock:
+            return self.submitted - self.finished
+
+    def collect_metrics(self):
+        labels = {"runtime": self.name}
+        yield "async_tasks_pending", "gauge", "事件循环中尚未结束的任务数", labels, self.pending()
+        yield "async_tasks_total", "counter", "提交到事件循环的任务数", labels, self.submitted
+        yield ("executor_queue_depth", "gauge", "线程池中等待执行的任务数",
+               {"pool": f"{self.name}-blocking"}, self.blocking_executor._work_queue.qsize())
+
+
+def create_async_runtime(name="analysis"):
+    """ANALYSIS_MODE=async 时创建（未启动的）运行时，否则返回 None。"""
+    if ANALYSIS_MODE != "async":
+        return None
+    return AsyncRuntime(ASYNC_BLOCKING_WORKERS, name)
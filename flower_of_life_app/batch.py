@@ -0,0 +1,303 @@
+# batch.py
+"""
+批量生成报告。
+
+清单（manifest）每行一张图片：姓名、图片（本地路径或 http(s) URL）、可选提示词。
+支持 CSV（表头 name,image,prompt；也接受 image_url 列名）、JSON 数组与 JSONL。
+
+每个批次对应 output/batches/<batch_id>/ 目录：
+- manifest.json：规范化后的条目列表；
+- progress.json：每个条目的结果（completed / failed、生成的文件或错误信息），每完成一条原子写入一次；
+- batch.json：提交时的设置（parallelism），继续处理时沿用。
+中断后用同一 batch_id 重新运行只会处理未完成的条目（失败的条目也会重试）。
+全部结束后打包为 batch_<batch_id>.zip，放在报告存储中（见 artifacts.py，可通过 /api/download/<文件名> 下载）；
+各条目生成的文件与结果包都在索引中记在该批次名下。
+
+条目之间用线程池并发执行（BATCH_PARALLELISM，默认 8；接口提交的 parallelism 不超过 BATCH_MAX_PARALLELISM，默认 32）；模型调用的并发与限流由 llm_gateway 统一控制，
+PDF 渲染走 pdf 模块当前的渲染函数（服务内为渲染进程池）。
+
+命令行：
+    python batch.py manifest.csv [--parallelism 8] [--batch-id ID]
+    python batch.py --resume ID
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import re
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ali_api import analyze_report, save_report
+from analysis_cache import is_remote
+from artifacts import store as artifact_store
+from downloads import record_digest
+from imaging import compress_image_if_needed
+from pdf import generate_pdf
+from remote_images import prefetch as prefetch_remote_image
+from report import json_path_for
+import metrics
+
+BATCH_DIR = os.path.join('output', 'batches')
+BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', '8'))
+BATCH_MAX_PARALLELISM = int(os.environ.get('BATCH_MAX_PARALLELISM', '32'))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '1000'))
+BATCH_ID_PATTERN = re.compile(r'[0-9a-zA-Z_-]{1,64}')
+
+
+class ManifestError(ValueError):
+    """清单格式错误或内容不合法。"""
+
+
+def parse_manifest(text, fmt):
+    """解析清单文本（fmt 为 csv / json / jsonl），返回规范化后的条目列表。"""
+    if fmt == 'csv':
+        rows = list(csv.DictReader(io.StringIO(text.lstrip('\ufeff'))))
+    elif fmt == 'json':
+        rows = json.loads(text)
+    elif fmt == 'jsonl':
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        raise ManifestError(f"不支持的清单格式: {fmt}")
+    return normalize_items(rows)
+
+
+def load_manifest(path):
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, 'r', encoding='utf-8') as f:
+        items = parse_manifest(f.read(), fmt)
+    # 本地图片路径相对于清单所在目录
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for item in items:
+        if not is_remote(item['image']):
+            item['image'] = os.path.join(base_dir, item['image'])
+    return items
+
+
+def normalize_items(rows):
+    if not isinstance(rows, list):
+        raise ManifestError("清单必须是条目列表")
+    if not rows:
+        raise ManifestError("清单为空")
+    if len(rows) > BATCH_MAX_ITEMS:
+        raise ManifestError(f"清单条目过多（最多 {BATCH_MAX_ITEMS} 条）")
+    items = []
+    for i, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            raise ManifestError(f"第 {i} 条格式错误")
+        name = (row.get('name') or '').strip()
+        image = (row.get('image') or row.get('image_url') or '').strip()
+        if not name or not image:
+            raise ManifestError(f"第 {i} 条缺少姓名或图片")
+        items.append({'name': name, 'image': image, 'prompt': (row.get('prompt') or '').strip() or None})
+    return items
+
+
+def parse_parallelism(value):
+    """接口传入的并发数：未提供时为 BATCH_PARALLELISM，限制在 1..BATCH_MAX_PARALLELISM；不是整数时抛出 ManifestError。"""
+    if value is None or value == '':
+        return BATCH_PARALLELISM
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ManifestError("parallelism 必须是整数")
+    try:
+        parallelism = int(value)
+    except (TypeError, ValueError):
+        raise ManifestError("parallelism 必须是整数") from None
+    return min(max(1, parallelism), BATCH_MAX_PARALLELISM)
+
+
+def zip_entry_prefix(index, name):
+    """结果包中条目的文件名前缀 <序号>_<姓名>：去掉路径分隔符、控制字符与 ..，避免解压到包外或生成嵌套目录。"""
+    safe = re.sub(r'[\\/\x00-\x1f]+', '_', name).replace('..', '_').strip(' ._')
+    return f"{index:03d}_{safe}" if safe else f"{index:03d}"
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+class BatchJob:
+    def __init__(self, batch_id, items, progress=None, base_dir=BATCH_DIR, parallelism=BATCH_PARALLELISM):
+        self.batch_id = batch_id
+        self.items = items
+        self.parallelism = parallelism
+        self.progress = progress or {}  # str(index) -> {"status", "txt_file", "pdf_file", "error"}
+        self.dir = os.path.join(base_dir, batch_id)
+        self._lock = threading.Lock()
+        self._admit = contextlib.nullcontext
+
+    @classmethod
+    def create(cls, items, batch_id=None, base_dir=BATCH_DIR, parallelism=BATCH_PARALLELISM):
+        """新建批次；batch_id 不符合 BATCH_ID_PATTERN 时抛出 ValueError。"""
+        if batch_id is not None and not BATCH_ID_PATTERN.fullmatch(batch_id):
+            raise ValueError(f"批次 ID 不合法（只能包含字母、数字、_ 与 -，最长 64 个字符）: {batch_id}")
+        job = cls(batch_id or uuid.uuid4().hex, items, base_dir=base_dir, parallelism=parallelism)
+        os.makedirs(job.dir, exist_ok=True)
+        _write_json(os.path.join(job.dir, 'manifest.json'), items)
+        _write_json(os.path.join(job.dir, 'progress.json'), {})
+        _write_json(os.path.join(job.dir, 'batch.json'), {'parallelism': parallelism})
+        return job
+
+    @classmethod
+    def load(cls, batch_id, base_dir=BATCH_DIR):
+        """读取已有批次；不存在时返回 None。"""
+        if not BATCH_ID_PATTERN.fullmatch(batch_id):
+            return None
+        directory = os.path.join(base_dir, batch_id)
+        try:
+            with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+                items = json.load(f)
+            with open(os.path.join(directory, 'progress.json'), 'r', encoding='utf-8') as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # 旧批次没有 batch.json，使用默认并发数
+            with open(os.path.join(directory, 'batch.json'), 'r', encoding='utf-8') as f:
+                parallelism = int(json.load(f)['parallelism'])
+        except (OSError, ValueError, KeyError, TypeError):
+            parallelism = BATCH_PARALLELISM
+        return cls(batch_id, items, progress, base_dir=base_dir, parallelism=parallelism)
+
+    @property
+    def zip_path(self):
+        return artifact_store.report_path(f"batch_{self.batch_id}.zip")
+
+    def pending(self):
+        return [i for i in range(len(self.items))
+                if self.progress.get(str(i), {}).get('status') != 'completed']
+
+    def summary(self):
+        with self._lock:
+            statuses = [self.progress.get(str(i), {}).get('status') for i in range(len(self.items))]
+        completed, failed = statuses.count('completed'), statuses.count('failed')
+        total = len(self.items)
+        return {
+            "batch_id": self.batch_id,
+            "total": total,
+            "completed": completed,
+            "failed": failed,
+            "pending": total - completed - failed,
+            "progress": int((completed + failed) * 100 / total) if total else 100,
+            "zip_file": os.path.basename(self.zip_path) if os.path.exists(self.zip_path) else None,
+        }
+
+    def _record(self, index, **result):
+        with self._lock:
+            self.progress[str(index)] = result
+            _write_json(os.path.join(self.dir, 'progress.json'), self.progress)
+
+    def _process(self, index):
+        with metrics.trace("batch_item", batch_id=self.batch_id, index=index), self._admit():
+            self._process_item(index)
+
+    def _process_item(self, index):
+        item = self.items[index]
+        image_path = item['image']
+        try:
+            if not is_remote(image_path):
+                if not os.path.isfile(image_path):
+                    raise FileNotFoundError(f"图片不存在: {image_path}")
+                image_path = compress_image_if_needed(image_path, max_size_bytes=10 * 1024 * 1024)
+            else:
+                prefetch_remote_image(image_path)
+            report, error = analyze_report(image_path, item['name'], item['prompt'])
+            if error:
+                raise RuntimeError(f"分析失败: {error}")
+            txt_file_path = save_report(report, image_path)
+            # 文件名带上批次与序号：清单中同名的条目同一天生成，各自写入自己的 PDF
+            pdf_file_path = generate_pdf(report, image_path, suffix=f"{self.batch_id}-{index + 1:03d}")
+            artifact_store.assign(self.batch_id, txt_file_path, json_path_for(txt_file_path), pdf_file_path)
+            self._record(index, status='completed', txt_file=txt_file_path, pdf_file=pdf_file_path)
+        except Exception as e:
+            self._record(index, status='failed', error=str(e))
+
+    def run(self, parallelism=None, on_progress=None, admit=None):
+        """
+        处理所有未完成的条目，结束后打包；on_progress(summary) 在每个条目结束时调用。返回汇总。
+        parallelism 默认为批次创建时的设置。
+        admit 为可选的准入函数，返回上下文管理器，每个条目在其中处理（服务内为调度器的 batch 通道，见 admission.py）。
+        """
+        self._admit = admit or contextlib.nullcontext
+        parallelism = parallelism or self.parallelism
+        pending = self.pending()
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix='batch') as executor:
+                futures = [executor.submit(self._process, i) for i in pending]
+                for future in as_completed(futures):
+                    future.result()
+                    if on_progress:
+                        on_progress(self.summary())
+        self.build_zip()
+        return self.summary()
+
+    def build_zip(self):
+        """把已完成条目的 PDF / TXT 打包（PDF 本身已压缩，按 STORED 存放），附带 summary.json。"""
+        tmp_path = f"{self.zip_path}.tmp"
+        rows = []
+        with zipfile.ZipFile(tmp_path, 'w') as zf:
+            for i, item in enumerate(self.items):
+                result = self.progress.get(str(i), {})
+                rows.append({"index": i + 1, "name": item['name'], "image": item['image'], **result})
+                if result.get('status') != 'completed':
+                    continue
+                prefix = zip_entry_prefix(i + 1, item['name'])
+                for key, compression in (('pdf_file', zipfile.ZIP_STORED), ('txt_file', zipfile.ZIP_DEFLATED)):
+                    path = result.get(key)
+                    if path and os.path.exists(path):
+                        zf.write(path, prefix + os.path.splitext(path)[1], compress_type=compression)
+            zf.writestr('summary.json', json.dumps(rows, ensure_ascii=False, indent=1),
+                        compress_type=zipfile.ZIP_DEFLATED)
+        os.replace(tmp_path, self.zip_path)
+        record_digest(self.zip_path)
+        artifact_store.add(self.zip_path, owner=self.batch_id)
+        return self.zip_path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="批量生成生命之花分析报告")
+    ap.add_argument("manifest", nargs="?", help="清单文件（.csv / .json / .jsonl）")
+    ap.add_argument("--resume", metavar="BATCH_ID", help="继续处理已有批次中未完成的条目")
+    ap.add_argument("--batch-id", help="新批次使用的 ID（默认随机生成）")
+    ap.add_argument("--parallelism", type=int,
+                    help=f"并发处理的条目数（新批次默认 {BATCH_PARALLELISM}，--resume 时默认沿用批次创建时的设置）")
+    args = ap.parse_args()
+
+    if args.resume:
+        job = BatchJob.load(args.resume)
+        if job is None:
+            ap.error(f"批次不存在: {args.resume}")
+    elif args.manifest:
+        try:
+            job = BatchJob.create(load_manifest(args.manifest), args.batch_id,
+                                  parallelism=args.parallelism or BATCH_PARALLELISM)
+        except (ManifestError, ValueError, OSError) as e:
+            ap.error(str(e))
+    else:
+        ap.error("需要提供清单文件或 --resume")
+
+    from pdf import warm_pdf_assets
+    from pdf_workers import install_render_pool
+    warm_pdf_assets()
+    install_render_pool()
+
+    print(f"批次 {job.batch_id}: 共 {len(job.items)} 条，待处理 {len(job.pending())} 条")
+
+    def report(summary):
+        print(f"进度 {summary['completed'] + summary['failed']}/{summary['total']}"
+              f"（成功 {summary['completed']}，失败 {summary['failed']}）")
+
+    summary = job.run(args.parallelism, on_progress=report)
+    print(json.dumps(summary, ensure_ascii=False))
+    print(f"结果已打包: {job.zip_path}")
+
+
+if __name__ == "__main__":
+    main()
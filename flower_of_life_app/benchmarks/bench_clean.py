@@ -0,0 +1,145 @@
+# benchmarks/bench_clean.py
+"""
+TXT 清洗 / 章节解析微基准：对比旧流程与 report.IncrementalSectionParser 的单趟解析。
+
+旧流程（下方 legacy_*，照搬原 pdf.py 中的实现）：整篇 clean_noise（6 次全文 re.sub）→ 头部字段正则 →
+解析器逐行 clean_noise → 每节收尾再 clean_noise 一次并去引用符、整理空行 → 渲染前 _add_section 再清洗一次。
+新流程：逐行清洗一次，同一趟识别头部字段与章节边界；章节正文为 CleanText，渲染前的 clean_noise 直接返回。
+
+输入：output/ 下的样例报告，以及由样例拼接成的约 1MB 合成报告（--synthetic-mb 调整大小）。
+每个输入先核对两种流程解析出的章节一致，再分别计时（取 --repeat 次中的最小值）。
+
+用法（在 flower_of_life_app 目录下运行）：
+    python benchmarks/bench_clean.py
+    python benchmarks/bench_clean.py --synthetic-mb 4 --repeat 5
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from report import IncrementalSectionParser, clean_noise  # noqa: E402
+
+
+def legacy_clean_noise(text):
+    if not text:
+        return text
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r'\*{1,3}([^\n*]+?)\*{1,3}', r'\1', text)
+    text = re.sub(r'^\s*[-_–—]{3,}\s*$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'[ \t]+$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^\s*•\s*', '•', text, flags=re.MULTILINE)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text
+
+
+def legacy_parse(raw):
+    """原 parse_text_file + IncrementalSectionParser + _add_section 的清洗部分。"""
+    title_pat = re.compile(r'^\s*\*{0,2}(\d+)\.\s*(.+?)\s*\*{0,2}\s*$')
+    banner_pat = re.compile(r'^生命之花分析报告\s*$')
+    raw = legacy_clean_noise(raw)
+    header = {}
+    for field, key in (('name', '姓名'), ('date', '日期'), ('image_path', '图片路径')):
+        m = re.search(key + r'[:：]\s*(.+)', raw)
+        if m:
+            header[field] = m.group(1).strip()
+
+    sections = {}
+    title, lines = None, []
+
+    def close():
+        if title is None:
+            return
+        value = legacy_clean_noise("\n".join(lines))
+        value = re.sub(r'^\s*>\s*', '', value, flags=re.MULTILINE)
+        sections[title] = re.sub(r'\n\s*\n', '\n\n', value).strip()
+
+    for line in raw.split("\n"):
+        line = legacy_clean_noise(line)
+        if banner_pat.match(line):
+            continue
+        m = title_pat.match(line)
+        if m:
+            close()
+            title, lines = f"{m.group(1)}. {m.group(2).strip()}", []
+        elif title is not None:
+            lines.append(line)
+    close()
+    # 渲染前 _add_section 的再清洗
+    return header, {k: legacy_clean_noise(v) for k, v in sections.items()}
+
+
+def current_parse(raw):
+    parser = IncrementalSectionParser()
+    parser.feed(raw)
+    parser.finish()
+    return parser.header, {k: clean_noise(v) for k, v in parser.sections.items()}
+
+
+def synthetic_report(samples, size_bytes):
+    """拼接样例报告的正文，按顺序重新编号章节，直到达到 size_bytes。"""
+    body = [line for text in samples for line in text.split("\n")
+            if not re.match(r'^\s*\*{0,2}\d+\.', line) and not re.match(r'^(生命之花分析报告|姓名|日期|图片路径)', line)]
+    parts = ["生命之花分析报告", "姓名：基准", "日期：2025-01-01", "图片路径：bench.png", ""]
+    size, number = 0, 0
+    while size < size_bytes:
+        number += 1
+        parts.append(f"**{number}. 合成章节 {number}**")
+        parts.append("")
+        parts.extend(body)
+        size += sum(len(line.encode("utf-8")) + 1 for line in body)
+    return "\n".join(parts)
+
+
+def best_of(fn, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--synthetic-mb", type=float, default=1.0, help="合成报告大小（MB）")
+    ap.add_argument("--repeat", type=int, default=20, help="每项重复次数，取最小值")
+    args = ap.parse_args()
+
+    samples = {}
+    for path in sorted(glob.glob(os.path.join(APP_DIR, "output", "生命之花分析报告-*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            samples[os.path.basename(path)] = f.read()
+    if not samples:
+        print("output/ 下没有样例报告")
+        return 1
+    inputs = dict(samples)
+    inputs[f"synthetic_{args.synthetic_mb:g}MB"] = synthetic_report(list(samples.values()), int(args.synthetic_mb * 1024 * 1024))
+
+    print(f"{'输入':<36}{'大小KB':>9}{'章节':>6}{'旧流程ms':>11}{'单趟ms':>10}{'加速':>8}")
+    for name, raw in inputs.items():
+        legacy, current = legacy_parse(raw), current_parse(raw)
+        if legacy != current:
+            print(f"{name}: 两种流程的解析结果不一致")
+            return 1
+        repeat = args.repeat if len(raw) < 100_000 else max(1, args.repeat // 5)
+        t_legacy = best_of(legacy_parse, raw, repeat)
+        t_current = best_of(current_parse, raw, repeat)
+        print(f"{name:<36}{len(raw.encode('utf-8')) / 1024:>9.1f}{len(current[1]):>6}"
+              f"{t_legacy * 1000:>11.2f}{t_current * 1000:>10.2f}{t_legacy / t_current:>7.1f}x")
+
+    # 幂等标记：已清洗文本再次 clean_noise 直接返回
+    cleaned = clean_noise(inputs[f"synthetic_{args.synthetic_mb:g}MB"])
+    print(f"clean_noise 全文 {best_of(clean_noise, str(cleaned), 3) * 1000:.2f}ms，"
+          f"已清洗文本再次调用 {best_of(clean_noise, cleaned, 3) * 1e6:.1f}µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
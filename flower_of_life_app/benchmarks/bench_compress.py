@@ -0,0 +1,105 @@
+# benchmarks/bench_compress.py
+"""
+上传图片压缩基准：对比旧版逐级降质量算法与 imaging.compress_to_limit。
+
+用法（在 flower_of_life_app 目录下运行）：
+    python benchmarks/bench_compress.py                     # 自动生成一组大尺寸 PNG/JPEG 样本
+    python benchmarks/bench_compress.py --corpus 样本目录 --max-mb 10
+输出每张图的耗时、编码次数与结果体积，以及汇总。
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+from imaging import compress_to_limit  # noqa: E402
+
+
+def legacy_compress(image_path, max_size_bytes):
+    """旧版 compress_image_if_needed 的算法（质量 85 起每次减 5，最后按体积比缩放）。"""
+    encodes = 0
+    file_size = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGB')
+        quality = 85
+        while quality > 10:
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=quality, optimize=True)
+            encodes += 1
+            if buffer.tell() <= max_size_bytes:
+                return buffer.getvalue(), encodes
+            quality -= 5
+        ratio = (max_size_bytes / file_size) ** 0.5 * 0.9
+        img_resized = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img_resized.save(buffer, 'JPEG', quality=70, optimize=True)
+        return buffer.getvalue(), encodes + 1
+
+
+def make_corpus(directory, count):
+    """生成带噪点的大尺寸照片类样本（PNG 无法有效压缩，JPEG 用高质量保存）。"""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        w, h = (6000, 4000) if i % 2 == 0 else (4032, 3024)
+        base = rng.integers(0, 255, (h // 8, w // 8, 3), dtype=np.uint8)
+        img = Image.fromarray(base).resize((w, h), Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(1))
+        noise = rng.integers(-60, 60, (h, w, 3))
+        img = Image.fromarray(np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8))
+        if i % 2 == 0:
+            path = os.path.join(directory, f"sample_{i}.png")
+            img.save(path, compress_level=1)
+        else:
+            path = os.path.join(directory, f"sample_{i}.jpg")
+            img.save(path, quality=98)
+        paths.append(path)
+    return paths
+
+
+def measure(fn, path, max_size_bytes):
+    t0 = time.perf_counter()
+    data, encodes = fn(path, max_size_bytes)
+    return {"seconds": round(time.perf_counter() - t0, 3), "encodes": encodes,
+            "bytes": len(data), "within_limit": len(data) <= max_size_bytes}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", help="样本目录（*.png / *.jpg / *.jpeg），不指定则自动生成")
+    ap.add_argument("--count", type=int, default=4, help="自动生成的样本数")
+    ap.add_argument("--max-mb", type=float, default=10, help="压缩上限（MB）")
+    args = ap.parse_args()
+
+    if args.corpus:
+        paths = sorted(p for ext in ("png", "jpg", "jpeg") for p in glob.glob(os.path.join(args.corpus, f"*.{ext}")))
+    else:
+        paths = make_corpus(tempfile.mkdtemp(prefix="bench_compress_"), args.count)
+    limit = int(args.max_mb * 1024 * 1024)
+
+    totals = {"legacy": [0.0, 0], "new": [0.0, 0]}
+    for path in paths:
+        row = {"file": os.path.basename(path), "source_mb": round(os.path.getsize(path) / 1024 / 1024, 1)}
+        for label, fn in (("legacy", legacy_compress), ("new", compress_to_limit)):
+            row[label] = measure(fn, path, limit)
+            totals[label][0] += row[label]["seconds"]
+            totals[label][1] += row[label]["encodes"]
+        print(json.dumps(row, ensure_ascii=False))
+
+    n = max(len(paths), 1)
+    print(json.dumps({label: {"mean_seconds": round(t / n, 3), "encodes_per_image": round(e / n, 2)}
+                      for label, (t, e) in totals.items()}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
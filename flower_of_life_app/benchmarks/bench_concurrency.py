@@ -0,0 +1,240 @@
+# benchmarks/bench_concurrency.py
+"""
+并发容量压测：用生产入口（gunicorn -c gunicorn.conf.py app:app，单个 worker）分别以
+ANALYSIS_MODE=thread 与 ANALYSIS_MODE=async 启动服务，一次性提交大量 /api/analyze 请求，
+模拟模型（mock_dashscope.py，独立进程）的延迟设得较长，使所有分析同时处于等待模型的状态。统计：
+- submit：提交阶段耗时与 202 之外的响应数；
+- peak_llm_in_flight：模拟模型观察到的峰值并发请求数，即服务端同时挂着的分析数；
+- peak_threads / peak_rss_mb：worker 进程的峰值线程数与内存；
+- all_waiting_s：从开始提交到所有分析都已发出模型调用的耗时（达不到时为 null）；
+- completed / failed / wall_s：在 --timeout 内完成、失败的任务数与总耗时（从任务库中统计）。
+
+线程池模式下同时分析数受 ANALYSIS_WORKERS（默认用 --thread-workers 个线程）限制，其余任务排队；
+异步模式下所有任务同时等待模型，线程数基本不随请求数增长。模型侧的并发上限（LLM_MAX_CONCURRENCY）与
+连接池（LLM_MAX_CONNECTIONS）均设为请求数，限流关闭，分析缓存关闭，每个请求上传内容不同的小图。
+
+用法（在 flower_of_life_app 目录下运行，需要 gunicorn 与 fonts/simhei.ttf 等资源）：
+    python benchmarks/bench_concurrency.py
+    python benchmarks/bench_concurrency.py --requests 2000 --latency-ms 30000 --modes async
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url, timeout=60):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def make_images(count, size):
+    """count 张内容各不相同的小 PNG（随机像素），避免被请求合并吸收。"""
+    from PIL import Image
+    rng = random.Random(0)
+    images = []
+    for _ in range(count):
+        img = Image.frombytes("RGB", (size, size), bytes(rng.randrange(256) for _ in range(size * size * 3)))
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def proc_status(pid):
+    """返回 (线程数, RSS MB)；进程不存在时返回 (0, 0)。"""
+    threads, rss = 0, 0.0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+                elif line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return threads, rss
+
+
+def worker_pids(master_pid):
+    """gunicorn master 的子进程（worker）。"""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def task_counts(db_path):
+    try:
+        conn = sqlite3.connect(db_path, timeout=5)
+        try:
+            return dict(conn.execute("SELECT status, count(*) FROM tasks GROUP BY status").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+
+def run_mode(mode, args, images):
+    import requests
+    mock_port, app_port = free_port(), free_port()
+    mock = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "mock_dashscope.py"), "--port", str(mock_port),
+                             "--latency-ms", str(args.latency_ms), "--latency-sigma", "0.05"],
+                            stdout=subprocess.DEVNULL)
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    workdir = tempfile.mkdtemp(prefix=f"bench_concurrency_{mode}_")
+    os.symlink(os.path.join(APP_DIR, "fonts"), os.path.join(workdir, "fonts"))
+    db_path = os.path.join(workdir, "tasks.db")
+    env = dict(os.environ,
+               PYTHONPATH=APP_DIR,
+               DASHSCOPE_BASE_URL=f"{mock_url}/v1",
+               DASHSCOPE_API_KEY="mock",
+               ANALYSIS_MODE=mode,
+               ANALYSIS_WORKERS=str(args.thread_workers),
+               ANALYSIS_CACHE="0",
+               LLM_RATE_PER_MINUTE="0",
+               LLM_MAX_CONCURRENCY=str(args.requests),
+               LLM_MAX_CONNECTIONS=str(args.requests),
+               LLM_READ_TIMEOUT=str(args.timeout),
+               LLM_DEADLINE=str(args.timeout),
+               # 所有请求都来自同一个客户端，准入控制的排队上限放宽到请求数，只测容量
+               ADMISSION_MAX_QUEUE=str(args.requests),
+               ADMISSION_MAX_QUEUE_PER_CLIENT=str(args.requests),
+               TASK_DB_PATH=db_path,
+               GUNICORN_BIND=f"127.0.0.1:{app_port}",
+               GUNICORN_WORKERS="1")
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(APP_DIR, "gunicorn.conf.py"),
+                               "--chdir", workdir, "app:app"], env=env, cwd=workdir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{app_port}"
+    try:
+        if not (wait_http(f"{mock_url}/stats") and wait_http(f"{base}/metrics")):
+            raise RuntimeError("服务启动失败")
+        pids = worker_pids(server.pid)
+        idle_threads = sum(proc_status(pid)[0] for pid in pids)
+
+        peak = {"threads": 0, "rss": 0.0, "llm": 0}
+        all_waiting = {}
+        stop = threading.Event()
+        t0 = time.perf_counter()
+
+        def monitor():
+            while not stop.is_set():
+                status = [proc_status(pid) for pid in pids]
+                peak["threads"] = max(peak["threads"], sum(s[0] for s in status))
+                peak["rss"] = max(peak["rss"], sum(s[1] for s in status))
+                try:
+                    stats = requests.get(f"{mock_url}/stats", timeout=5).json()
+                    peak["llm"] = stats["peak_in_flight"]
+                    if "s" not in all_waiting and stats["in_flight"] >= args.requests:
+                        all_waiting["s"] = round(time.perf_counter() - t0, 2)
+                except requests.RequestException:
+                    pass
+                stop.wait(0.25)
+
+        threading.Thread(target=monitor, daemon=True).start()
+
+        local = threading.local()
+
+        def submit(index):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            resp = local.session.post(f"{base}/api/analyze", data={"name": f"压测{index}"},
+                                      files={"image_file": (f"{index}.png", images[index], "image/png")})
+            return resp.status_code == 202
+
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            accepted = sum(executor.map(submit, range(args.requests)))
+        submit_s = time.perf_counter() - t0
+
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            counts = task_counts(db_path)
+            if counts.get("completed", 0) + counts.get("failed", 0) >= accepted:
+                break
+            time.sleep(0.5)
+        wall = time.perf_counter() - t0
+        stop.set()
+        counts = task_counts(db_path)
+        return {
+            "mode": mode,
+            "requests": args.requests,
+            "submit_s": round(submit_s, 2),
+            "rejected": args.requests - accepted,
+            "idle_threads": idle_threads,
+            "peak_threads": peak["threads"],
+            "peak_rss_mb": round(peak["rss"], 1),
+            "peak_llm_in_flight": peak["llm"],
+            "all_waiting_s": all_waiting.get("s"),
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "wall_s": round(wall, 2),
+        }
+    finally:
+        server.terminate()
+        mock.terminate()
+        server.wait(30)
+        mock.wait(30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--modes", default="thread,async", help="要测试的模式，逗号分隔：thread,async")
+    ap.add_argument("--requests", type=int, default=1000, help="提交的分析请求数")
+    ap.add_argument("--latency-ms", type=float, default=20000, help="模拟模型的延迟（毫秒）")
+    ap.add_argument("--clients", type=int, default=32, help="提交请求的并发客户端数")
+    ap.add_argument("--thread-workers", type=int, default=64, help="线程池模式的 ANALYSIS_WORKERS")
+    ap.add_argument("--image-size", type=int, default=48, help="上传图片边长（像素）")
+    ap.add_argument("--timeout", type=float, default=600, help="等待全部任务结束的时限（秒）")
+    ap.add_argument("--out", help="结果 JSON 路径")
+    args = ap.parse_args()
+
+    images = make_images(args.requests, args.image_size)
+    results = []
+    for mode in args.modes.split(","):
+        result = run_mode(mode, args, images)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
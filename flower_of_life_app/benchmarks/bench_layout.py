@@ -0,0 +1,129 @@
+# benchmarks/bench_layout.py
+"""
+正文排版基准：对比原先的 multi_cell 逐段输出（段落开始前检查 get_y() > 250）与 pdf_layout 的
+字宽表断行 + 逐行分页。
+
+输入为 output/ 下的样例报告，以及把样例章节正文重复多次得到的长报告（--long-repeat）。统计：
+- cpu_ms：正文排版与输出（_fill_text_on_new_pages）的 CPU 时间，取 --runs 次中的最小值；
+  不含字体子集化等每份文档固定的收尾开销；ms_per_page 为按页平均；
+- pages：页数；overflow_lines：底部超出正文区域（pdf.BODY_BOTTOM）的行数；
+- same_lines：两种方式断出的行（文字内容与顺序）是否完全一致。
+
+用法（在 flower_of_life_app 目录下运行，需要 fonts/simhei.ttf 等资源）：
+    python benchmarks/bench_layout.py
+    python benchmarks/bench_layout.py --runs 10 --long-repeat 8
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import pdf  # noqa: E402
+import pdf_layout  # noqa: E402
+from report import BLANK, BULLET, Report, Section  # noqa: E402
+
+
+class LegacyConverter(pdf.FlowerOfLifeReportConverter):
+    """原先的正文输出：每段调用 multi_cell，只在段落开始前检查 y 坐标。"""
+
+    def _add_section(self, section):
+        self.pdf.set_font(self.font_name, 'B', 16)
+        self.pdf.set_text_color(57, 96, 156)
+        if self.pdf.get_y() > 250:
+            self._add_page_with_background(False)
+        self.pdf.cell(0, 10, section.title, ln=True)
+        self.pdf.ln(2)
+        self.pdf.set_font(self.font_name, '', 12)
+        self.pdf.set_text_color(0, 0, 0)
+        for kind, text in section.blocks:
+            if kind == BLANK:
+                self.pdf.ln(5)
+                continue
+            if self.pdf.get_y() > 250:
+                self._add_page_with_background(False)
+            if kind == BULLET:
+                self.pdf.set_x(20)
+                self.pdf.cell(5, 8, "•", ln=0)
+                self.pdf.set_x(25)
+            self.pdf.multi_cell(0, 8, text)
+            self.pdf.ln(4)
+        self.pdf.ln(8)
+
+
+def long_report(report, repeat):
+    """每一节的正文重复 repeat 次。"""
+    sections = [Section(s.title, s.blocks * repeat) for s in report.sections]
+    return Report(report.name, report.date, report.image_path, sections, report.text)
+
+
+def layout_lines(converter_class, report):
+    """排版正文并记录每一行，返回 (页数, 正文行 [(页, y, h, 文本)])。"""
+    converter = converter_class(report)
+    lines = []
+    cell, emit_text = converter.pdf.cell, pdf_layout._emit_text
+
+    def record(h, txt):
+        if h == pdf.LINE_HEIGHT and txt not in ("", "•"):
+            lines.append((converter.pdf.page, converter.pdf.y, h, txt))
+
+    def recording_cell(w, h=0, txt='', *args, **kwargs):
+        record(h, txt)
+        return cell(w, h, txt, *args, **kwargs)
+
+    def recording_emit_text(target, h, txt):
+        record(h, txt)
+        return emit_text(target, h, txt)
+
+    converter.pdf.cell = recording_cell
+    pdf_layout._emit_text = recording_emit_text
+    try:
+        converter.pdf.add_page()
+        converter._fill_text_on_new_pages()
+        return converter.pdf.page, lines
+    finally:
+        pdf_layout._emit_text = emit_text
+
+
+def layout_cpu(converter_class, report):
+    converter = converter_class(report)
+    converter.pdf.add_page()
+    t0 = time.process_time()
+    converter._fill_text_on_new_pages()
+    return time.process_time() - t0
+
+
+def measure(converter_class, report, runs):
+    pages, lines = layout_lines(converter_class, report)
+    best = min(layout_cpu(converter_class, report) for _ in range(runs))
+    overflow = sum(1 for _, y, h, _ in lines if y + h > pdf.BODY_BOTTOM + 1e-6)
+    return {"cpu_ms": round(best * 1000, 1), "pages": pages, "ms_per_page": round(best * 1000 / pages, 2),
+            "overflow_lines": overflow}, [text for *_, text in lines]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--long-repeat", type=int, default=6, help="长报告中每节正文的重复次数")
+    args = ap.parse_args()
+
+    os.chdir(APP_DIR)
+    pdf.warm_pdf_assets()
+    inputs = {}
+    for path in sorted(glob.glob(os.path.join("output", "生命之花分析报告-*.txt"))):
+        report = Report.from_text(open(path, encoding="utf-8").read())
+        inputs[os.path.basename(path)] = report
+        inputs[f"{os.path.basename(path)} x{args.long_repeat}"] = long_report(report, args.long_repeat)
+
+    for name, report in inputs.items():
+        legacy, legacy_lines = measure(LegacyConverter, report, args.runs)
+        current, current_lines = measure(pdf.FlowerOfLifeReportConverter, report, args.runs)
+        print(f"{name}\n  multi_cell: {legacy}\n  layout:     {current}\n"
+              f"  same_lines: {legacy_lines == current_lines}，CPU/页 x{legacy['ms_per_page'] / current['ms_per_page']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# benchmarks/bench_near_duplicates.py
+"""
+近似重复检测基准（near_duplicates.py），用于选择 NEAR_DUPLICATE_THRESHOLD 并确认查找开销：
+- 变换距离：对样例图片（output/ 下的图片与 --images 指定的文件）做重新压缩、缩放、加边距、裁边、
+  调亮度、轻微旋转，输出各变体与原图的汉明距离（应在阈值内）；
+- 不同图片的距离：--drawings 张随机生成的“画”（随机色圈，与 bench_service 相同的画法）两两之间的最小距离
+  （应远大于阈值），以及阈值内的误匹配对数；
+- 哈希耗时：每张图片计算 dHash 的耗时；
+- 查找耗时：--index-size 个哈希建 多索引哈希，随机查询的平均耗时，与逐个比较对比。
+
+用法（在 flower_of_life_app 目录下运行）：
+    python benchmarks/bench_near_duplicates.py
+    python benchmarks/bench_near_duplicates.py --images a.jpg b.png --index-size 200000
+"""
+import argparse
+import glob
+import io
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageOps  # noqa: E402
+
+from near_duplicates import MultiIndexHash, dhash  # noqa: E402
+
+
+def encode(img, fmt="JPEG", **kwargs):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def variants(img):
+    """常见的“同一幅画再次上传”的变化。"""
+    w, h = img.size
+    white = (255, 255, 255)
+    return {
+        "jpeg_q40": encode(img, quality=40),
+        "resize_50%": encode(img.resize((w // 2, h // 2), Image.Resampling.LANCZOS), quality=85),
+        "margin_+5%": encode(ImageOps.expand(img, border=w // 20, fill=white), quality=85),
+        "crop_3%": encode(img.crop((w * 3 // 100, h * 3 // 100, w * 97 // 100, h * 97 // 100)), quality=85),
+        "brightness_+20%": encode(ImageEnhance.Brightness(img).enhance(1.2), quality=85),
+        "rotate_2deg": encode(img.rotate(2, resample=Image.Resampling.BICUBIC, fillcolor=white), quality=85),
+    }
+
+
+def drawing(rng, size=800):
+    img = Image.new("RGB", (size, size), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x, y, r = rng.randrange(size), rng.randrange(size), rng.randrange(20, size // 4)
+        draw.ellipse((x - r, y - r, x + r, y + r), outline=tuple(rng.randrange(256) for _ in range(3)), width=6)
+    return img
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--images", nargs="*", default=[], help="额外的样例图片")
+    ap.add_argument("--drawings", type=int, default=200, help="随机生成的不同图片数")
+    ap.add_argument("--index-size", type=int, default=100000, help="查找测试的索引规模")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--threshold", type=int, default=int(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "12")))
+    args = ap.parse_args()
+
+    os.chdir(APP_DIR)
+    rng = random.Random(0)
+    samples = sorted(glob.glob(os.path.join("output", "*.jpg")) + glob.glob(os.path.join("output", "*.png")))
+    samples += args.images
+
+    print(f"变换距离（阈值 {args.threshold}）：")
+    hash_ms = []
+    for path in samples:
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+        t0 = time.perf_counter()
+        base = dhash(path)
+        hash_ms.append((time.perf_counter() - t0) * 1000)
+        if base is None:
+            print(f"  {os.path.basename(path)}: 纯色图片，不计算哈希")
+            continue
+        distances = {}
+        for name, data in variants(img).items():
+            value = dhash(data)
+            distances[name] = None if value is None else (base ^ value).bit_count()
+        print(f"  {os.path.basename(path)} {img.width}x{img.height}: {distances}")
+
+    drawings = [drawing(rng) for _ in range(args.drawings)]
+    hashes = []
+    for img in drawings:
+        data = encode(img, quality=90)
+        t0 = time.perf_counter()
+        hashes.append(dhash(data))
+        hash_ms.append((time.perf_counter() - t0) * 1000)
+    pairs = [(hashes[i] ^ hashes[j]).bit_count() for i in range(len(hashes)) for j in range(i + 1, len(hashes))]
+    false_matches = sum(1 for d in pairs if d <= args.threshold)
+    pairs.sort()
+    print(f"不同图片（{len(hashes)} 张，{len(pairs)} 对）：最小距离 {pairs[0]}，"
+          f"1% 分位 {pairs[len(pairs) // 100]}，中位数 {pairs[len(pairs) // 2]}，阈值内误匹配 {false_matches} 对")
+    hash_ms.sort()
+    print(f"哈希耗时：中位数 {hash_ms[len(hash_ms) // 2]:.2f}ms，最大 {hash_ms[-1]:.2f}ms")
+
+    # 查找：真实哈希之外补充随机哈希到指定规模，查询为真实哈希翻转少量位
+    population = hashes + [rng.getrandbits(128) for _ in range(max(0, args.index_size - len(hashes)))]
+    index = MultiIndexHash()
+    t0 = time.perf_counter()
+    for i, value in enumerate(population):
+        index.add(value, i)
+    build_s = time.perf_counter() - t0
+    queries = []
+    for _ in range(args.queries):
+        value = rng.choice(hashes)
+        for bit in rng.sample(range(128), rng.randrange(args.threshold + 1)):
+            value ^= 1 << bit
+        queries.append(value)
+
+    t0 = time.perf_counter()
+    index_hits = [index.search(q, args.threshold) for q in queries]
+    index_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    t0 = time.perf_counter()
+    scan_hits = [[i for i, v in enumerate(population) if (v ^ q).bit_count() <= args.threshold] for q in queries]
+    scan_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    assert [sorted(v for _, v in hits) for hits in index_hits] == [sorted(hits) for hits in scan_hits]
+    print(f"查找（{len(population)} 个哈希，建索引 {build_s:.2f}s）：多索引哈希 {index_ms:.3f}ms/次，"
+          f"逐个比较 {scan_ms:.3f}ms/次，x{scan_ms / index_ms:.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# benchmarks/bench_pdf.py
+"""
+PDF 生成基准：对 output/ 下的示例 TXT 报告反复生成 PDF，统计 CPU 时间与输出体积。
+
+用法（在 flower_of_life_app 目录下运行）：
+    python benchmarks/bench_pdf.py --runs 10            # 当前配置
+    python benchmarks/bench_pdf.py --runs 10 --compare  # 对比关闭 / 开启资源缓存（PDF_ASSET_CACHE=0/1）
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_reports():
+    return sorted(glob.glob(os.path.join(APP_DIR, "output", "*.txt")))
+
+
+def run(runs):
+    sys.path.insert(0, APP_DIR)
+    reports = sample_reports()
+    workdir = tempfile.mkdtemp(prefix="bench_pdf_")
+    # PDF 写到临时目录；背景图由 asset_path 回退到模块目录，
+    # 字体度量文件里记录的是相对路径 fonts/simhei.ttf，因此把 fonts 链接过来
+    os.symlink(os.path.join(APP_DIR, "fonts"), os.path.join(workdir, "fonts"))
+    os.chdir(workdir)
+
+    import pdf
+    t0 = time.process_time()
+    pdf.warm_pdf_assets()
+    warm_cpu = time.process_time() - t0
+
+    cpu_times, sizes = [], []
+    for i in range(runs):
+        for report in reports:
+            t0 = time.process_time()
+            out = pdf.generate_pdf_from_txt(report, None, f"基准{i}")
+            cpu_times.append(time.process_time() - t0)
+            sizes.append(os.path.getsize(out))
+    cpu_times.sort()
+    return {
+        "asset_cache": pdf.ASSET_CACHE_ENABLED,
+        "renders": len(cpu_times),
+        "warm_cpu_s": round(warm_cpu, 4),
+        "cpu_mean_s": round(sum(cpu_times) / len(cpu_times), 4),
+        "cpu_p50_s": round(cpu_times[len(cpu_times) // 2], 4),
+        "size_mean_kb": round(sum(sizes) / len(sizes) / 1024, 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5, help="每份示例报告生成的次数")
+    ap.add_argument("--compare", action="store_true", help="分别在关闭 / 开启资源缓存的子进程中运行并对比")
+    args = ap.parse_args()
+
+    if not args.compare:
+        print(json.dumps(run(args.runs), ensure_ascii=False))
+        return
+
+    results = []
+    for flag in ("0", "1"):
+        env = dict(os.environ, PDF_ASSET_CACHE=flag)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--runs", str(args.runs)],
+                             env=env, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    before, after = results
+    for r in results:
+        print(json.dumps(r, ensure_ascii=False))
+    print(f"CPU/份: {before['cpu_mean_s']}s -> {after['cpu_mean_s']}s "
+          f"(x{before['cpu_mean_s'] / max(after['cpu_mean_s'], 1e-9):.1f})；"
+          f"体积: {before['size_mean_kb']}KB -> {after['size_mean_kb']}KB "
+          f"(x{before['size_mean_kb'] / max(after['size_mean_kb'], 1e-9):.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# benchmarks/bench_service.py
+"""
+服务端到端基准（离线）：启动本地模拟 DashScope（mock_dashscope.py）与真实的 Flask 服务，
+按指定并发驱动 /api/analyze（提交 + 轮询至完成）与 /web/analyze，统计：
+- 每个接口的端到端延迟 p50 / p95 / p99 与吞吐（请求/秒）；
+- 各阶段耗时 p50 / p95 / p99：upload（接收上传）、compression（压缩）、llm（模型调用）、pdf（生成 PDF）。
+结果保存为 JSON，--compare 可与之前的结果对比。
+
+每个请求上传内容不同的图片，避免被分析缓存 / 请求合并吸收；分析缓存关闭，模型限流关闭（可用 --rate-limit 保留）。
+
+用法（在 flower_of_life_app 目录下运行，需要 fonts/simhei.ttf 等资源）：
+    python benchmarks/bench_service.py --requests 40 --concurrency 8 --latency-ms 2000
+    python benchmarks/bench_service.py --out after.json --compare before.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_dashscope import MockDashScope  # noqa: E402
+
+STAGES = (("upload", "receive_upload"), ("compression", "compress_upload"),
+          ("llm", "analyze_report"), ("llm", "analyze_report_async"), ("pdf", "generate_pdf"))
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+    return {"count": len(values), "mean": round(sum(values) / len(values), 4),
+            "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class StageTimer:
+    """替换 app 模块中各阶段函数，记录每次调用的耗时。"""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage, _ in STAGES}
+        self._lock = threading.Lock()
+
+    def wrap(self, module):
+        for stage, attr in STAGES:
+            setattr(module, attr, self._timed(stage, getattr(module, attr)))
+
+    def _timed(self, stage, fn):
+        if asyncio.iscoroutinefunction(fn):
+            async def async_wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    with self._lock:
+                        self.samples[stage].append(time.perf_counter() - t0)
+            return async_wrapper
+
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples[stage].append(time.perf_counter() - t0)
+        return wrapper
+
+    def reset(self):
+        with self._lock:
+            for values in self.samples.values():
+                values.clear()
+
+    def report(self):
+        with self._lock:
+            return {stage: percentiles(values) for stage, values in self.samples.items()}
+
+
+def make_images(count, size):
+    """生成 count 张内容各不相同的 JPEG（随机色块），返回 bytes 列表。"""
+    from PIL import Image, ImageDraw
+    rng = random.Random(0)
+    images = []
+    for _ in range(count):
+        img = Image.new("RGB", (size, size), (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        for _ in range(60):
+            x, y, r = rng.randrange(size), rng.randrange(size), rng.randrange(20, size // 4)
+            draw.ellipse((x - r, y - r, x + r, y + r), outline=tuple(rng.randrange(256) for _ in range(3)), width=6)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def call_api(session, base, image, index, poll_interval):
+    resp = session.post(f"{base}/api/analyze", data={"name": f"基准{index}"},
+                        files={"image_file": (f"{index}.jpg", image, "image/jpeg")})
+    if resp.status_code != 202:
+        return False
+    task_id = resp.json()["task_id"]
+    while True:
+        status = session.get(f"{base}/api/task/{task_id}").json().get("status")
+        if status in ("completed", "failed"):
+            return status == "completed"
+        time.sleep(poll_interval)
+
+
+def call_web(session, base, image, index, poll_interval):
+    resp = session.post(f"{base}/web/analyze", data={"name": f"基准{index}", "image_option": "file"},
+                        files={"image_file": (f"{index}.jpg", image, "image/jpeg")})
+    return resp.ok and resp.json().get("success", False)
+
+
+ENDPOINTS = {"api": call_api, "web": call_web}
+
+
+def drive(base, endpoint, images, concurrency, poll_interval):
+    import requests
+    local = threading.local()
+
+    def one(index):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        t0 = time.perf_counter()
+        try:
+            ok = ENDPOINTS[endpoint](local.session, base, images[index], index, poll_interval)
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(len(images))))
+    wall = time.perf_counter() - t0
+    latencies = [seconds for ok, seconds in results if ok]
+    return {"latency": percentiles(latencies), "errors": len(results) - len(latencies),
+            "wall_s": round(wall, 3), "rps": round(len(latencies) / wall, 3) if wall else 0}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, previous_path):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    for endpoint, result in current["endpoints"].items():
+        before = previous.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        print(f"[{endpoint}] rps {before['rps']} -> {result['rps']}，"
+              f"p50 {before['latency'].get('p50')} -> {result['latency'].get('p50')}s，"
+              f"p95 {before['latency'].get('p95')} -> {result['latency'].get('p95')}s")
+        for stage, stats in result["stages"].items():
+            old = before.get("stages", {}).get(stage, {})
+            if stats.get("count") and old.get("count"):
+                print(f"    {stage}: p50 {old['p50']} -> {stats['p50']}s，p95 {old['p95']} -> {stats['p95']}s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--endpoints", default="api,web", help="要测试的接口，逗号分隔：api,web")
+    ap.add_argument("--requests", type=int, default=40, help="每个接口的请求数")
+    ap.add_argument("--concurrency", type=int, default=8, help="并发客户端数")
+    ap.add_argument("--image-size", type=int, default=1600, help="上传图片边长（像素）")
+    ap.add_argument("--latency-ms", type=float, default=2000, help="模拟模型的首字延迟中位数（毫秒）")
+    ap.add_argument("--latency-sigma", type=float, default=0.3)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="模拟模型返回 503 的比例")
+    ap.add_argument("--poll-interval", type=float, default=0.05, help="/api/task 轮询间隔（秒）")
+    ap.add_argument("--rate-limit", action="store_true", help="保留 LLM_RATE_PER_MINUTE 限流配置")
+    ap.add_argument("--label", default="", help="写入结果的标签（如版本号）")
+    ap.add_argument("--out", help="结果 JSON 路径（默认 bench_service_<时间>.json）")
+    ap.add_argument("--compare", help="与之前保存的结果 JSON 对比")
+    args = ap.parse_args()
+
+    out = os.path.abspath(args.out or f"bench_service_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    previous = os.path.abspath(args.compare) if args.compare else None
+
+    mock = MockDashScope(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                         error_rate=args.error_rate).start()
+    workdir = tempfile.mkdtemp(prefix="bench_service_")
+    os.environ.update({
+        "DASHSCOPE_BASE_URL": mock.base_url,
+        "DASHSCOPE_API_KEY": "mock",
+        "ANALYSIS_CACHE": "0",
+        "TASK_DB_PATH": os.path.join(workdir, "tasks.db"),
+    })
+    if not args.rate_limit:
+        os.environ["LLM_RATE_PER_MINUTE"] = "0"
+    # 输出写到临时目录；字体度量文件里记录的是相对路径 fonts/simhei.ttf，因此把 fonts 链接过来
+    os.symlink(os.path.join(APP_DIR, "fonts"), os.path.join(workdir, "fonts"))
+    os.chdir(workdir)
+
+    import app
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    timer = StageTimer()
+    timer.wrap(app)
+    server = make_server("127.0.0.1", 0, app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    results = {
+        "label": args.label,
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "env": {k: os.environ[k] for k in ("PDF_WORKERS", "ANALYSIS_MODE", "ANALYSIS_WORKERS", "LLM_MAX_CONCURRENCY")
+                if k in os.environ},
+        "endpoints": {},
+    }
+    for endpoint in args.endpoints.split(","):
+        images = make_images(args.requests, args.image_size)
+        timer.reset()
+        result = drive(base, endpoint, images, args.concurrency, args.poll_interval)
+        result["stages"] = timer.report()
+        results["endpoints"][endpoint] = result
+        print(json.dumps({endpoint: result}, ensure_ascii=False))
+
+    server.shutdown()
+    mock.stop()
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {out}")
+    if previous:
+        compare(results, previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/bench_thumbnail.py
+"""
+抬头小图基准：对比原先的做法（嵌入原图，带透明通道的 PNG 由 FPDF 自带的逐行正则拆分）
+与按 300dpi 缩略图嵌入（透明通道由 Pillow 拆分，见 pdf_assets._alpha_png_info）。
+
+输入为 output/ 下的样例图片、备用图 flower.png（不传用户图片时使用），以及一张合成的大尺寸照片
+（--photo-size，模拟手机拍摄的 JPEG）。每张图片用同一份样例报告渲染，统计：
+- pdf_kb：输出 PDF 大小；
+- render_ms：渲染耗时（create_pdf，含输出），取 --runs 次中的最小值；缩略图已生成时的稳定耗时；
+- thumb_ms：首次生成缩略图的耗时（之后重新渲染直接复用）；thumb：缩略图尺寸与格式。
+
+缩略图写入临时目录中的 artifacts 存储，不影响 output/。
+
+用法（在 flower_of_life_app 目录下运行，需要 fonts/simhei.ttf 等资源）：
+    python benchmarks/bench_thumbnail.py
+    python benchmarks/bench_thumbnail.py --runs 10 --photo-size 4000x3000
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+WORK_DIR = tempfile.mkdtemp(prefix="bench_thumbnail_")
+os.environ["ARTIFACT_DIR"] = os.path.join(WORK_DIR, "artifacts")
+
+import pdf  # noqa: E402
+import pdf_assets  # noqa: E402
+from report import Report  # noqa: E402
+
+
+def synthetic_photo(size):
+    """带渐变与噪点的大尺寸 JPEG（接近照片的压缩率）。"""
+    from PIL import Image, ImageFilter
+    width, height = size
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = Image.blend(gradient, noise, 0.5).filter(ImageFilter.GaussianBlur(1))
+    path = os.path.join(WORK_DIR, f"photo_{width}x{height}.jpg")
+    img.save(path, "JPEG", quality=92)
+    return path
+
+
+def render(report, image_path, runs):
+    out_path = os.path.join(WORK_DIR, "report.pdf")
+    best = None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        pdf.FlowerOfLifeReportConverter(report, image_path).create_pdf(out_path)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return {"pdf_kb": round(os.path.getsize(out_path) / 1024, 1), "render_ms": round(best * 1000, 1)}
+
+
+def describe(path):
+    from PIL import Image
+    with Image.open(path) as img:
+        return f"{img.width}x{img.height} {img.format} {os.path.getsize(path) / 1024:.0f}KB"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--photo-size", default="4032x3024", help="合成照片尺寸，WxH；设为 0 跳过")
+    args = ap.parse_args()
+
+    os.chdir(APP_DIR)
+    pdf.warm_pdf_assets()
+    samples = sorted(glob.glob(os.path.join("output", "生命之花分析报告-*.txt")))
+    if not samples:
+        print("output/ 下没有样例报告")
+        return 1
+    with open(samples[0], "r", encoding="utf-8") as f:
+        report = Report.from_text(f.read())
+
+    images = {os.path.basename(p): p for p in sorted(glob.glob(os.path.join("output", "*.jpg")) +
+                                                      glob.glob(os.path.join("output", "*.png")))}
+    images["flower.png（备用图）"] = None
+    if args.photo_size != "0":
+        size = tuple(int(v) for v in args.photo_size.lower().split("x"))
+        images[f"合成照片 {args.photo_size}"] = synthetic_photo(size)
+
+    dpi = pdf_assets.THUMBNAIL_DPI
+    alpha_png_info = pdf_assets._alpha_png_info
+    px = round(pdf.HEADER_IMAGE_SIZE / 25.4 * dpi)
+    for name, path in images.items():
+        source = path or pdf.asset_path("flower.png")
+        pdf_assets.THUMBNAIL_DPI, pdf_assets._alpha_png_info = 0, lambda *a, **k: None
+        before = render(report, path, args.runs)
+        pdf_assets.THUMBNAIL_DPI, pdf_assets._alpha_png_info = dpi, alpha_png_info
+        t0 = time.perf_counter()
+        thumb = pdf_assets.thumbnail_asset(source, pdf.HEADER_IMAGE_SIZE)
+        thumb_ms = (time.perf_counter() - t0) * 1000
+        after = render(report, path, args.runs)
+        print(f"{name}（{describe(source)}）\n  原图:   {before}\n  缩略图: {after}，thumb_ms={thumb_ms:.1f}，"
+              f"thumb={describe(thumb) if thumb != source else '沿用原图'}（目标 {px}px @ {dpi}dpi）\n"
+              f"  PDF x{before['pdf_kb'] / after['pdf_kb']:.1f} 更小，渲染 x{before['render_ms'] / after['render_ms']:.1f} 更快")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# benchmarks/bench_upload.py
+"""
+上传处理内存基准：对比旧流程（file.save 落盘 → PIL 识别格式 → 压缩 / 规范化 / 缓存键各自重新读盘）
+与 uploads.receive_upload（分块读取、边写盘边哈希，之后各环节共用同一份只读 mmap 与哈希）。
+
+每个样本、每种流程在独立子进程中运行，记录：
+- peak_rss_mb：进程峰值 RSS 相对导入完成后的增量；
+- traced_peak_mb：tracemalloc 统计的 Python 侧分配峰值；
+- seconds：从接收上传到得到 base64 数据的耗时。
+模型调用不在测量范围内。
+
+用法（在 flower_of_life_app 目录下运行）：
+    python benchmarks/bench_upload.py                 # 自动生成样本
+    python benchmarks/bench_upload.py --corpus 样本目录
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+MAX_SIZE_BYTES = 10 * 1024 * 1024
+
+
+def legacy_flow(path, output_dir):
+    """旧版 app.py 的上传处理：保存到临时文件、重新打开识别格式、之后每个环节各自读盘。"""
+    import base64
+    import shutil
+    import uuid
+
+    from PIL import Image
+
+    from analysis_cache import make_cache_key
+    from imaging import compress_image_if_needed, normalize_for_model
+
+    temp_path = os.path.join(output_dir, f"{uuid.uuid4()}_temp")
+    with open(path, 'rb') as src, open(temp_path, 'wb') as dst:  # file.save()
+        shutil.copyfileobj(src, dst)
+    with Image.open(temp_path) as img:
+        detected_type = img.format.lower()
+    image_path = temp_path + ('.jpg' if detected_type == 'jpeg' else '.' + detected_type)
+    os.rename(temp_path, image_path)
+
+    image_path = compress_image_if_needed(image_path, MAX_SIZE_BYTES)
+    make_cache_key(image_path, "prompt", "model")
+    data, mime = normalize_for_model(image_path)
+    return base64.b64encode(data).decode("ascii")
+
+
+def streaming_flow(path, output_dir):
+    """新流程：receive_upload → compress_upload → 用 mmap 中的内容与已算好的哈希做规范化和缓存键。"""
+    import base64
+
+    from werkzeug.datastructures import FileStorage
+
+    from analysis_cache import make_cache_key
+    from imaging import normalize_for_model
+    from artifacts import ArtifactStore
+    from uploads import compress_upload, receive_upload
+
+    store = ArtifactStore(output_dir)
+    with open(path, 'rb') as f:  # werkzeug 会把大请求体落到临时文件，这里用文件流模拟
+        image = receive_upload(FileStorage(stream=f, filename='upload'), store)
+    image = compress_upload(image, MAX_SIZE_BYTES, store)
+    make_cache_key(image.path, "prompt", "model", image.sha256)
+    data, mime = normalize_for_model(image.path, image.data, image.sha256)
+    return base64.b64encode(data).decode("ascii")
+
+
+FLOWS = {"legacy": legacy_flow, "streaming": streaming_flow}
+
+
+def peak_rss_kb():
+    """进程峰值 RSS（KB）。Linux 上 ru_maxrss 会跨 exec 继承父进程的峰值，优先读 /proc 的 VmHWM。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Linux 下单位为 KB
+
+
+def run_child(flow, path):
+    """子进程入口：运行一次指定流程并输出测量结果。"""
+    import time
+    import tracemalloc
+
+    import analysis_cache  # noqa: F401  先完成导入，基线 RSS 不含模块加载
+    import imaging  # noqa: F401
+    import uploads  # noqa: F401
+    from PIL import Image  # noqa: F401
+    from werkzeug.datastructures import FileStorage  # noqa: F401
+
+    output_dir = tempfile.mkdtemp(prefix="bench_upload_")
+    base_rss = peak_rss_kb()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    FLOWS[flow](path, output_dir)
+    seconds = time.perf_counter() - t0
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak_rss = peak_rss_kb()
+    print(json.dumps({
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round((peak_rss - base_rss) / 1024, 1),
+        "traced_peak_mb": round(traced_peak / 1024 / 1024, 1),
+    }))
+
+
+def make_corpus(directory):
+    """生成典型上传样本：手机照片（JPEG）、截图 / 扫描件（PNG）、超过 10MB 需要压缩的大图。"""
+    import numpy as np
+    from PIL import Image, ImageFilter
+
+    rng = np.random.default_rng(0)
+    specs = (("photo.jpg", (4032, 3024), {"quality": 92}),
+             ("scan.png", (2480, 3508), {"compress_level": 6}),
+             ("oversize.png", (6000, 4000), {"compress_level": 1}))
+    paths = []
+    for name, (w, h), options in specs:
+        base = rng.integers(0, 255, (h // 16, w // 16, 3), dtype=np.uint8)
+        img = Image.fromarray(base).resize((w, h), Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+        if name == "oversize.png":
+            noise = rng.integers(-40, 40, (h, w, 3))
+            img = Image.fromarray(np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8))
+        path = os.path.join(directory, name)
+        img.save(path, **options)
+        paths.append(path)
+    return paths
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", help="样本目录（*.png / *.jpg / *.jpeg），不指定则自动生成")
+    ap.add_argument("--child", nargs=2, metavar=("FLOW", "PATH"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    if args.corpus:
+        paths = sorted(p for ext in ("png", "jpg", "jpeg") for p in glob.glob(os.path.join(args.corpus, f"*.{ext}")))
+    else:
+        paths = make_corpus(tempfile.mkdtemp(prefix="bench_upload_corpus_"))
+
+    env = dict(os.environ, ANALYSIS_CACHE="0")
+    for path in paths:
+        row = {"file": os.path.basename(path), "source_mb": round(os.path.getsize(path) / 1024 / 1024, 1)}
+        for flow in FLOWS:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", flow, path],
+                                 cwd=APP_DIR, env=env, capture_output=True, text=True, check=True)
+            row[flow] = json.loads(out.stdout.strip().splitlines()[-1])
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# benchmarks/mock_dashscope.py
+"""
+本地模拟的 DashScope（OpenAI 兼容）接口，用于离线基准测试，不消耗真实调用额度。
+
+POST .../chat/completions：
+- 返回 output/生命之花分析报告-*.txt 中随机一份作为报告内容；
+- 首字延迟服从对数正态分布（中位数 --latency-ms，离散度 --latency-sigma）；
+- stream=true 时按 SSE 分块返回，块间隔由 --chunk-ms 控制；
+- --error-rate 按比例返回 503，用于观察重试与熔断。
+GET /stats：累计请求数、当前与峰值并发请求数（观察服务端实际同时发出了多少个模型调用）。
+
+单独运行：
+    python benchmarks/mock_dashscope.py --port 8089 --latency-ms 3000
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8089/v1 DASHSCOPE_API_KEY=mock python app.py
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK_CHARS = 40
+
+
+def load_reports():
+    reports = []
+    for path in sorted(glob.glob(os.path.join(APP_DIR, "output", "生命之花分析报告-*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            reports.append(f.read())
+    return reports or ["1. 图案结构解读\n这是一份模拟报告。\n"]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认 backlog 只有 5，上千个并发连接时会被拒绝
+    request_queue_size = 4096
+
+
+class MockDashScope:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=2000, latency_sigma=0.3, chunk_ms=20, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.chunk_ms = chunk_ms
+        self.error_rate = error_rate
+        self.reports = load_reports()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self.server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="mock-dashscope")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def first_token_delay(self):
+        if self.latency_ms <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, code, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if not self.path.endswith("/stats"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                with mock._lock:
+                    self._send_json(200, {"requests": mock.requests, "in_flight": mock.in_flight,
+                                          "peak_in_flight": mock.peak_in_flight})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                with mock._lock:
+                    mock.requests += 1
+                    mock.in_flight += 1
+                    mock.peak_in_flight = max(mock.peak_in_flight, mock.in_flight)
+                try:
+                    self._complete(request)
+                finally:
+                    with mock._lock:
+                        mock.in_flight -= 1
+
+            def _complete(self, request):
+                if random.random() < mock.error_rate:
+                    self._send_json(503, {"error": {"message": "mock overloaded"}})
+                    return
+
+                text = random.choice(mock.reports)
+                model = request.get("model", "mock")
+                time.sleep(mock.first_token_delay())
+                if not request.get("stream"):
+                    self._send_json(200, {
+                        "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i in range(0, len(text), CHUNK_CHARS):
+                    chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "finish_reason": None,
+                                                          "delta": {"content": text[i:i + CHUNK_CHARS]}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if mock.chunk_ms:
+                        time.sleep(mock.chunk_ms / 1000)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency-ms", type=float, default=2000, help="首字延迟中位数（毫秒）")
+    ap.add_argument("--latency-sigma", type=float, default=0.3, help="对数正态分布的离散度")
+    ap.add_argument("--chunk-ms", type=float, default=20, help="流式输出的块间隔（毫秒）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的比例")
+    args = ap.parse_args()
+    mock = MockDashScope(args.host, args.port, args.latency_ms, args.latency_sigma, args.chunk_ms, args.error_rate)
+    print(f"模拟服务已启动: {mock.base_url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# downloads.py
+"""
+报告文件的下载：强 ETag、Cache-Control、条件请求（304）与断点续传（Range）。
+
+- ETag 为文件内容的 sha256，在生成文件时计算一次（record_digest），记录在同目录的 <文件名>.etag 中，
+  一并记下文件大小与修改时间；下载时文件未变则直接读取，否则（旧文件、被覆盖）重新计算并更新。
+- 同名 PDF 可能被重新生成（同一姓名、同一天），默认 Cache-Control: no-cache，客户端 / CDN 每次
+  带 If-None-Match 回源验证，未变化时返回 304；DOWNLOAD_MAX_AGE 设为正数则允许在该时间内直接使用缓存。
+- DOWNLOAD_ACCEL 可把文件传输交给前端服务器，Flask worker 只返回响应头：
+  - sendfile：X-Sendfile: <绝对路径>（Apache mod_xsendfile / lighttpd）；
+  - accel：X-Accel-Redirect（nginx）。artifacts.py 分片目录中的文件为 <DOWNLOAD_ACCEL_PREFIX><相对 ARTIFACT_DIR 的路径>
+    （如 /protected-artifacts/reports/aa/bb/<文件名>），需配置 internal location 指向 ARTIFACT_DIR；
+    升级前平铺在 output/ 下、经 locate 回退找到的旧文件为 <DOWNLOAD_ACCEL_LEGACY_PREFIX><文件名>，
+    需另配置一个 internal location 指向 output 目录。例如：
+        location /protected-artifacts/ { internal; alias /srv/app/output/artifacts/; }
+        location /protected-output/    { internal; alias /srv/app/output/; }
+  此时 Range 由前端服务器处理，304 仍由这里判断。
+"""
+import hashlib
+import json
+import mimetypes
+import os
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+
+DOWNLOAD_MAX_AGE = int(os.environ.get("DOWNLOAD_MAX_AGE", "0"))
+DOWNLOAD_ACCEL = os.environ.get("DOWNLOAD_ACCEL", "").lower()  # "" / sendfile / accel
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "/protected-artifacts/")
+DOWNLOAD_ACCEL_LEGACY_PREFIX = os.environ.get("DOWNLOAD_ACCEL_LEGACY_PREFIX", "/protected-output/")
+DIGEST_SUFFIX = ".etag"
+CHUNK_SIZE = 1024 * 1024
+
+
+def _digest_path(path):
+    return path + DIGEST_SUFFIX
+
+
+def _compute_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def record_digest(path):
+    """计算文件内容的 sha256 并记录在 <path>.etag 中，返回十六进制摘要；生成文件后调用。"""
+    st = os.stat(path)
+    digest = _compute_digest(path)
+    # 计算期间文件被改写时不记录，下次下载时重新计算
+    if os.stat(path).st_mtime_ns == st.st_mtime_ns:
+        tmp_path = f"{_digest_path(path)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}, f)
+            os.replace(tmp_path, _digest_path(path))
+        except OSError as e:
+            print(f"警告: 写入 ETag 记录失败 {path}: {e}")
+    return digest
+
+
+def file_digest(path):
+    """文件内容的 sha256：记录与文件大小、修改时间一致时直接返回，否则重新计算并记录。"""
+    try:
+        with open(_digest_path(path), "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+        st = os.stat(path)
+        if recorded.get("size") == st.st_size and recorded.get("mtime_ns") == st.st_mtime_ns:
+            return recorded["sha256"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return record_digest(path)
+
+
+def is_digest_file(filename):
+    return filename.endswith(DIGEST_SUFFIX)
+
+
+def _cache_headers(response, etag):
+    response.set_etag(etag)
+    if DOWNLOAD_MAX_AGE > 0:
+        response.cache_control.public = True
+        response.cache_control.max_age = DOWNLOAD_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+
+
+def _accel_location(path):
+    """X-Accel-Redirect 的内部地址：分片目录中的文件带上相对路径，旧的平铺文件只用文件名。"""
+    from artifacts import store as artifact_store  # artifacts 导入本模块，这里延迟导入
+    rel = artifact_store.relative_path(path)
+    if rel is not None:
+        return DOWNLOAD_ACCEL_PREFIX + quote(rel)
+    return DOWNLOAD_ACCEL_LEGACY_PREFIX + quote(os.path.basename(path))
+
+
+def _accel_response(path, etag, as_attachment):
+    filename = os.path.basename(path)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        _cache_headers(response, etag)
+        return response
+    response = Response(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+    if DOWNLOAD_ACCEL == "accel":
+        response.headers["X-Accel-Redirect"] = _accel_location(path)
+    else:
+        response.headers["X-Sendfile"] = os.path.abspath(path)
+    if as_attachment:
+        response.headers.set("Content-Disposition", "attachment", **{"filename*": f"UTF-8''{quote(filename)}"})
+    _cache_headers(response, etag)
+    return response
+
+
+def send_download(path, as_attachment=True):
+    """发送 output 中的文件：带强 ETag 与缓存头，支持 If-None-Match（304）与 Range（206）。"""
+    etag = file_digest(path)
+    if DOWNLOAD_ACCEL in ("sendfile", "accel"):
+        return _accel_response(path, etag, as_attachment)
+    response = send_file(os.path.abspath(path), as_attachment=as_attachment, etag=etag, conditional=True,
+                         max_age=DOWNLOAD_MAX_AGE if DOWNLOAD_MAX_AGE > 0 else None)
+    # werkzeug 只在 206 响应中带 Accept-Ranges；完整响应也声明，客户端据此断点续传
+    if response.status_code == 200:
+        response.headers["Accept-Ranges"] = "bytes"
+    return response
@@ -0,0 +1,38 @@
+# gunicorn.conf.py
+"""
+生产环境入口（代替 app.py 末尾的调试服务器）：
+
+    gunicorn -c gunicorn.conf.py app:app
+
+- worker 类型为 gthread：每个 worker 进程用少量线程处理 HTTP 请求；
+- /api/analyze 提交后立即返回 202，分析在 worker 进程内的事件循环中以协程运行（ANALYSIS_MODE=async，
+  见 async_runtime.py），等待模型不占线程，一个 worker 可以同时挂着成千上万个分析；
+  阻塞步骤（压缩、PDF 渲染等）由 ASYNC_BLOCKING_WORKERS 个线程执行，PDF 可再交给渲染进程池（PDF_WORKERS）；
+- 不预加载应用（preload_app=False）：后台线程（事件循环、产物清理）与渲染进程池不能跨 fork 使用，
+  每个 worker 各自导入 app 并启动；任务状态存在共享的 SQLite（TASK_STORE，见 task_store.py），
+  轮询请求落到任何一个 worker 都能查到。
+
+配置（环境变量）：
+- GUNICORN_BIND：监听地址，默认 0.0.0.0:5000
+- GUNICORN_WORKERS：worker 进程数，默认 2
+- GUNICORN_THREADS：每个 worker 处理请求的线程数，默认 16（同步的 /web/analyze 与流式接口会占用线程直到结束）
+- GUNICORN_TIMEOUT：worker 无响应多久后重启（秒），默认 120
+- GUNICORN_KEEPALIVE：keep-alive 连接的空闲时间（秒），默认 5
+- GUNICORN_MAX_REQUESTS：每个 worker 处理多少个请求后平滑重启（0 表示不重启），默认 0
+- GUNICORN_ACCESS_LOG：访问日志路径（- 为标准输出），默认不记录
+"""
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+preload_app = False
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
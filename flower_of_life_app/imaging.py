@@ -0,0 +1,264 @@
+# imaging.py
+"""
+图片处理：上传图片压缩、送入视觉模型前的规范化。
+
+compress_image_if_needed 只在文件超过大小上限时介入：
+1. JPEG 源图用 Image.draft 在解码阶段直接按 2 的幂缩小（跳过全分辨率解码）；
+2. 先缩到视觉模型实际使用的分辨率（长边 VISION_MAX_EDGE），更高的分辨率模型也会缩掉；
+3. 超出不多时对质量做二分查找（不低于 60），而不是从 85 每次减 5 逐个尝试；
+4. 超出较多时用试编码估算 字节/像素，按比例预测尺寸，通常 1~2 次编码即可落在上限内。
+
+normalize_for_model 在上传给模型前把图片缩到模型实际使用的像素数以内、去掉元数据、
+选择合适的编码（色彩少的图用 PNG，照片用 JPEG）并给出正确的 MIME；结果按源文件哈希缓存。
+"""
+import hashlib
+import io
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+import metrics
+
+# 视觉模型使用的最大边长（像素），超过部分对分析没有帮助
+VISION_MAX_EDGE = int(os.environ.get("VISION_MAX_EDGE", "2048"))
+DEFAULT_QUALITY = 85
+MIN_QUALITY = 10
+# qwen-vl 系列默认最多使用 1280 个 28x28 的图块，超过的像素会被模型侧缩掉，上传只是浪费带宽和时间
+VISION_MAX_PIXELS = int(os.environ.get("VISION_MAX_PIXELS", str(1280 * 28 * 28)))
+MODEL_JPEG_QUALITY = int(os.environ.get("MODEL_JPEG_QUALITY", "85"))
+# 尺寸合适、无元数据且每像素不超过该字节数的 JPEG / PNG 直接使用，不再重新编码
+PASSTHROUGH_BYTES_PER_PIXEL = 0.5
+NORMALIZED_CACHE_BYTES = int(os.environ.get("NORMALIZED_CACHE_MB", "64")) * 1024 * 1024
+# 降质量的下限：低于此质量画面损失明显，宁可缩小尺寸
+QUALITY_FLOOR = 60
+# 体积超出不多（目标/当前 ≥ 0.5）时只调质量；否则先按比例缩小尺寸
+QUALITY_SEARCH_MIN_RATIO = 0.5
+# 以 q85 的体积为 1，各质量下的大致体积比（照片类图片的经验值），用于预测质量
+QUALITY_SIZE_RATIOS = ((80, 0.83), (75, 0.72), (70, 0.64), (65, 0.58), (60, 0.53))
+
+
+def _encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _to_rgb(img):
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        # 透明区域铺白底，避免转 RGB 后变黑
+        rgba = img.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _fit_edge(img, max_edge):
+    width, height = img.size
+    if max(width, height) <= max_edge:
+        return img
+    ratio = max_edge / max(width, height)
+    # reducing_gap：先用整数倍 reduce 快速缩小，再做 LANCZOS，速度接近 draft、质量几乎不变
+    return img.resize((max(1, round(width * ratio)), max(1, round(height * ratio))),
+                      Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def compress_to_limit(source, max_size_bytes, max_edge=VISION_MAX_EDGE):
+    """
+    将图片压缩为不超过 max_size_bytes 的 JPEG。
+    source 为文件路径或类文件对象；返回 (jpeg_bytes, 编码次数)。
+    """
+    with Image.open(source) as img:
+        if img.format == 'JPEG':
+            # draft 只能按 1/2、1/4、1/8 缩小，保证结果仍不小于目标尺寸
+            scale = max_edge / max(img.size)
+            if scale < 1:
+                img.draft('RGB', (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+        img = _fit_edge(_to_rgb(img), max_edge)
+
+    encodes = 1
+    data = _encode_jpeg(img, DEFAULT_QUALITY)
+
+    while len(data) > max_size_bytes:
+        ratio = max_size_bytes / len(data)
+        if ratio >= QUALITY_SEARCH_MIN_RATIO or min(img.size) <= 16:
+            # 差距不大：先按经验曲线预测质量试编码一次，不满足再在 [下限, 预测值) 区间二分查找
+            low = QUALITY_FLOOR if ratio >= QUALITY_SEARCH_MIN_RATIO else MIN_QUALITY
+            guess = _predict_quality(ratio, low)
+            candidate = _encode_jpeg(img, guess)
+            encodes += 1
+            if len(candidate) <= max_size_bytes:
+                return candidate, encodes
+            best, more = _search_quality(img, max_size_bytes, low, guess - 1)
+            encodes += more
+            if best is not None or min(img.size) <= 16:
+                return (best if best is not None else data), encodes
+            ratio = QUALITY_SEARCH_MIN_RATIO / 2
+        # 差距较大：字节数与像素数近似成正比，按比例预测尺寸（留 5% 余量）后重新编码
+        scale = (ratio ** 0.5) * 0.95
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                         Image.Resampling.LANCZOS, reducing_gap=3.0)
+        data = _encode_jpeg(img, DEFAULT_QUALITY)
+        encodes += 1
+    return data, encodes
+
+
+def _predict_quality(ratio, low):
+    """按 目标体积 / q85 体积 的比例，从经验曲线中取预计刚好满足上限的质量。"""
+    for quality, size_ratio in QUALITY_SIZE_RATIOS:
+        if quality >= low and size_ratio <= ratio * 0.97:
+            return quality
+    return low
+
+
+def _search_quality(img, max_size_bytes, lo, hi):
+    """二分查找不超过上限的最高质量，返回 (jpeg_bytes 或 None, 编码次数)。"""
+    best, encodes = None, 0
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        candidate = _encode_jpeg(img, quality)
+        encodes += 1
+        if len(candidate) <= max_size_bytes:
+            best, lo = candidate, quality + 1
+        else:
+            hi = quality - 1
+    return best, encodes
+
+
+def compress_image_if_needed(image_path, max_size_bytes=10 * 1024 * 1024):
+    """
+    如果图片超过指定大小，则进行压缩；返回压缩后的文件路径（<原名>_compressed.jpg），
+    未超限或压缩失败时返回原路径。
+    """
+    if not os.path.exists(image_path):
+        return image_path
+
+    # 检查文件大小
+    if os.path.getsize(image_path) <= max_size_bytes:
+        return image_path  # 文件大小已经在限制内
+
+    try:
+        with metrics.span("compress"):
+            data, _ = compress_to_limit(image_path, max_size_bytes)
+        compressed_path = os.path.splitext(image_path)[0] + '_compressed.jpg'
+        with open(compressed_path, 'wb') as f:
+            f.write(data)
+        return compressed_path
+    except Exception as e:
+        print(f"图片压缩失败: {e}")
+        return image_path  # 返回原始路径，让后续处理决定
+
+
+_normalized_cache = OrderedDict()  # 源文件 sha256 -> (bytes, mime)
+_normalized_bytes = 0
+_normalized_lock = threading.Lock()
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'BMP': 'image/bmp', 'WEBP': 'image/webp'}
+
+# 文件头魔数 -> 格式（上传与网络图片只接受这几种，见 uploads.py / remote_images.py）
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+
+def sniff_format(head):
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def _cache_normalized(key, value):
+    global _normalized_bytes
+    with _normalized_lock:
+        if key in _normalized_cache:
+            return
+        _normalized_cache[key] = value
+        _normalized_bytes += len(value[0])
+        while _normalized_bytes > NORMALIZED_CACHE_BYTES and _normalized_cache:
+            _, (data, _) = _normalized_cache.popitem(last=False)
+            _normalized_bytes -= len(data)
+
+
+def _open_buffer(data):
+    """bytes 包一层 BytesIO；mmap 本身就是类文件对象，直接交给 PIL 读取，避免复制。"""
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        return data
+    return io.BytesIO(data)
+
+
+def normalize_image_bytes(data, max_pixels=VISION_MAX_PIXELS):
+    """
+    将原始图片内容（bytes 或只读 mmap）规范化为适合上传模型的 (bytes, mime)：
+    - 按 EXIF 方向摆正，像素数缩到 max_pixels 以内；
+    - 重新编码以去掉 EXIF / ICC 等元数据；色彩不超过 256 种的图（线稿、色块画）用 PNG，其余用 JPEG；
+    - 已经是小尺寸、无元数据的 JPEG / PNG 直接原样使用。
+    """
+    with Image.open(_open_buffer(data)) as img:
+        source_format = img.format
+        has_metadata = bool(img.info.get('exif') or img.info.get('icc_profile') or img.getexif())
+        pixels = img.width * img.height
+        reusable = source_format in ('JPEG', 'PNG') and pixels <= max_pixels and not has_metadata
+        if reusable and len(data) <= pixels * PASSTHROUGH_BYTES_PER_PIXEL:
+            return bytes(data), MIME_TYPES[source_format]
+
+        if source_format == 'JPEG' and pixels > max_pixels:
+            scale = (max_pixels / pixels) ** 0.5
+            img.draft('RGB', (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+        img = ImageOps.exif_transpose(img)
+        if img.width * img.height > max_pixels:
+            scale = (max_pixels / (img.width * img.height)) ** 0.5
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                             Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        buffer = io.BytesIO()
+        if img.mode in ('P', 'L', '1') or img.getcolors(256) is not None:
+            if img.mode not in ('P', 'L', '1'):
+                img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+                img = img.quantize(256) if img.mode == 'RGB' else img
+            img.save(buffer, format='PNG', optimize=True)
+            result = buffer.getvalue(), 'image/png'
+        else:
+            _to_rgb(img).save(buffer, format='JPEG', quality=MODEL_JPEG_QUALITY, optimize=True)
+            result = buffer.getvalue(), 'image/jpeg'
+    # 重新编码反而更大时沿用原图
+    if reusable and len(result[0]) >= len(data):
+        return bytes(data), MIME_TYPES[source_format]
+    return result
+
+
+def normalize_for_model(image_path, data=None, sha256=None):
+    """
+    规范化本地图片（见 normalize_image_bytes），结果按内容哈希缓存。
+    调用方已持有图片内容 / 哈希（如刚接收的上传）时直接传入，避免重复读盘与哈希。
+    """
+    if data is None:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+    key = sha256 or hashlib.sha256(data).hexdigest()
+    with _normalized_lock:
+        cached = _normalized_cache.get(key)
+        if cached is not None:
+            _normalized_cache.move_to_end(key)
+            return cached
+    try:
+        result = normalize_image_bytes(data)
+    except Exception as e:
+        # 无法解码时按文件头识别的真实格式原样上传，由模型接口决定是否接受；格式也无法识别时拒绝
+        fmt = sniff_format(bytes(data[:16]))
+        if fmt is None:
+            raise ValueError(f"无法识别的图片格式: {e}") from e
+        print(f"图片规范化失败，按原图上传（{fmt}）: {e}")
+        result = (bytes(data), f'image/{fmt}')
+    _cache_normalized(key, result)
+    return result
@@ -0,0 +1,447 @@
+# llm_gateway.py
+"""
+大模型调用网关：所有对 DashScope（OpenAI 兼容接口）的调用都经过这里。
+
+- 连接池：同步 / 异步各一个共享的 httpx 客户端（keep-alive），避免每次调用重新建连；
+- 并发上限：同时进行的模型调用数不超过 LLM_MAX_CONCURRENCY，多余的按到达顺序排队等待
+  （同步与 asyncio 调用方共用名额，排队的协程不占线程）；
+- 速率限制：令牌桶，按配额（每分钟请求数 + 突发量）放行，排队时间计入调用截止时间；
+- 重试：429 / 5xx / 连接错误 / 超时按指数退避 + 随机抖动重试，服务端给出 Retry-After 时优先使用；
+  其他 4xx（参数错误、鉴权失败等）不重试；
+- 截止时间：每次调用有总时限（含排队、重试与退避），单次尝试的超时不会超过剩余时间；
+- 熔断：连续失败达到阈值后在冷却期内直接失败，不再打到上游；冷却结束后放行一个探测请求，
+  成功则恢复，失败则继续熔断。
+
+同步调用方（Flask 线程池）使用 chat / stream，asyncio 调用方使用 achat。
+
+配置（环境变量）：
+- LLM_MAX_CONNECTIONS：连接池大小，默认 20
+- LLM_MAX_CONCURRENCY：并发调用上限，默认 8
+- LLM_RATE_PER_MINUTE / LLM_BURST：令牌桶速率与容量，默认 60 / 10；速率为 0 表示不限速
+- LLM_MAX_RETRIES：最多重试次数，默认 4
+- LLM_BACKOFF_BASE / LLM_BACKOFF_MAX：退避基数与上限（秒），默认 1 / 30
+- LLM_CONNECT_TIMEOUT / LLM_READ_TIMEOUT：连接超时与单次读超时（秒），默认 10 / 120
+- LLM_DEADLINE：单次调用总时限（秒），默认 300
+- LLM_BREAKER_FAILURES / LLM_BREAKER_COOLDOWN：熔断阈值（连续失败次数）与冷却时间（秒），默认 5 / 30
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+from openai import (APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, OpenAI,
+                    RateLimitError)
+
+
+class LLMUnavailableError(RuntimeError):
+    """熔断中，或在截止时间内无法取得调用配额。"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """调用（含排队与重试）超过了截止时间。"""
+
+
+class TokenBucket:
+    """
+    令牌桶。reserve() 预占一个令牌并返回需要等待的秒数（令牌可以预支为负数），
+    同步与异步调用方共用同一个桶，各自用 time.sleep / asyncio.sleep 等待。
+    """
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """预占一个令牌，返回需等待的秒数；等待时间会超过 max_wait 时不预占，返回 None。"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class ConcurrencyLimiter:
+    """
+    并发名额，同步（线程）与 asyncio 调用方共用，按到达顺序（FIFO）分配。
+    释放名额时直接交给队首的等待者：线程等待者用 Event 唤醒，协程等待者由 call_soon_threadsafe 唤醒，
+    等待中的协程不占用任何线程（原先 achat 在名额不足时用 asyncio.to_thread 阻塞等待，每个排队的调用占一个线程）。
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        return False
+
+    def acquire(self, timeout=None):
+        """同步获取名额，超时返回 False。"""
+        with self._lock:
+            if self._try_acquire():
+                return True
+            waiter = _ThreadWaiter()
+            self._waiters.append(waiter)
+        waiter.event.wait(timeout)
+        return self._settle(waiter)
+
+    async def aacquire(self, timeout=None):
+        """asyncio 版本的 acquire；等待期间被取消时交还已分到的名额。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire():
+                return True
+            waiter = _AsyncWaiter(loop)
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter.future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if self._settle(waiter):
+                self.release()
+            raise
+        return self._settle(waiter)
+
+    def _settle(self, waiter):
+        """等待结束（唤醒或超时）：已分到名额返回 True，否则移出队列返回 False。"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # 名额直接移交，active 不变
+                self._waiters.popleft().grant()
+            else:
+                self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"active": self.active, "waiting": len(self._waiters)}
+
+
+class _ThreadWaiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.event.set()
+
+
+class _AsyncWaiter:
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed -> open（冷却）-> half_open（放行一个探测请求）-> closed / open。"""
+
+    def __init__(self, failure_threshold=5, cooldown=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def abandon(self):
+        """放行后调用并未真正发出（排队超时等），交还探测名额。"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def is_retryable(error):
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def counts_as_failure(error):
+    """计入熔断的失败：上游不可用（5xx、连接失败、超时）；429 与其他 4xx 不算。"""
+    return is_retryable(error) and not isinstance(error, RateLimitError)
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return max(0.0, float(response.headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    def __init__(self, api_key, base_url, max_connections=20, max_concurrency=8,
+                 rate_per_minute=60, burst=10, max_retries=4, backoff_base=1.0, backoff_max=30.0,
+                 connect_timeout=10.0, read_timeout=120.0, deadline=300.0,
+                 breaker_failures=5, breaker_cooldown=30.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self._limits = httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections)
+        # 重试由网关统一负责，SDK 自带的重试关闭
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                             http_client=httpx.Client(limits=self._limits))
+        self._async_client = None
+        self.slots = ConcurrencyLimiter(max_concurrency)
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0  # 熔断或配额等待超时而未发出的调用
+
+    @property
+    def async_client(self):
+        # httpx.AsyncClient 需要在事件循环中使用，首次异步调用时再创建
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0,
+                                             http_client=httpx.AsyncClient(limits=self._limits))
+        return self._async_client
+
+    # ---------- 公共步骤 ----------
+
+    def _count(self, field):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _deadline_at(self, deadline):
+        return time.monotonic() + (deadline if deadline is not None else self.deadline)
+
+    def _remaining(self, deadline_at):
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError("模型调用超时")
+        return remaining
+
+    def _attempt_timeout(self, deadline_at):
+        remaining = self._remaining(deadline_at)
+        return httpx.Timeout(min(self.read_timeout, remaining), connect=min(self.connect_timeout, remaining))
+
+    def _admit(self, deadline_at):
+        """熔断检查 + 预占令牌，返回需等待的秒数。"""
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise LLMUnavailableError("模型服务暂时不可用，请稍后再试")
+        try:
+            wait = self.bucket.reserve(max_wait=self._remaining(deadline_at))
+        except DeadlineExceededError:
+            self.breaker.abandon()
+            raise
+        if wait is None:
+            self.breaker.abandon()
+            self._count("rejected")
+            raise LLMUnavailableError("模型调用排队超时，请稍后再试")
+        return wait
+
+    def _backoff(self, attempt, error, deadline_at):
+        """返回下次重试前的等待秒数；不再重试时返回 None。"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # full jitter：在 [0, min(上限, 基数 * 2^n)] 内随机，避免大量请求同时重试
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if time.monotonic() + delay >= deadline_at:
+            return None
+        return delay
+
+    def _record(self, error):
+        if error is None:
+            self.breaker.record_success()
+        else:
+            self._count("failures")
+            if counts_as_failure(error):
+                self.breaker.record_failure()
+            elif not is_retryable(error):
+                # 4xx 说明上游是正常响应的，探测请求也算成功
+                self.breaker.record_success()
+
+    def _acquire_slot(self, deadline_at):
+        if not self.slots.acquire(timeout=self._remaining(deadline_at)):
+            self._count("rejected")
+            raise LLMUnavailableError("模型调用排队超时，请稍后再试")
+
+    # ---------- 同步接口 ----------
+
+    def chat(self, model, messages, deadline=None, **kwargs):
+        """同步调用 chat.completions.create（非流式），返回 completion 对象。"""
+        deadline_at = self._deadline_at(deadline)
+        self._acquire_slot(deadline_at)
+        try:
+            return self._call_with_retry(deadline_at, model=model, messages=messages, **kwargs)
+        finally:
+            self.slots.release()
+
+    def stream(self, model, messages, deadline=None, **kwargs):
+        """
+        同步流式调用，逐个产出 chunk。只在收到第一个 chunk 前重试；
+        流式输出期间一直占用一个并发名额。
+        """
+        deadline_at = self._deadline_at(deadline)
+        self._acquire_slot(deadline_at)
+        try:
+            response = self._call_with_retry(deadline_at, model=model, messages=messages, stream=True, **kwargs)
+            try:
+                yield from response
+            except Exception as e:
+                self._record(e)
+                raise
+        finally:
+            self.slots.release()
+
+    def _call_with_retry(self, deadline_at, **kwargs):
+        attempt = 0
+        while True:
+            wait = self._admit(deadline_at)
+            if wait:
+                time.sleep(wait)
+            self._count("calls")
+            try:
+                result = self.client.chat.completions.create(timeout=self._attempt_timeout(deadline_at), **kwargs)
+            except Exception as e:
+                self._record(e)
+                delay = self._backoff(attempt, e, deadline_at)
+                if delay is None:
+                    raise
+                print(f"模型调用失败，{delay:.1f} 秒后重试（第 {attempt + 1} 次）: {e}")
+                self._count("retries")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._record(None)
+            return result
+
+    # ---------- 异步接口 ----------
+
+    async def achat(self, model, messages, deadline=None, **kwargs):
+        """asyncio 版本的 chat，行为一致（共用令牌桶、并发名额与熔断状态）。"""
+        deadline_at = self._deadline_at(deadline)
+        if not await self.slots.aacquire(timeout=self._remaining(deadline_at)):
+            self._count("rejected")
+            raise LLMUnavailableError("模型调用排队超时，请稍后再试")
+        try:
+            attempt = 0
+            while True:
+                wait = self._admit(deadline_at)
+                if wait:
+                    await asyncio.sleep(wait)
+                self._count("calls")
+                try:
+                    result = await self.async_client.chat.completions.create(
+                        timeout=self._attempt_timeout(deadline_at), model=model, messages=messages, **kwargs)
+                except Exception as e:
+                    self._record(e)
+                    delay = self._backoff(attempt, e, deadline_at)
+                    if delay is None:
+                        raise
+                    self._count("retries")
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self._record(None)
+                return result
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        slots = self.slots.stats()
+        with self._stats_lock:
+            return {
+                "active": slots["active"],
+                "waiting": slots["waiting"],
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "circuit": self.breaker.state,
+            }
+
+
+def create_llm_gateway(api_key, base_url):
+    """按环境变量（见模块说明）创建网关。"""
+    env = os.environ.get
+    return LLMGateway(
+        api_key, base_url,
+        max_connections=int(env("LLM_MAX_CONNECTIONS", "20")),
+        max_concurrency=int(env("LLM_MAX_CONCURRENCY", "8")),
+        rate_per_minute=float(env("LLM_RATE_PER_MINUTE", "60")),
+        burst=int(env("LLM_BURST", "10")),
+        max_retries=int(env("LLM_MAX_RETRIES", "4")),
+        backoff_base=float(env("LLM_BACKOFF_BASE", "1")),
+        backoff_max=float(env("LLM_BACKOFF_MAX", "30")),
+        connect_timeout=float(env("LLM_CONNECT_TIMEOUT", "10")),
+        read_timeout=float(env("LLM_READ_TIMEOUT", "120")),
+        deadline=float(env("LLM_DEADLINE", "300")),
+        breaker_failures=int(env("LLM_BREAKER_FAILURES", "5")),
+        breaker_cooldown=float(env("LLM_BREAKER_COOLDOWN", "30")),
+    )
@@ -0,0 +1,235 @@
+# metrics.py
+"""
+进程内指标与请求追踪。
+
+- span(stage)：记录一个处理阶段的耗时，计入直方图 flower_stage_seconds{stage=...}，
+  抛出异常时另计 flower_stage_errors_total；处于某个 trace 中时同时记入该 trace。
+- inc(name, value, **labels)：计数器，如上传字节数。
+- register_collector(fn)：导出时回调，用于把各模块已有的统计（缓存命中、重试次数、队列长度等）
+  转成指标，避免在热路径上重复计数。fn 返回 (名称, 类型, 说明, 标签字典, 值) 的可迭代对象。
+- trace(name, **attrs)：一次请求 / 后台任务的追踪上下文；METRICS_TRACE=1 时结束后输出一行 JSON，
+  包含各阶段的起始偏移与耗时；METRICS_TRACE_MIN_SECONDS 只输出总耗时超过阈值的追踪（用于排查 p99）。
+
+render_prometheus() 输出 Prometheus 文本格式（/metrics）。指标按进程统计，多 worker 部署时由抓取端汇总。
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+PREFIX = "flower_"
+TRACE_LOG = os.environ.get("METRICS_TRACE", "0") == "1"
+TRACE_MIN_SECONDS = float(os.environ.get("METRICS_TRACE_MIN_SECONDS", "0"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}        # name -> (type, help)
+        self._counters = {}    # (name, label_key) -> value
+        self._histograms = {}  # (name, label_key) -> _Histogram
+        self._collectors = []
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._help:
+            self._help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, help="", **labels):
+        key = (PREFIX + name, _label_key(labels))
+        with self._lock:
+            self._declare(key[0], "counter", help)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, help="", **labels):
+        key = (PREFIX + name, _label_key(labels))
+        with self._lock:
+            self._declare(key[0], "histogram", help)
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = _Histogram()
+            hist.observe(value)
+
+    def register_collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self):
+        families = {}  # name -> (type, help, [lines])
+
+        def family(name, kind, help_text):
+            if name not in families:
+                families[name] = (kind, help_text, [])
+            return families[name][2]
+
+        with self._lock:
+            for (name, label_key), value in self._counters.items():
+                kind, help_text = self._help[name]
+                family(name, kind, help_text).append(f"{name}{_format_labels(label_key)} {_format_value(value)}")
+            for (name, label_key), hist in self._histograms.items():
+                kind, help_text = self._help[name]
+                lines = family(name, kind, help_text)
+                cumulative = 0
+                for bound, n in zip(BUCKETS, hist.buckets):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(label_key, [('le', repr(float(bound)))])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(label_key, [('le', '+Inf')])} {hist.count}")
+                lines.append(f"{name}_sum{_format_labels(label_key)} {hist.sum!r}")
+                lines.append(f"{name}_count{_format_labels(label_key)} {hist.count}")
+            collectors = list(self._collectors)
+
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"指标采集失败 {getattr(collector, '__name__', collector)}: {e}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                name = PREFIX + name
+                family(name, kind, help_text).append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+
+        out = []
+        for name in sorted(families):
+            kind, help_text, lines = families[name]
+            if help_text:
+                out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+register_collector = registry.register_collector
+render_prometheus = registry.render
+
+_current_trace = contextvars.ContextVar("flower_trace", default=None)
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "attrs", "spans", "started")
+
+    def __init__(self, name, attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.started = time.perf_counter()
+
+
+def start_trace(name, **attrs):
+    """开始追踪，返回 token（交给 finish_trace）；用于无法使用 with 的场景（如 Flask 请求钩子）。"""
+    return _current_trace.set(Trace(name, attrs))
+
+
+def finish_trace(token, **attrs):
+    current = _current_trace.get()
+    try:
+        _current_trace.reset(token)
+    except ValueError:
+        # token 来自另一个上下文（如流式响应在生成器里结束请求）
+        _current_trace.set(None)
+    if current is None:
+        return
+    elapsed = time.perf_counter() - current.started
+    if TRACE_LOG and elapsed >= TRACE_MIN_SECONDS:
+        print(json.dumps({
+            "trace_id": current.trace_id,
+            "name": current.name,
+            "seconds": round(elapsed, 4),
+            **current.attrs, **attrs,
+            "spans": [{"stage": stage, "offset": round(offset, 4), "seconds": round(seconds, 4), **({"error": True} if error else {})}
+                      for stage, offset, seconds, error in current.spans],
+        }, ensure_ascii=False))
+
+
+@contextlib.contextmanager
+def trace(name, **attrs):
+    token = start_trace(name, **attrs)
+    try:
+        yield _current_trace.get()
+    finally:
+        finish_trace(token)
+
+
+def singleflight_collector(flight):
+    """把 SingleFlight.stats() 转成指标的采集函数。"""
+    def collect():
+        stats = flight.stats()
+        labels = {"name": flight.name}
+        yield "singleflight_executed_total", "counter", "实际执行的调用次数", labels, stats["executed"]
+        yield "singleflight_coalesced_total", "counter", "被合并（共享结果）的调用次数", labels, stats["coalesced"]
+        yield "singleflight_in_flight", "gauge", "正在执行的调用数", labels, stats["in_flight"]
+    return collect
+
+
+def current_trace_id():
+    current = _current_trace.get()
+    return current.trace_id if current else None
+
+
+def record(stage, seconds, started=None, error=False):
+    """记录一个已知耗时的阶段（如排队等待）；started 为 time.perf_counter() 起点，默认按刚结束计算。"""
+    if started is None:
+        started = time.perf_counter() - seconds
+    observe("stage_seconds", seconds, help="各处理阶段耗时（秒）", stage=stage)
+    if error:
+        inc("stage_errors_total", help="各处理阶段抛出异常的次数", stage=stage)
+    current = _current_trace.get()
+    if current is not None:
+        current.spans.append((stage, started - current.started, seconds, error))
+
+
+@contextlib.contextmanager
+def span(stage):
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, started, error)
@@ -0,0 +1,248 @@
+# near_duplicates.py
+"""
+近似重复图片检测：同一幅画重新拍照、重新裁剪或重新压缩后再次上传时，复用之前的分析结果。
+
+分析缓存（analysis_cache.py）按图片内容的 sha256 命中，字节有任何变化（包括 compress_upload 生成的
+_compressed 副本）都会错过。这里为每张经模型分析过的图片计算感知哈希，记录“哈希 -> 分析缓存键”，
+精确缓存未命中时按汉明距离查找相近的图片，距离不超过阈值时直接使用那张图片缓存的报告文本，不再调用模型。
+
+- 哈希（PIL + NumPy）：按 EXIF 摆正、透明背景铺白、转灰度缩小后，先裁掉与边框颜色相同的留白
+  （重新拍照 / 重新裁剪改变的多是画纸边距），再缩到 9x9 计算横向与纵向的差值哈希（dHash），共 128 位。
+  重新压缩、缩放、亮度变化、边距变化的距离通常在 0~6，轻微旋转约 10，不同的画在 45 以上。
+  几乎纯色的图片（差值都是噪声）不计算哈希；网络图片只用已缓存的本地副本计算（查找时不下载，
+  首次提交时通常只能在模型返回后、图片已预取完成时登记）；
+- 查找：每组（提示词 + 模型）一个多索引哈希表，只核对至少有一段接近的候选，不必逐个比较；
+- 存储：SQLite（NEAR_DUPLICATE_DB），启动时载入，之后按自增 id 增量读取其他进程新写入的记录；
+- 只记录模型实际返回的结果（复用得到的结果不再登记，避免相似链条一路传递）；
+  复用的报告文本另以本图的精确缓存键写入分析缓存，同一张图再次提交时直接精确命中。
+
+依赖分析缓存保存报告文本：ANALYSIS_CACHE=0 时不启用；被缓存淘汰的记录查到后会跳过。
+
+配置（环境变量）：
+- NEAR_DUPLICATE：设为 0 关闭，默认开启
+- NEAR_DUPLICATE_THRESHOLD：汉明距离阈值（128 位中不同的位数），默认 12
+- NEAR_DUPLICATE_DB：索引库路径，默认 output/cache/near_duplicates.db
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from itertools import combinations
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import metrics
+from analysis_cache import is_remote
+from imaging import _open_buffer
+from remote_images import cached_image_path
+
+HASH_SIZE = 8              # 每个方向 8x8 个差值，共 128 位
+TRIM_SIZE = 256            # 裁白边前先缩到这个尺寸以内
+TRIM_TOLERANCE = 24        # 与边框中位灰度相差超过该值的像素算作画面内容
+MIN_STDDEV = 2.0           # 低于该灰度标准差的图片视为纯色，不计算哈希
+MEMO_ITEMS = 1024
+CHUNKS = 8                 # 多索引哈希的分段数（每段 16 位）
+CHUNK_BITS = HASH_SIZE * HASH_SIZE * 2 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+class MultiIndexHash:
+    """
+    多索引哈希（multi-index hashing）：把 128 位哈希切成 CHUNKS 段，每段一张“段值 -> 哈希”的表。
+    两个哈希相差不超过 r 位时，按抽屉原理至少有一段相差不超过 r // CHUNKS 位，
+    所以只需查询每段本身及翻转至多 r // CHUNKS 位的段值，再对候选逐个核对距离。
+    （128 位哈希两两距离集中在 64 附近，BK 树在这种分布下几乎剪不掉子树，不比逐个比较快。）
+    """
+    __slots__ = ("tables", "values", "size")
+
+    def __init__(self):
+        self.tables = [{} for _ in range(CHUNKS)]  # 段值 -> set(哈希)
+        self.values = {}  # 哈希 -> [value]
+        self.size = 0
+
+    @staticmethod
+    def _chunks(value_hash):
+        return [(value_hash >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def add(self, value_hash, value):
+        self.size += 1
+        if value_hash in self.values:
+            self.values[value_hash].append(value)
+            return
+        self.values[value_hash] = [value]
+        for table, chunk in zip(self.tables, self._chunks(value_hash)):
+            table.setdefault(chunk, set()).add(value_hash)
+
+    def search(self, value_hash, radius):
+        """返回 [(距离, value)]，按距离从小到大。"""
+        probes = [0]
+        for flips in range(1, radius // CHUNKS + 1):
+            probes += [sum(1 << bit for bit in bits) for bits in combinations(range(CHUNK_BITS), flips)]
+        candidates = set()
+        for table, chunk in zip(self.tables, self._chunks(value_hash)):
+            for probe in probes:
+                bucket = table.get(chunk ^ probe)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for candidate in candidates:
+            distance = (candidate ^ value_hash).bit_count()
+            if distance <= radius:
+                found.extend((distance, value) for value in self.values[candidate])
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+def _load_gray(source):
+    """source 为文件路径或 bytes / mmap；返回缩小后的灰度图（透明部分铺白，按 EXIF 摆正）。"""
+    with Image.open(source if isinstance(source, str) else _open_buffer(source)) as img:
+        if img.format == 'JPEG':
+            img.draft('L', (TRIM_SIZE, TRIM_SIZE))
+        img = ImageOps.exif_transpose(img)
+        if 'A' in img.getbands() or img.mode == 'P':
+            img = img.convert('RGBA')
+            canvas = Image.new('RGBA', img.size, (255, 255, 255, 255))
+            canvas.alpha_composite(img)
+            img = canvas
+        gray = img.convert('L')
+    gray.thumbnail((TRIM_SIZE, TRIM_SIZE), Image.Resampling.BOX)
+    return gray
+
+
+def _trim(pixels):
+    """裁掉与边框颜色相同的留白，返回画面内容的包围盒内的像素（没有内容时原样返回）。"""
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    mask = np.abs(pixels - np.median(border)) > TRIM_TOLERANCE
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    if rows.size < 2 or cols.size < 2:
+        return pixels
+    return pixels[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+
+def dhash(source):
+    """计算 128 位差值哈希（int）；纯色图片返回 None。source 为文件路径或 bytes / mmap。"""
+    pixels = _trim(np.asarray(_load_gray(source), dtype=np.int16))
+    small = Image.fromarray(pixels.astype(np.uint8)).resize((HASH_SIZE + 1, HASH_SIZE + 1), Image.Resampling.BOX)
+    grid = np.asarray(small, dtype=np.int16)
+    if grid.std() < MIN_STDDEV:
+        return None
+    horizontal = grid[:-1, 1:] > grid[:-1, :-1]
+    vertical = grid[1:, :-1] > grid[:-1, :-1]
+    bits = np.packbits(np.concatenate([horizontal.ravel(), vertical.ravel()]))
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def scope_key(prompt, model):
+    """同一组提示词 + 模型的结果才能互相复用。"""
+    return hashlib.sha256(f"{prompt}\0{model}".encode('utf-8')).hexdigest()[:32]
+
+
+class NearDuplicateIndex:
+    def __init__(self, db_path, threshold=12):
+        self.db_path = db_path
+        self.threshold = threshold
+        self._indexes = {}  # scope -> MultiIndexHash
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._memo = OrderedDict()  # 图片 sha256（网络图片为 URL）-> 哈希（查找后紧接着登记，不重复计算）
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS phashes (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope      TEXT NOT NULL,
+                phash      TEXT NOT NULL,
+                cache_key  TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (scope, cache_key)
+            );
+            """
+        )
+        self._refresh()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _refresh(self):
+        """读入上次之后（含其他进程）新增的记录。"""
+        rows = self._conn().execute("SELECT id, scope, phash, cache_key FROM phashes WHERE id > ? ORDER BY id",
+                                    (self._last_id,)).fetchall()
+        if not rows:
+            return
+        with self._lock:
+            for row_id, scope, phash, cache_key in rows:
+                if row_id <= self._last_id:
+                    continue
+                self._indexes.setdefault(scope, MultiIndexHash()).add(int(phash, 16), cache_key)
+                self._last_id = row_id
+
+    def image_hash(self, image_path, image=None):
+        """
+        图片的感知哈希；网络图片只使用已缓存的本地副本（见 remote_images.cached_image_path，查找时不下载），
+        没有副本或无法解码时返回 None。
+        """
+        memo_key = image.sha256 if image is not None and image.sha256 else image_path
+        with self._lock:
+            if memo_key in self._memo:
+                self._memo.move_to_end(memo_key)
+                return self._memo[memo_key]
+        if is_remote(image_path):
+            source = cached_image_path(image_path)
+            if source is None:
+                return None
+        else:
+            source = image.data if image is not None and image.data is not None else image_path
+        try:
+            with metrics.span("perceptual_hash"):
+                value = dhash(source)
+        except Exception as e:
+            print(f"感知哈希计算失败: {e}")
+            return None
+        with self._lock:
+            self._memo[memo_key] = value
+            while len(self._memo) > MEMO_ITEMS:
+                self._memo.popitem(last=False)
+        return value
+
+    def lookup(self, value_hash, scope):
+        """返回阈值内的 [(距离, 分析缓存键)]，最相近的在前。"""
+        self._refresh()
+        with self._lock:
+            index = self._indexes.get(scope)
+            return index.search(value_hash, self.threshold) if index is not None else []
+
+    def add(self, value_hash, scope, cache_key):
+        """登记一张图片；写入失败时只打印警告（登记只影响之后的复用，不影响本次请求）。"""
+        try:
+            self._conn().execute(
+                "INSERT OR IGNORE INTO phashes (scope, phash, cache_key, created_at) VALUES (?, ?, ?, ?)",
+                (scope, f"{value_hash:032x}", cache_key, time.time()),
+            )
+            self._refresh()
+        except sqlite3.Error as e:
+            print(f"警告: 近似重复索引写入失败: {e}")
+
+    def size(self):
+        with self._lock:
+            return sum(index.size for index in self._indexes.values())
+
+
+def create_near_duplicate_index(analysis_cache):
+    """按环境变量（见模块说明）创建索引；关闭或未启用分析缓存时返回 None。"""
+    if analysis_cache is None or os.environ.get("NEAR_DUPLICATE", "1") == "0":
+        return None
+    return NearDuplicateIndex(
+        os.environ.get("NEAR_DUPLICATE_DB", os.path.join("output", "cache", "near_duplicates.db")),
+        threshold=int(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "12")),
+    )
@@ -1,8 +1,24 @@
 # pdf.py
-import re
-from fpdf import FPDF
+import hashlib
+from pdf_assets import ReportPDF, ASSET_CACHE_ENABLED, page_asset, thumbnail_asset, warm_assets
 from datetime import datetime
 import os
+from singleflight import SingleFlight
+import metrics
+import profiling
+from report import BULLET, BLANK, load_report
+from pdf_layout import break_lines, emit_line, end_lines
+from downloads import record_digest
+from artifacts import store as artifact_store
+from remote_images import local_image_path
+
+# 正文区域的下边界（mm）：任何一行的底部都不超过这里（与原先 “起始 y 不超过 250、行高 8” 的上限一致）
+BODY_BOTTOM = 258
+TITLE_HEIGHT = 10
+HEADER_IMAGE_SIZE = 40  # 抬头右侧小图边长（mm）
+LINE_HEIGHT = 8
+BULLET_X = 20
+BULLET_TEXT_X = 25
 
 def asset_path(*parts: str) -> str:
     """
@@ -15,94 +31,30 @@ def asset_path(*parts: str) -> str:
     base_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base_dir, *parts)
 
-def clean_noise(text: str) -> str:
-    """清理 TXT 中不符合阅读习惯的杂质符号。"""
-    if not text:
-        return text
-
-    # 统一换行
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-
-    # 去掉 Markdown 强调标记：**粗体**、*斜体*、***加粗斜体***
-    # 注意：仅去除星号，保留中间文字
-    text = re.sub(r'\*{1,3}([^\n*]+?)\*{1,3}', r'\1', text)
-
-    # 删除“整行的分隔线”，如 --- / ---- / —— 等（只在单独一行时删除）
-    text = re.sub(r'^\s*[-_–—]{3,}\s*$', '', text, flags=re.MULTILINE)
-
-    # 去掉每行尾部多余空格
-    text = re.sub(r'[ \t]+$', '', text, flags=re.MULTILINE)
-
-    # 轻微整理项目符号：行首的 "• " -> "•"
-    text = re.sub(r'^\s*•\s*', '•', text, flags=re.MULTILINE)
-
-    # 折叠 3 个以上空行为 2 个
-    text = re.sub(r'\n{3,}', '\n\n', text)
-
-    return text
-
 class FlowerOfLifeReportConverter:
-    def __init__(self, image_path=None, user_name=None):
-        self.pdf = FPDF()
+    """把 report.Report 渲染为 PDF；image_path 为空时使用报告头部中的图片路径。"""
+    def __init__(self, report, image_path=None):
+        self.pdf = ReportPDF()
         self.pdf.set_auto_page_break(auto=False)  # 禁用自动分页
-        self.section_data = {}
-        self.image_path = image_path
-        self.user_name = user_name
+        self.report = report
+        self.image_path = image_path or report.image_path
 
         # 中文字体（相对路径，兼容服务器部署）
         self.font_name = "SimHei"
+        # 启用资源缓存时只注册常规体：B / I 与常规体字形相同，由 ReportPDF 自动映射，避免重复嵌入
+        styles = ("",) if ASSET_CACHE_ENABLED else ("", "B", "I", "BI")
         try:
             font_file = asset_path("fonts", "simhei.ttf")
-            self.pdf.add_font(self.font_name, style="",  fname=font_file, uni=True)
-            self.pdf.add_font(self.font_name, style="B", fname=font_file, uni=True)
-            self.pdf.add_font(self.font_name, style="I", fname=font_file, uni=True)
-            self.pdf.add_font(self.font_name, style="BI",fname=font_file, uni=True)
+            for style in styles:
+                self.pdf.add_font(self.font_name, style=style, fname=font_file, uni=True)
         except Exception as e:
             print(f"警告: 中文字体加载失败，将使用内置字体（中文可能显示为空白）: {e}")
             self.font_name = "Arial"
 
-    def parse_text_file(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            raw = file.read()
-
-        # 先做一次全局清洗（可去除文件头部中可能的 **、--- 等）
-        raw = clean_noise(raw)
-
-        # 提取头部信息
-        name_match  = re.search(r'姓名[:：]\s*(.+)', raw)
-        date_match  = re.search(r'日期[:：]\s*(.+)', raw)
-        image_match = re.search(r'图片路径[:：]\s*(.+)', raw)
-
-        self.section_data['name']  = self.user_name or (name_match.group(1).strip() if name_match else "未知")
-        self.section_data['date']  = date_match.group(1).strip() if date_match else datetime.now().strftime("%Y-%m-%d")
-        self.section_data['image_path'] = image_match.group(1).strip() if image_match else None
-
-        if not self.image_path and self.section_data['image_path']:
-            self.image_path = self.section_data['image_path']
-
-        # 去掉单独的抬头行，保留正文
-        content = re.sub(r'^生命之花分析报告\s*$', '', raw, flags=re.MULTILINE).strip()
-
-        # ——仅识别“行首的 1. 标题”为章节，避免把 xxx.jpg、小数点当标题——
-        title_pat = re.compile(r'^\s*\*{0,2}(\d+)\.\s*([^\n]+?)\s*\*{0,2}\s*$', re.MULTILINE)
-        matches = list(title_pat.finditer(content))
-
-        for i, m in enumerate(matches):
-            start = m.end()
-            end   = matches[i+1].start() if i+1 < len(matches) else len(content)
-            key   = f"{m.group(1)}. {m.group(2).strip()}"  # 如：1. 图案结构解读
-            value = content[start:end]
-            # 每节正文做清洗，去 **、--- 等
-            value = clean_noise(value)
-            # 适度清理：去掉引用符、多余空行
-            value = re.sub(r'^\s*>\s*', '', value, flags=re.MULTILINE)
-            value = re.sub(r'\n\s*\n', '\n\n', value).strip()
-            self.section_data[key] = value
-
     def create_pdf(self, output_path):
         # 封面
         self.pdf.add_page()
-        self.pdf.image(asset_path("fengmian.png"), x=0, y=0, w=210, h=297)
+        self.pdf.image(page_asset(asset_path("fengmian.png")), x=0, y=0, w=210, h=297)
 
         # 正文（从第二页开始）
         self._fill_text_on_new_pages()
@@ -125,13 +77,13 @@ class FlowerOfLifeReportConverter:
             "8. 总结金句",
         ]
         for title in sections_order:
-            content = self.section_data.get(title, "")
-            if content:
-                self._add_section(title, content)
+            section = self.report.section(title)
+            if section and section.blocks:
+                self._add_section(section)
 
     def _add_page_with_background(self, with_header=True):
         self.pdf.add_page()
-        self.pdf.image(asset_path("background.png"), x=0, y=0, w=210, h=297)
+        self.pdf.image(page_asset(asset_path("background.png")), x=0, y=0, w=210, h=297)
         self.pdf.ln(5)
 
         if with_header:
@@ -157,23 +109,20 @@ class FlowerOfLifeReportConverter:
             self.pdf.set_text_color(0, 0, 0)
             text_start_y = y_pos + (box_height - 16) / 2
             self.pdf.set_xy(x_center + 10, text_start_y)
-            self.pdf.cell(80, 8, f"姓名：{self.section_data.get('name','')}")
+            self.pdf.cell(80, 8, f"姓名：{self.report.name}")
             self.pdf.set_xy(x_center + 10, text_start_y + 8)
-            self.pdf.cell(80, 8, f"日期：{self.section_data.get('date','')}")
+            self.pdf.cell(80, 8, f"日期：{self.report.date}")
 
-            # 右侧小图（用户图/备用图）
+            # 右侧小图（用户图/备用图）；只使用本地文件，网络图片已在渲染前取到本地（见 remote_images.py）
             image_to_use = None
-            if self.image_path:
-                if str(self.image_path).startswith("http"):
-                    image_to_use = self.image_path
-                elif os.path.exists(self.image_path):
-                    image_to_use = self.image_path
+            if self.image_path and os.path.exists(self.image_path):
+                image_to_use = thumbnail_asset(self.image_path, HEADER_IMAGE_SIZE)
             if not image_to_use and os.path.exists(asset_path("flower.png")):
-                image_to_use = asset_path("flower.png")
+                image_to_use = thumbnail_asset(asset_path("flower.png"), HEADER_IMAGE_SIZE, shared=True)
 
             if image_to_use:
                 try:
-                    img_size = 40
+                    img_size = HEADER_IMAGE_SIZE
                     img_x = x_center + box_width - img_size - 10
                     img_y = y_pos + (box_height - img_size) / 2
                     self.pdf.image(image_to_use, x=img_x, y=img_y, w=img_size, h=img_size)
@@ -188,67 +137,114 @@ class FlowerOfLifeReportConverter:
             for _ in range(4):
                 self.pdf.ln(8)
 
-    def _add_section(self, title, content):
-        # 再保险：渲染前再清洗一次（避免外部调用绕过 parse_text_file）
-        content = clean_noise(content)
-        if not content.strip():
-            return
+    def _ensure_space(self, height):
+        """当前页剩余高度放不下 height 时新开一页（只铺背景，不再画抬头盒）。"""
+        if self.pdf.get_y() + height > BODY_BOTTOM:
+            self._add_page_with_background(False)
 
-        # 节标题
+    def _add_section(self, section):
+        # 节标题：与正文第一行放在同一页
         self.pdf.set_font(self.font_name, 'B', 16)
         self.pdf.set_text_color(57, 96, 156)
-
-        # 临近页尾则新开一页（只铺背景，不再画抬头盒）
-        if self.pdf.get_y() > 250:
-            self._add_page_with_background(False)
-
-        self.pdf.cell(0, 10, title, ln=True)
+        self._ensure_space(TITLE_HEIGHT + 2 + LINE_HEIGHT)
+        self.pdf.cell(0, TITLE_HEIGHT, section.title, ln=True)
         self.pdf.ln(2)
 
-        # 正文
+        # 正文：先按字宽表断好行，再逐行确认剩余高度后输出（段落可以跨页，不会越过页面底部）
         self.pdf.set_font(self.font_name, '', 12)
         self.pdf.set_text_color(0, 0, 0)
+        page_width = self.pdf.w - self.pdf.r_margin
 
-        lines = content.split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line:
+        for kind, text in section.blocks:
+            if kind == BLANK:
                 self.pdf.ln(5)
                 continue
-            if self.pdf.get_y() > 250:
-                self._add_page_with_background(False)
-            if line.startswith('•'):
-                # 项目符号：小圆点 + 内容
-                self.pdf.set_x(20)
-                self.pdf.cell(5, 8, "•", ln=0)
-                self.pdf.set_x(25)
-                self.pdf.multi_cell(0, 8, line[1:].lstrip())
-            elif line.startswith('- '):
-                self.pdf.set_x(20)
-                self.pdf.cell(5, 8, "•", ln=0)
-                self.pdf.set_x(25)
-                self.pdf.multi_cell(0, 8, line[2:].strip())
-            else:
-                self.pdf.multi_cell(0, 8, line)
+            x = BULLET_TEXT_X if kind == BULLET else self.pdf.l_margin
+            width = page_width - x
+            for i, line in enumerate(break_lines(self.pdf, text, width)):
+                self._ensure_space(LINE_HEIGHT)
+                if i == 0 and kind == BULLET:
+                    # 项目符号：小圆点 + 内容
+                    self.pdf.set_x(BULLET_X)
+                    self.pdf.cell(5, LINE_HEIGHT, "•", ln=0)
+                self.pdf.set_x(x)
+                emit_line(self.pdf, width, LINE_HEIGHT, line)
+            end_lines(self.pdf)
             self.pdf.ln(4)
         self.pdf.ln(8)
 
-def generate_pdf_from_txt(input_txt_path, image_path=None, user_name=None):
-    converter = FlowerOfLifeReportConverter(image_path, user_name)
-    converter.parse_text_file(input_txt_path)
+def warm_pdf_assets():
+    """进程启动时预加载字体度量与封面 / 背景图，首个请求不再承担加载开销。"""
+    warm_assets("SimHei", asset_path("fonts", "simhei.ttf"),
+                [asset_path("fengmian.png"), asset_path("background.png")])
+
+# 相同报告内容 + 图片 + 姓名 + 日期 的 PDF 渲染同时只进行一次
+pdf_flight = SingleFlight("generate_pdf")
+metrics.register_collector(metrics.singleflight_collector(pdf_flight))
 
-    name = converter.section_data.get('name', '未知')
-    date_str = converter.section_data.get('date', datetime.now().strftime("%Y-%m-%d"))
+def pdf_flight_key(report, image_path=None, suffix=None) -> str:
+    h = hashlib.sha256(report.text.encode('utf-8'))
+    for part in (str(image_path or report.image_path or ''), report.name, report.date, suffix or ''):
+        h.update(b'\0')
+        h.update(part.encode('utf-8'))
+    return h.hexdigest()
+
+def generate_pdf(report, image_path=None, suffix=None):
+    """
+    由 report.Report 生成 PDF，返回输出路径；并发的重复请求共享同一次渲染结果。
+    suffix 非空时加在输出文件名末尾（批量任务按条目区分，同名同日的条目不会写到同一个文件）。
+    """
+    # 解析时被选中剖析的报告（report.profile_id，见 profiling.py），渲染也在 cProfile 下执行
+    return _render_once(report, image_path, report.profile_id, suffix)
+
+def generate_pdf_from_txt(input_txt_path, image_path=None, user_name=None):
+    """由已保存的报告文件（TXT 或 save_report 写出的 JSON）生成 PDF；被选中剖析时解析与渲染分别剖析。"""
+    profile_id = profiling.new_profile_id() if profiling.should_profile() else None
+    with metrics.span("parse_text_file"), profiling.capture(profile_id, "parse", report=os.path.basename(input_txt_path)):
+        report = load_report(input_txt_path, user_name)
+    report.profile_id = profile_id
+    return _render_once(report, image_path, profile_id)
+
+def _render_once(report, image_path, profile_id, suffix=None):
+    return pdf_flight.do(pdf_flight_key(report, image_path, suffix), _generate_pdf, report, image_path, profile_id,
+                         suffix)
+
+def _generate_pdf(report, image_path, profile_id, suffix=None):
+    output_file = report_output_path(report, suffix)
+    # 网络图片在这里换成本地缓存文件，渲染（可能在渲染进程中）不访问网络
+    image_path = local_image_path(image_path or report.image_path)
+    # 使用渲染进程池时包含排队等待时间
+    with metrics.span("create_pdf"):
+        if profile_id is None:
+            return pdf_renderer(report, image_path, output_file)
+        return pdf_renderer(report, image_path, output_file, profile_id=profile_id)
+
+def report_output_path(report, suffix=None):
+    """
+    按姓名与日期生成 PDF 输出路径：报告存储中的 生命之花分析报告-<姓名><月.日>.pdf（见 artifacts.py），
+    有 suffix 时为 生命之花分析报告-<姓名><月.日>-<suffix>.pdf
+    """
     try:
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
+        date_obj = datetime.strptime(report.date, "%Y-%m-%d")
         formatted_date = date_obj.strftime("%m.%d")
     except ValueError:
         formatted_date = datetime.now().strftime("%m.%d")
 
-    output_filename = f"生命之花分析报告-{name}{formatted_date}.pdf"
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    output_filename = f"生命之花分析报告-{report.name}{formatted_date}{f'-{suffix}' if suffix else ''}.pdf"
+    return artifact_store.report_path(output_filename)
+
+def render_report(report, image_path, output_path, profile_id=None):
+    """渲染 PDF，返回输出路径。可在独立的渲染进程中执行；profile_id 非空时剖析渲染过程。"""
+    with profiling.capture(profile_id, "render", output=os.path.basename(output_path)):
+        output_path = FlowerOfLifeReportConverter(report, image_path).create_pdf(output_path)
+    # 生成时即计算下载用的 ETag（在渲染进程中完成，不占用请求线程）
+    record_digest(output_path)
+    artifact_store.add(output_path)
+    return output_path
+
+# PDF 渲染函数：默认在当前进程渲染，可由 pdf_workers.install_render_pool 替换为进程池
+pdf_renderer = render_report
 
-    output_file = os.path.join(output_dir, output_filename)
-    return converter.create_pdf(output_file)
+def set_pdf_renderer(renderer):
+    global pdf_renderer
+    pdf_renderer = renderer or render_report
@@ -0,0 +1,327 @@
+# pdf_assets.py
+"""
+PDF 渲染用的进程级资源缓存。
+
+- 字体：TTF 度量（fonts/simhei.pkl，约 6.5 万个字宽）每个进程只加载一次，之后新建的 PDF 直接复用；
+  每份 PDF 仍各自维护用到的字形集合（去重后的 GlyphSubset），输出时只嵌入这些字形（子集化）。
+  同一 TTF 的粗体 / 斜体与常规体字形完全相同，只注册常规体，B / I 自动落到常规体上，
+  避免同一字体被当成两种字体重复嵌入。
+- 图片：封面、背景等静态图片解析（PNG 解压 / 拆分透明通道 / 重新压缩）只做一次，
+  解析结果在各 PDF 间共享；同一 PDF 内多页引用的是同一个图片对象（XObject）。
+  整页背景图可预先转成适合打印分辨率的 JPEG，显著减小输出体积。
+- 抬头小图（用户图片 / 备用图，版面上只有 40mm）：按 PDF_THUMBNAIL_DPI（默认 300dpi，约 472 像素）缩小后嵌入，
+  缩略图以源图内容哈希命名存入 artifacts 存储（<sha256>_thumb<像素>.jpg / .png），重新渲染时直接复用；
+  带透明通道的 PNG 用 Pillow 拆分颜色与透明通道（见 _alpha_png_info）。
+
+PDF_ASSET_CACHE=0 可关闭缓存（用于基准对比）。
+"""
+import hashlib
+import os
+import io
+import struct
+import threading
+
+from fpdf import FPDF
+
+ASSET_CACHE_ENABLED = os.environ.get("PDF_ASSET_CACHE", "1") != "0"
+# 整页背景图转 JPEG 的质量与最大宽度（A4 宽 210mm，1654px 约 200dpi）；质量设为 0 则保留原图
+PAGE_ASSET_JPEG_QUALITY = int(os.environ.get("PDF_PAGE_JPEG_QUALITY", "85"))
+PAGE_ASSET_MAX_WIDTH = int(os.environ.get("PDF_PAGE_MAX_WIDTH", "1654"))
+ASSET_CACHE_DIR = os.environ.get("PDF_ASSET_CACHE_DIR", os.path.join("output", "cache", "assets"))
+# 抬头小图的目标分辨率与 JPEG 质量；分辨率设为 0 则嵌入原图
+THUMBNAIL_DPI = int(os.environ.get("PDF_THUMBNAIL_DPI", "300"))
+THUMBNAIL_JPEG_QUALITY = int(os.environ.get("PDF_THUMBNAIL_JPEG_QUALITY", "90"))
+
+_lock = threading.Lock()
+_font_cache = {}   # (family, style, fname) -> {"font": ..., "file": ...}
+_image_cache = {}  # (abspath, mtime, size) -> fpdf 解析后的图片信息
+_shared_images = set()  # 允许跨 PDF 缓存的图片（封面 / 背景等静态资源；用户图片不缓存，避免内存无限增长）
+_content_hashes = {}  # (abspath, mtime, size) -> sha256（不在上传存储中的源图）
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime, st.st_size
+
+
+class GlyphSubset(list):
+    """
+    字形子集列表：FPDF 每输出一个字符就 append 一次（大量重复），
+    并在输出时对 0~65535 的每个码位做 `cid in subset` 判断；
+    这里去重并用集合加速成员判断，列表语义（顺序、del subset[0]）保持不变。
+    """
+
+    def __init__(self, iterable=()):
+        super().__init__()
+        self._members = set()
+        for code in iterable:
+            self.append(code)
+
+    def append(self, code):
+        if code not in self._members:
+            self._members.add(code)
+            super().append(code)
+
+    def __contains__(self, code):
+        return code in self._members
+
+    def __delitem__(self, index):
+        removed = self[index]
+        super().__delitem__(index)
+        for code in (removed if isinstance(index, slice) else (removed,)):
+            self._members.discard(code)
+
+
+class ReportPDF(FPDF):
+    """带进程级字体 / 图片缓存的 FPDF。"""
+
+    def add_font(self, family, style='', fname='', uni=False):
+        if not (ASSET_CACHE_ENABLED and uni):
+            return super().add_font(family, style, fname, uni)
+
+        family_key = family.lower()
+        style = style.upper()
+        fontkey = family_key + style
+        cache_key = (family_key, style, fname)
+        with _lock:
+            cached = _font_cache.get(cache_key)
+        if cached is None:
+            super().add_font(family, style, fname, uni)
+            self.fonts[fontkey]["subset"] = GlyphSubset(self.fonts[fontkey]["subset"])
+            cached = {
+                "font": {k: v for k, v in self.fonts[fontkey].items() if k not in ("i", "subset")},
+                "file": dict(self.font_files[fontkey]),
+            }
+            with _lock:
+                _font_cache[cache_key] = cached
+            return
+
+        if fontkey in self.fonts:
+            return
+        font = dict(cached["font"])
+        font["i"] = len(self.fonts) + 1
+        # 与 FPDF.add_font 一致：初始子集包含控制字符（及页码别名用到的数字）
+        font["subset"] = GlyphSubset(range(0, 57) if hasattr(self, "str_alias_nb_pages") else range(0, 32))
+        self.fonts[fontkey] = font
+        self.font_files[fontkey] = dict(cached["file"])
+        self.font_files[fname] = {"type": "TTF"}
+
+    def set_font(self, family, style='', size=0):
+        # TTF 字体只注册了常规体时，粗体 / 斜体落到常规体（字形本就相同）
+        family_key = (family or self.font_family).lower()
+        plain_style = style.upper().replace('U', '')
+        regular = self.fonts.get(family_key)
+        if plain_style and family_key + plain_style not in self.fonts and regular and regular.get('type') == 'TTF':
+            style = 'U' if 'U' in style.upper() else ''
+        return super().set_font(family, style, size)
+
+    def image(self, name, x=None, y=None, w=0, h=0, type='', link=''):
+        if ASSET_CACHE_ENABLED and name not in self.images:
+            if name in _shared_images:
+                info = get_image_info(name, type)
+            else:
+                info = _alpha_png_info(name, type)  # 用户图片不缓存，只替换慢的透明通道拆分
+            if info is not None:
+                info = dict(info)  # 输出后 FPDF 会删掉 data，必须用副本
+                info["i"] = len(self.images) + 1
+                self.images[name] = info
+                if 'smask' in info and self.pdf_version < '1.4':
+                    self.pdf_version = '1.4'
+        return super().image(name, x, y, w, h, type, link)
+
+
+def get_image_info(path, type=''):
+    """解析图片并缓存结果；解析失败返回 None，交给 FPDF 按原逻辑处理。"""
+    try:
+        sig = _file_signature(path)
+    except OSError:
+        return None
+    with _lock:
+        info = _image_cache.get(sig)
+    if info is not None:
+        return info
+
+    ext = (type or os.path.splitext(path)[1].lstrip('.')).lower()
+    parser = FPDF()
+    try:
+        if ext in ('jpg', 'jpeg'):
+            info = parser._parsejpg(path)
+        elif ext == 'png':
+            info = _alpha_png_info(path, ext) or parser._parsepng(path)
+        else:
+            return None
+    except Exception:
+        return None
+    with _lock:
+        _image_cache[sig] = info
+    return info
+
+
+def _alpha_png_info(path, type=''):
+    """
+    带透明通道（RGBA / LA）的 PNG：用 Pillow 拆出颜色与透明通道，得到与 FPDF._parsepng 相同结构的图片信息。
+    FPDF 自带的拆分逐行用正则拼接字节串，数十万像素就要数百毫秒；而且它直接拆分经过 PNG 行过滤的数据，
+    只有未使用行过滤的文件才能正确显示。这里把两个通道分别编码为 PNG（各自做行过滤），取其压缩数据。
+    其他图片返回 None，交给 FPDF 按原逻辑处理。
+    """
+    ext = (type or os.path.splitext(path)[1].lstrip('.')).lower()
+    if ext != 'png':
+        return None
+    try:
+        from PIL import Image
+        with Image.open(path) as img:
+            if img.format != 'PNG' or img.mode not in ('RGBA', 'LA'):
+                return None
+            img.load()
+            colors = 3 if img.mode == 'RGBA' else 1
+            data = _png_idat(img.convert('RGB' if colors == 3 else 'L'))
+            smask = _png_idat(img.getchannel('A'))
+    except Exception:
+        return None
+    return {
+        'w': img.width, 'h': img.height, 'cs': 'DeviceRGB' if colors == 3 else 'DeviceGray', 'bpc': 8,
+        'f': 'FlateDecode', 'dp': f'/Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {img.width}',
+        'pal': '', 'trns': '', 'data': data, 'smask': smask,
+    }
+
+
+def _png_idat(img):
+    """把单个通道 / RGB 图编码为 PNG，返回拼接后的 IDAT 数据（即 PDF 中 Predictor 15 的 FlateDecode 数据）。"""
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    png = buf.getvalue()
+    pos, chunks = 8, []
+    while pos < len(png):
+        length, chunk_type = struct.unpack('>I4s', png[pos:pos + 8])
+        if chunk_type == b'IDAT':
+            chunks.append(png[pos + 8:pos + 8 + length])
+        pos += 12 + length
+    return b''.join(chunks)
+
+
+def page_asset(path):
+    """
+    整页背景类图片：首次使用时按打印分辨率缩放并转为 JPEG（缓存在 ASSET_CACHE_DIR），之后直接复用。
+    无法转换（未安装 Pillow、带透明通道、关闭缓存等）时返回原路径。
+    """
+    if not ASSET_CACHE_ENABLED:
+        return path
+    out_path = _page_asset(path)
+    with _lock:
+        _shared_images.add(out_path)
+    return out_path
+
+
+def _page_asset(path):
+    if PAGE_ASSET_JPEG_QUALITY <= 0:
+        return path
+    try:
+        abspath, mtime, size = _file_signature(path)
+    except OSError:
+        return path
+    digest = hashlib.sha1(f"{abspath}:{mtime}:{size}:{PAGE_ASSET_JPEG_QUALITY}:{PAGE_ASSET_MAX_WIDTH}".encode()).hexdigest()
+    out_path = os.path.join(ASSET_CACHE_DIR, f"{digest}.jpg")
+    if os.path.exists(out_path):
+        return out_path
+
+    try:
+        from PIL import Image
+        with Image.open(path) as img:
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                return path
+            img = img.convert('RGB')
+            if img.width > PAGE_ASSET_MAX_WIDTH:
+                new_height = round(img.height * PAGE_ASSET_MAX_WIDTH / img.width)
+                img = img.resize((PAGE_ASSET_MAX_WIDTH, new_height), Image.Resampling.LANCZOS)
+            os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{out_path}.{os.getpid()}.tmp"
+            img.save(tmp_path, 'JPEG', quality=PAGE_ASSET_JPEG_QUALITY, optimize=True)
+            os.replace(tmp_path, out_path)
+        return out_path
+    except Exception as e:
+        print(f"警告: 背景图预处理失败，使用原图 {path}: {e}")
+        return path
+
+
+def thumbnail_asset(path, size_mm, shared=False):
+    """
+    版面上 size_mm 见方的小图：按 THUMBNAIL_DPI 缩小（不放大）后返回缩略图路径，已生成过时直接复用；
+    有透明通道的存 PNG，其余存 JPEG。无需缩小（已是小尺寸 JPEG）、关闭缓存或处理失败时返回原路径。
+    shared=True 表示静态资源（备用图），解析结果跨 PDF 复用。
+    """
+    if not ASSET_CACHE_ENABLED or THUMBNAIL_DPI <= 0:
+        return path
+    try:
+        out_path = _thumbnail(path, round(size_mm / 25.4 * THUMBNAIL_DPI))
+    except Exception as e:
+        print(f"警告: 缩略图生成失败，使用原图 {path}: {e}")
+        return path
+    if shared and out_path != path:
+        with _lock:
+            _shared_images.add(out_path)
+    return out_path
+
+
+def _content_sha256(path):
+    """源图内容哈希：上传存储中的文件名即为哈希，其余文件计算一次后按文件签名记住。"""
+    name = os.path.basename(path)[:64]
+    if len(name) == 64 and all(c in "0123456789abcdef" for c in name):
+        return name
+    sig = _file_signature(path)
+    with _lock:
+        digest = _content_hashes.get(sig)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _lock:
+            _content_hashes[sig] = digest
+    return digest
+
+
+def _thumbnail(path, px):
+    from PIL import Image
+    from artifacts import store as artifact_store
+
+    digest = _content_sha256(path)
+    for ext in (".jpg", ".png"):
+        out_path = artifact_store.path("uploads", f"{digest}_thumb{px}{ext}")
+        if os.path.exists(out_path):
+            artifact_store.touch(out_path)
+            return out_path
+
+    with Image.open(path) as img:
+        if img.format == 'JPEG' and img.width <= px and img.height <= px:
+            return path
+        # 版面上按正方形放置（宽高各自缩放），这里两边各自限制到 px，最终显示效果不变
+        size = (min(img.width, px), min(img.height, px))
+        if img.format == 'JPEG':
+            img.draft('RGB', size)  # 大图 JPEG 按缩小比例解码，省去全尺寸解码
+        transparent = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if transparent else 'RGB')
+        if img.size != size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        ext = ".png" if transparent else ".jpg"
+        out_path = artifact_store.upload_path(f"{digest}_thumb{px}{ext}")
+        tmp_path = artifact_store.temp_path(ext)
+        if transparent:
+            img.save(tmp_path, 'PNG', optimize=True)
+        else:
+            img.save(tmp_path, 'JPEG', quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+    os.replace(tmp_path, out_path)
+    artifact_store.add(out_path)
+    return out_path
+
+
+def warm_assets(font_name, font_file, page_images=()):
+    """启动时预热：加载字体度量、预处理并解析整页背景图。"""
+    pdf = ReportPDF()
+    try:
+        pdf.add_font(font_name, style="", fname=font_file, uni=True)
+    except Exception as e:
+        print(f"警告: 字体预热失败: {e}")
+    for path in page_images:
+        if os.path.exists(path):
+            get_image_info(page_asset(path))
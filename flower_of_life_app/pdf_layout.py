@@ -0,0 +1,135 @@
+# pdf_layout.py
+"""
+正文排版：按字宽表一次性断行，再按精确的剩余高度分页，最后输出绘制指令。
+
+FPDF.multi_cell 对每个字符调用一次 get_string_width（CJK 文本每个字都要走一遍函数调用与编码检查），
+且只能在开始输出一个段落前检查 y 坐标，段落在页尾开始时会越过页面底部。这里：
+- 字宽直接查字体度量中的字宽表（SimHei 为 fonts/simhei.pkl 中 65536 项的 cw，随字体缓存在进程内共享）；
+- break_lines 单趟扫描完成断行，规则与 multi_cell 相同（有空格时在最后一个空格处断开并两端对齐，
+  否则按字符断开），输出的行与 multi_cell 一致；
+- 调用方拿到全部行之后逐行判断 y + 行高 是否超出正文区域，需要时先换页再输出该行；
+- emit_line 按 multi_cell 的方式输出这些行（同样的文字 / 字间距指令）；普通行直接写出文字指令，
+  不再经过 cell 的逐字符处理。
+"""
+
+
+class WidthTable:
+    """当前字体的字宽表（单位：字号的 1/1000）。"""
+
+    def __init__(self, font):
+        cw = font['cw']
+        self.unicode = isinstance(cw, list)
+        self.cw = cw
+        self.missing = font.get('desc', {}).get('MissingWidth') or 500
+
+    def widths(self, text):
+        """text 中每个字符的宽度列表。"""
+        cw = self.cw
+        if not self.unicode:
+            return [cw.get(c, 0) for c in text]
+        size = len(cw)
+        missing = self.missing
+        return [cw[o] if o < size else missing for o in map(ord, text)]
+
+    def width(self, text):
+        return sum(self.widths(text))
+
+
+_tables = {}
+
+
+def width_table(pdf):
+    """pdf 当前字体的字宽表；字体度量在进程内共享时，按字宽表对象缓存。"""
+    font = pdf.current_font
+    key = id(font['cw'])
+    table = _tables.get(key)
+    if table is None or table.cw is not font['cw']:
+        table = _tables[key] = WidthTable(font)
+    return table
+
+
+def break_lines(pdf, text, w=0, align='J'):
+    """
+    按当前字体与字号把单段文字（不含换行符）断成多行，返回 [(行文本, 字间距)]，不输出任何内容。
+    字间距为 None 表示普通行；为数值表示在空格处断开、需要两端对齐的行（与 multi_cell 的 ws 相同）。
+    """
+    if w == 0:
+        w = pdf.w - pdf.r_margin - pdf.x
+    wmax = (w - 2 * pdf.c_margin) * 1000.0 / pdf.font_size
+    widths = width_table(pdf).widths(text)
+    lines = []
+    n = len(text)
+    i = j = 0
+    sep = -1
+    ns = 0
+    length = line_start_length = 0.0
+    while i < n:
+        c = text[i]
+        if c == ' ':
+            sep = i
+            line_start_length = length
+            ns += 1
+        length += widths[i]
+        if length > wmax:
+            if sep == -1:
+                if i == j:
+                    i += 1
+                lines.append((text[j:i], None))
+            else:
+                ws = None
+                if align == 'J':
+                    ws = (wmax - line_start_length) / 1000.0 * pdf.font_size / (ns - 1) if ns > 1 else 0
+                lines.append((text[j:sep], ws))
+                i = sep + 1
+            sep = -1
+            j = i
+            length = 0.0
+            ns = 0
+        else:
+            i += 1
+    lines.append((text[j:i], None))
+    return lines
+
+
+def emit_line(pdf, w, h, line, align='J'):
+    """输出 break_lines 得到的一行（与 multi_cell 输出该行的指令相同），y 移到下一行。"""
+    text, ws = line
+    if ws is None:
+        if pdf.ws > 0:
+            pdf.ws = 0
+            pdf._out('0 Tw')
+        if pdf.unifontsubset and align not in ('R', 'C') and not pdf.underline and not pdf.auto_page_break:
+            _emit_text(pdf, h, text)
+            return
+    else:
+        pdf.ws = ws
+        pdf._out('%.3f Tw' % (ws * pdf.k))
+    pdf.cell(w, h, text, 0, 2, align)
+
+
+def _emit_text(pdf, h, text):
+    """
+    不带边框 / 填充 / 字间距的左对齐单行：直接写出与 FPDF.cell 相同的文字指令，
+    省去 cell 中逐字符的编码转换与字形登记（这里按去重后的字符登记一次）。
+    """
+    if text:
+        k = pdf.k
+        op = 'BT %.2f %.2f Td (%s) Tj ET' % ((pdf.x + pdf.c_margin) * k,
+                                             (pdf.h - (pdf.y + .5 * h + .3 * pdf.font_size)) * k,
+                                             pdf._escape(text.encode('utf-16-be').decode('latin1')))
+        if pdf.color_flag:
+            op = 'q ' + pdf.text_color + ' ' + op + ' Q'
+        subset = pdf.current_font['subset']
+        for code in map(ord, dict.fromkeys(text)):
+            subset.append(code)
+        pdf._out(op)
+    pdf.lasth = h
+    pdf.y += h
+
+
+def end_lines(pdf):
+    """一段输出结束：复位字间距，x 回到左边距（与 multi_cell 结束时相同）。"""
+    if pdf.ws > 0:
+        pdf.ws = 0
+        pdf._out('0 Tw')
+    pdf.x = pdf.l_margin
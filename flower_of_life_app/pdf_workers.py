@@ -0,0 +1,94 @@
+# pdf_workers.py
+"""
+PDF 渲染进程池。
+
+FPDF 渲染是纯 Python 的 CPU 密集操作，会长时间持有 GIL，与 Flask 请求处理线程互相拖慢。
+这里把渲染放到独立的工作进程中：进程启动时即预加载字体与背景图（warm_pdf_assets），
+主进程只把已解析好的报告（report.Report）交给工作进程渲染，返回 PDF 输出路径。
+
+配置：
+- PDF_WORKERS：渲染进程数，默认 min(4, CPU 核数)；0 表示在当前进程内渲染
+- PDF_QUEUE_DEPTH：除正在渲染的任务外，最多允许排队的任务数，默认 16
+- PDF_QUEUE_TIMEOUT：队列已满时等待空位的秒数，超时抛出 RuntimeError，默认 30
+
+工作进程在服务启动时（尚未开始处理请求前）一次性创建：支持 fork 的平台上直接 fork，
+子进程继承主进程中已加载好的字体与背景图；其他平台使用 spawn 并在初始化函数中加载。
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+import pdf
+
+
+def _init_worker():
+    pdf.warm_pdf_assets()
+
+
+def _ping():
+    return os.getpid()
+
+
+class PdfRenderPool:
+    def __init__(self, workers, queue_depth=16, queue_timeout=30):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def warm_up(self):
+        """提前拉起全部工作进程（各自完成资源预加载），首个请求不必等待进程启动。"""
+        futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+        return sorted({f.result() for f in futures})
+
+    def render(self, report, image_path, output_path, profile_id=None):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise RuntimeError("PDF 渲染队列已满，请稍后重试")
+        with self._lock:
+            self.pending += 1
+        try:
+            future = self._executor.submit(pdf.render_report, report, image_path, output_path, profile_id)
+            return future.result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+render_pool = None
+
+
+def install_render_pool(workers=None, queue_depth=None, warm=True):
+    """按配置创建渲染进程池，并将其设置为 pdf 模块的渲染函数；workers 为 0 时保持进程内渲染。"""
+    global render_pool
+    if workers is None:
+        workers = int(os.environ.get("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+    if queue_depth is None:
+        queue_depth = int(os.environ.get("PDF_QUEUE_DEPTH", "16"))
+    # 渲染进程自身（spawn 方式会重新导入主模块）不再创建进程池
+    if workers <= 0 or multiprocessing.parent_process() is not None:
+        return None
+    render_pool = PdfRenderPool(workers, queue_depth, float(os.environ.get("PDF_QUEUE_TIMEOUT", "30")))
+    if warm:
+        render_pool.warm_up()
+    pdf.set_pdf_renderer(render_pool.render)
+    metrics.register_collector(collect_metrics)
+    return render_pool
+
+
+def collect_metrics():
+    if render_pool is not None:
+        yield "pdf_render_pending", "gauge", "正在渲染或排队的 PDF 数", {}, render_pool.pending
+        yield "pdf_render_workers", "gauge", "PDF 渲染进程数", {}, render_pool.workers
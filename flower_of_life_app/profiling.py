@@ -0,0 +1,264 @@
+# profiling.py
+"""
+按需性能剖析（默认关闭）。
+
+被选中的分析在 cProfile 下分两个阶段剖析：parse 为解析模型输出（ali_api.parse_report / 流式接口中的
+IncrementalSectionParser，from_text / clean_line；由已保存的报告文件生成时为 load_report），render 为 PDF 渲染
+（create_pdf / _add_section）。是否剖析在解析时决定，profile_id 记在 Report 上，渲染沿用。可选地在前后各取一次 tracemalloc 快照，产物写入 PROFILE_DIR/<profile_id>/：
+- <阶段>.prof：pstats 原始数据（可用 snakeviz 等工具查看）；
+- <阶段>.txt：按累计耗时排序的前若干函数、重点函数的统计，以及内存分配增长最多的代码行；
+- meta.json：报告名、各阶段耗时等。
+渲染在渲染进程池中执行时，剖析也在渲染进程内进行，产物写到同一目录。
+
+选择方式：
+- PROFILE_SAMPLE_RATE：按比例随机抽样（0~1，默认 0）；
+- PROFILE_ON_DEMAND=1：允许受信任的请求携带 X-Profile: 1 头（或 profile=1 参数）强制剖析该请求；
+  受信任指带有正确的 X-Profile-Token（PROFILE_ADMIN_TOKEN）或直接来自 TRUSTED_PROXIES（见 app.profiling_allowed），
+  /api/profiles 同样只对受信任的调用方开放。
+其他配置：PROFILE_DIR（默认 output/profiles）、PROFILE_KEEP（保留最近多少份，默认 50）、
+PROFILE_TRACEMALLOC=1（记录内存分配；tracemalloc 统计整个进程，并发请求的分配也会计入）。
+
+查看：GET /api/profiles、GET /api/profiles/<profile_id>/<文件名>，或
+    python profiling.py list
+    python profiling.py show <profile_id> [parse|render]
+"""
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ON_DEMAND = os.environ.get("PROFILE_ON_DEMAND", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join("output", "profiles"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+PROFILE_TRACEMALLOC = os.environ.get("PROFILE_TRACEMALLOC", "0") == "1"
+ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_ON_DEMAND
+
+# 重点关注的函数，单独列出其统计
+FOCUS_FUNCTIONS = ("load_report", "from_text", "from_parser", "feed", "clean_line", "create_pdf", "_add_section", "break_lines")
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 20
+PROFILE_ID_PATTERN = re.compile(r"[0-9]{8}_[0-9]{6}_[0-9a-f]{8}")
+ARTIFACT_PATTERN = re.compile(r"(parse|render)\.(prof|txt)|meta\.json")
+
+_requested = contextvars.ContextVar("profile_requested", default=False)
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def request_profiling():
+    """当前请求要求剖析；返回 token，请求结束时交给 reset_request。"""
+    return _requested.set(True)
+
+
+def reset_request(token):
+    try:
+        _requested.reset(token)
+    except ValueError:
+        _requested.set(False)
+
+
+def should_profile():
+    if not ENABLED:
+        return False
+    if _requested.get():
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def new_profile_id():
+    return f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+def _stats_report(profiler, seconds, memory_lines):
+    buffer = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buffer)
+    buffer.write(f"耗时: {seconds:.4f}s\n\n== 按累计耗时排序 ==\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    buffer.write("\n== 重点函数 ==\n")
+    stats.print_stats("|".join(FOCUS_FUNCTIONS))
+    if memory_lines:
+        buffer.write("\n== 内存分配增长（前 %d 行）==\n" % TOP_ALLOCATIONS)
+        buffer.write("\n".join(memory_lines) + "\n")
+    return buffer.getvalue()
+
+
+@contextlib.contextmanager
+def capture(profile_id, stage, **meta):
+    """profile_id 为 None 时不做任何事；否则剖析代码块并把产物写入 PROFILE_DIR/<profile_id>/<stage>.*。"""
+    if profile_id is None:
+        yield
+        return
+
+    before = None
+    if PROFILE_TRACEMALLOC:
+        _start_tracemalloc()
+        before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - started
+        memory_lines = []
+        if before is not None:
+            after = tracemalloc.take_snapshot()
+            _stop_tracemalloc()
+            memory_lines = [str(stat) for stat in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]]
+        try:
+            _write_artifacts(profile_id, stage, profiler, seconds, memory_lines, meta)
+        except Exception as e:
+            print(f"警告: 写入剖析结果失败 {profile_id}/{stage}: {e}")
+
+
+class StageProfile:
+    """
+    分多段执行的阶段（流式接口中边接收边解析）：每段用 with 剖析并累计，结束后调用 save 写出产物。
+    不记录内存分配（各段之间的分配不属于本阶段）。profile_id 为 None 时不做任何事。
+    """
+
+    def __init__(self, profile_id, stage, **meta):
+        self.profile_id = profile_id
+        self.stage = stage
+        self.meta = meta
+        self.seconds = 0.0
+        self._profiler = cProfile.Profile() if profile_id is not None else None
+        self._started = None
+
+    def __enter__(self):
+        if self._profiler is not None:
+            self._started = time.perf_counter()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.seconds += time.perf_counter() - self._started
+
+    def save(self):
+        if self._profiler is None:
+            return
+        try:
+            _write_artifacts(self.profile_id, self.stage, self._profiler, self.seconds, [], self.meta)
+        except Exception as e:
+            print(f"警告: 写入剖析结果失败 {self.profile_id}/{self.stage}: {e}")
+
+
+def _write_artifacts(profile_id, stage, profiler, seconds, memory_lines, meta):
+    directory = os.path.join(PROFILE_DIR, profile_id)
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, f"{stage}.prof"))
+    with open(os.path.join(directory, f"{stage}.txt"), "w", encoding="utf-8") as f:
+        f.write(_stats_report(profiler, seconds, memory_lines))
+    # meta.json 由解析与渲染两个阶段（可能在不同进程）分别补充，按阶段各写一个键
+    meta_path = os.path.join(directory, "meta.json")
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {"profile_id": profile_id, "stages": {}}
+    data["stages"][stage] = dict(meta, seconds=round(seconds, 4), pid=os.getpid())
+    tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, meta_path)
+    print(f"剖析结果已保存: {directory}（{stage}，{seconds:.3f}s）")
+    prune()
+
+
+def prune(keep=None):
+    """只保留最近 keep 份剖析结果（profile_id 以时间开头，按名称排序即按时间排序）。"""
+    keep = PROFILE_KEEP if keep is None else keep
+    for profile_id in list_profile_ids()[keep:]:
+        shutil.rmtree(os.path.join(PROFILE_DIR, profile_id), ignore_errors=True)
+
+
+def list_profile_ids():
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except OSError:
+        return []
+    return sorted((n for n in names if PROFILE_ID_PATTERN.fullmatch(n)), reverse=True)
+
+
+def list_profiles(limit=20):
+    """最近的剖析结果：[{profile_id, stages, files}]，新的在前。"""
+    profiles = []
+    for profile_id in list_profile_ids()[:limit]:
+        directory = os.path.join(PROFILE_DIR, profile_id)
+        try:
+            with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+                stages = json.load(f).get("stages", {})
+        except (OSError, ValueError):
+            stages = {}
+        try:
+            files = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        profiles.append({"profile_id": profile_id, "stages": stages,
+                         "files": [n for n in files if ARTIFACT_PATTERN.fullmatch(n)]})
+    return profiles
+
+
+def artifact_path(profile_id, filename):
+    """校验并返回产物文件路径；不存在或名称不合法时返回 None。"""
+    if not PROFILE_ID_PATTERN.fullmatch(profile_id) or not ARTIFACT_PATTERN.fullmatch(filename):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id, filename)
+    return path if os.path.isfile(path) else None
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in ("list", "show"):
+        print("用法: python profiling.py list | show <profile_id> [parse|render]")
+        return 1
+    if argv[0] == "list":
+        for profile in list_profiles():
+            stages = "，".join(f"{k} {v.get('seconds')}s" for k, v in profile["stages"].items())
+            print(f"{profile['profile_id']}  {stages}")
+        return 0
+    if len(argv) < 2:
+        print("需要 profile_id")
+        return 1
+    for stage in ([argv[2]] if len(argv) > 2 else ["parse", "render"]):
+        path = artifact_path(argv[1], f"{stage}.txt")
+        if path:
+            print(f"===== {stage} =====")
+            with open(path, "r", encoding="utf-8") as f:
+                print(f.read())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# remote_images.py
+"""
+网络图片的获取与本地缓存：每张网络图片只下载一次，PDF 渲染只读本地文件。
+
+原先提供 image_url 时，URL 交给模型之后，PDF 渲染里 FPDF.image 还会同步再下载一遍（没有超时、没有大小限制）。
+现在由这里统一获取：
+- 连接池：共享一个 httpx 客户端（keep-alive），连接 / 读取分别限时，整次下载另有总时限；
+- 大小上限：响应头声明的长度或实际读到的字节数超过 REMOTE_IMAGE_MAX_MB 时中止；只接受 PNG / JPEG / GIF / BMP；
+- 缓存：图片内容按 sha256 存入 artifacts 存储（与上传图片共用 uploads/，相同内容只存一份，按保留策略清理）；
+  每个 URL 的记录（ETag / Last-Modified / 内容哈希）存在 REMOTE_IMAGE_CACHE_DIR/<前两位>/<sha1(url)>.json。
+  记录在 REMOTE_IMAGE_FRESH_SECONDS 内直接使用；过期后带 If-None-Match / If-Modified-Since 重新验证，304 时不再下载；
+- 同一 URL 的并发获取合并为一次；prefetch 在模型分析的同时于后台预取，生成 PDF 时通常已在本地。
+
+模型调用仍直接使用 URL（由模型服务端读取），分析缓存的键不变。
+
+配置（环境变量）：
+- REMOTE_IMAGE_MAX_MB：单张图片大小上限，默认 20
+- REMOTE_IMAGE_CONNECT_TIMEOUT / REMOTE_IMAGE_READ_TIMEOUT / REMOTE_IMAGE_DEADLINE：连接、单次读取与整次下载的时限（秒），默认 5 / 15 / 30
+- REMOTE_IMAGE_MAX_CONNECTIONS：连接池大小，默认 10
+- REMOTE_IMAGE_FRESH_SECONDS：记录在多长时间内无需重新验证，默认 3600
+- REMOTE_IMAGE_CACHE_DIR：URL 记录目录，默认 output/cache/remote
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import metrics
+from analysis_cache import is_remote, normalize_url
+from artifacts import store as artifact_store
+from singleflight import SingleFlight
+from uploads import EXTENSIONS, sniff_format
+
+REMOTE_IMAGE_MAX_BYTES = int(float(os.environ.get("REMOTE_IMAGE_MAX_MB", "20")) * 1024 * 1024)
+REMOTE_IMAGE_CONNECT_TIMEOUT = float(os.environ.get("REMOTE_IMAGE_CONNECT_TIMEOUT", "5"))
+REMOTE_IMAGE_READ_TIMEOUT = float(os.environ.get("REMOTE_IMAGE_READ_TIMEOUT", "15"))
+REMOTE_IMAGE_DEADLINE = float(os.environ.get("REMOTE_IMAGE_DEADLINE", "30"))
+REMOTE_IMAGE_MAX_CONNECTIONS = int(os.environ.get("REMOTE_IMAGE_MAX_CONNECTIONS", "10"))
+REMOTE_IMAGE_FRESH_SECONDS = float(os.environ.get("REMOTE_IMAGE_FRESH_SECONDS", "3600"))
+REMOTE_IMAGE_CACHE_DIR = os.environ.get("REMOTE_IMAGE_CACHE_DIR", os.path.join("output", "cache", "remote"))
+CHUNK_SIZE = 256 * 1024
+SNIFF_BYTES = 16
+
+
+class RemoteImageError(RuntimeError):
+    """网络图片无法获取：请求失败、超时、超过大小上限或不是支持的图片格式。"""
+
+
+_client = httpx.Client(
+    timeout=httpx.Timeout(REMOTE_IMAGE_READ_TIMEOUT, connect=REMOTE_IMAGE_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=REMOTE_IMAGE_MAX_CONNECTIONS,
+                        max_keepalive_connections=REMOTE_IMAGE_MAX_CONNECTIONS),
+    follow_redirects=True,
+    headers={"User-Agent": "flower-of-life-report/1.0"},
+)
+_flight = SingleFlight("remote_image")
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="remote-image")
+metrics.register_collector(metrics.singleflight_collector(_flight))
+
+
+def _record_path(url):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(REMOTE_IMAGE_CACHE_DIR, key[:2], f"{key}.json")
+
+
+def _read_record(url):
+    try:
+        with open(_record_path(url), "r", encoding="utf-8") as f:
+            record = json.load(f)
+        return record if record.get("url") == url else None
+    except (OSError, ValueError):
+        return None
+
+
+def _write_record(url, record):
+    path = _record_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _blob_path(record):
+    return artifact_store.path("uploads", f"{record['sha256']}{record['ext']}")
+
+
+def fetch_image(url):
+    """返回网络图片的本地路径（必要时下载或重新验证）；失败时抛出 RemoteImageError。"""
+    url = normalize_url(url)
+    return _flight.do(url, _fetch, url)
+
+
+def _fetch(url):
+    record = _read_record(url)
+    headers = {}
+    if record is not None:
+        path = _blob_path(record)
+        if os.path.isfile(path):
+            if time.time() - record.get("checked_at", 0) < REMOTE_IMAGE_FRESH_SECONDS:
+                artifact_store.touch(path)
+                metrics.inc("remote_image_requests_total", help="网络图片获取次数（按结果）", outcome="hit")
+                return path
+            if record.get("etag"):
+                headers["If-None-Match"] = record["etag"]
+            if record.get("last_modified"):
+                headers["If-Modified-Since"] = record["last_modified"]
+        else:
+            record = None  # 图片已被清理，重新下载
+
+    try:
+        with metrics.span("fetch_remote_image"), _client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and record is not None:
+                record["checked_at"] = time.time()
+                _write_record(url, record)
+                path = _blob_path(record)
+                artifact_store.touch(path)
+                metrics.inc("remote_image_requests_total", help="网络图片获取次数（按结果）", outcome="revalidated")
+                return path
+            response.raise_for_status()
+            path, sha256, ext = _download(response)
+    except httpx.HTTPError as e:
+        metrics.inc("remote_image_requests_total", help="网络图片获取次数（按结果）", outcome="error")
+        raise RemoteImageError(f"网络图片获取失败: {url}: {e}") from e
+    except RemoteImageError:
+        metrics.inc("remote_image_requests_total", help="网络图片获取次数（按结果）", outcome="error")
+        raise
+
+    _write_record(url, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": sha256,
+        "ext": ext,
+        "checked_at": time.time(),
+    })
+    metrics.inc("remote_image_requests_total", help="网络图片获取次数（按结果）", outcome="fetched")
+    return path
+
+
+def _download(response):
+    """把响应体写入存储：边读边计算 sha256，检查格式与大小上限。返回 (路径, sha256, 扩展名)。"""
+    declared = response.headers.get("Content-Length")
+    if declared and declared.isdigit() and int(declared) > REMOTE_IMAGE_MAX_BYTES:
+        raise RemoteImageError(f"网络图片过大: {int(declared)} 字节（上限 {REMOTE_IMAGE_MAX_BYTES}）")
+
+    deadline = time.monotonic() + REMOTE_IMAGE_DEADLINE
+    tmp_path = artifact_store.temp_path()
+    digest = hashlib.sha256()
+    head, fmt, size = b"", None, 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_bytes(CHUNK_SIZE):
+                size += len(chunk)
+                if size > REMOTE_IMAGE_MAX_BYTES:
+                    raise RemoteImageError(f"网络图片过大：超过 {REMOTE_IMAGE_MAX_BYTES} 字节")
+                if time.monotonic() > deadline:
+                    raise RemoteImageError(f"网络图片下载超时（{REMOTE_IMAGE_DEADLINE:g} 秒）")
+                if fmt is None and len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES]
+                    fmt = sniff_format(head)
+                    if fmt is None and len(head) >= SNIFF_BYTES:
+                        raise RemoteImageError("网络图片格式不支持，只支持 PNG, JPG, JPEG, BMP, GIF 格式")
+                digest.update(chunk)
+                f.write(chunk)
+        if fmt is None:
+            raise RemoteImageError("网络图片格式不支持，只支持 PNG, JPG, JPEG, BMP, GIF 格式")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    metrics.inc("remote_image_bytes_total", size, help="下载的网络图片字节数")
+    sha256 = digest.hexdigest()
+    return artifact_store.put_upload(tmp_path, sha256, EXTENSIONS[fmt]), sha256, EXTENSIONS[fmt]
+
+
+def local_image_path(image_path):
+    """
+    渲染用的本地图片路径：本地路径原样返回；网络图片返回缓存中的文件，获取失败时返回 None
+    （PDF 改用备用图，渲染过程中不会访问网络）。
+    """
+    if not image_path or not is_remote(image_path):
+        return image_path
+    try:
+        return fetch_image(image_path)
+    except RemoteImageError as e:
+        print(f"警告: {e}")
+        return None
+
+
+def cached_image_path(image_path):
+    """
+    已在缓存中且仍新鲜的网络图片的本地路径，不访问网络；没有时返回 None。
+    供请求路径上的查找使用（例如近似重复检测），避免在查找时同步下载。
+    """
+    record = _read_record(normalize_url(image_path))
+    if record is None or time.time() - record.get("checked_at", 0) >= REMOTE_IMAGE_FRESH_SECONDS:
+        return None
+    path = _blob_path(record)
+    return path if os.path.isfile(path) else None
+
+
+def prefetch(image_path):
+    """后台预取网络图片（与模型分析同时进行）；本地路径忽略，失败只记录日志，生成 PDF 时会再尝试。"""
+    if image_path and is_remote(image_path):
+        _prefetch_executor.submit(local_image_path, image_path)
@@ -0,0 +1,327 @@
+# report.py
+"""
+报告的内存表示。
+
+模型输出只在这里解析一次，得到 Report：头部信息（姓名、日期、图片路径）+ 按出现顺序排列的章节，
+章节正文已拆成段落 / 项目符号 / 空行（blocks），PDF 渲染直接使用，不再经过磁盘与正则。
+TXT（模型原文）与 JSON（结构化结果）只是旁路输出：save_report 写出二者，load_report 读回时
+优先使用 JSON，免去重新解析，缓存 / 历史报告可以直接重新渲染。
+"""
+import json
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+
+
+# —— TXT 清洗：逐行单趟处理，正则全部预编译 ——
+# Markdown 强调标记：**粗体**、*斜体*、***加粗斜体***（仅去除星号，保留中间文字）
+_emphasis_pat = re.compile(r'\*{1,3}([^\n*]+?)\*{1,3}')
+# 整行的分隔线，如 --- / ---- / —— 等（只在单独一行时删除）
+_separator_pat = re.compile(r'\s*[-_–—]{3,}\s*')
+_separator_chars = frozenset('-_–—')
+# 报告头部字段：姓名 / 日期 / 图片路径
+_header_pat = re.compile(r'(姓名|日期|图片路径)[:：]\s*(.*)')
+HEADER_FIELDS = {'姓名': 'name', '日期': 'date', '图片路径': 'image_path'}
+
+
+class CleanText(str):
+    """已清洗过的文本（幂等标记）：clean_noise 遇到它直接原样返回，不再重复扫描。"""
+    __slots__ = ()
+
+
+def clean_line(line: str) -> str:
+    """清洗单行（不含换行符）：去强调星号、清空整行分隔线、去行尾空格、规整行首项目符号 “• ”。"""
+    while '*' in line:
+        cleaned = _emphasis_pat.sub(r'\1', line)
+        if cleaned == line:
+            break
+        line = cleaned
+    stripped = line.strip()
+    if len(stripped) >= 3 and stripped[0] in _separator_chars and _separator_pat.fullmatch(line):
+        return ""
+    line = line.rstrip(" \t")
+    if stripped[:1] == '•':
+        line = '•' + line.lstrip()[1:].lstrip()
+    return line
+
+
+def clean_noise(text: str) -> str:
+    """清理 TXT 中不符合阅读习惯的杂质符号；连续空行最多保留一行。结果带 CleanText 标记，重复调用直接返回。"""
+    if not text or isinstance(text, CleanText):
+        return text
+    out = []
+    blank = False
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        line = clean_line(line)
+        if not line:
+            if blank:
+                continue
+            blank = True
+        else:
+            blank = False
+        out.append(line)
+    return CleanText("\n".join(out))
+
+
+class IncrementalSectionParser:
+    """
+    增量章节解析器：按行处理输入，遇到下一个 “N. 标题” 行时，上一节即视为完成并返回。
+    既用于整篇 TXT 的解析，也用于模型流式输出时边生成边推送章节。
+
+    每行只清洗一次，同一趟里识别抬头、头部字段（header）与章节边界；
+    章节正文在收尾时只做空行整理，结果为 CleanText，渲染时不再重复清洗。
+    """
+    # ——仅识别“行首的 1. 标题”为章节，避免把 xxx.jpg、小数点当标题——
+    title_pat = re.compile(r'^\s*\*{0,2}(\d+)\.\s*(.+?)\s*\*{0,2}\s*$')
+    banner_pat = re.compile(r'^生命之花分析报告\s*$')
+
+    def __init__(self):
+        self.sections = {}
+        self.header = {}
+        self._buffer = ""
+        self._title = None
+        self._lines = []
+        self._pending_field = None
+
+    def feed(self, chunk):
+        """输入一段文本，返回本次新完成的章节列表 [(标题, 正文)]。"""
+        self._buffer += chunk.replace("\r\n", "\n").replace("\r", "\n")
+        *lines, self._buffer = self._buffer.split("\n")
+        completed = []
+        for line in lines:
+            section = self._feed_line(line)
+            if section:
+                completed.append(section)
+        return completed
+
+    def finish(self):
+        """输入结束：处理缓冲区剩余内容并收尾最后一节。"""
+        completed = []
+        if self._buffer:
+            section = self._feed_line(self._buffer)
+            self._buffer = ""
+            if section:
+                completed.append(section)
+        section = self._close_section()
+        if section:
+            completed.append(section)
+        return completed
+
+    def _feed_line(self, line):
+        line = clean_line(line)
+        if not line:
+            if self._title is not None:
+                self._lines.append(line)
+            return None
+        self._scan_header(line)
+        head = line.lstrip()[:1]
+        # 去掉单独的抬头行，保留正文
+        if head == '生' and self.banner_pat.match(line):
+            return None
+        if head.isdigit() or head == '*':
+            m = self.title_pat.match(line)
+            if m:
+                section = self._close_section()
+                self._title = f"{m.group(1)}. {m.group(2).strip()}"  # 如：1. 图案结构解读
+                return section
+        if self._title is not None:
+            self._lines.append(line)
+        return None
+
+    def _scan_header(self, line):
+        """记录各头部字段第一次出现的值；冒号后为空时取下一个非空行。"""
+        if self._pending_field:
+            self.header[self._pending_field] = line.strip()
+            self._pending_field = None
+        if len(self.header) == len(HEADER_FIELDS) or ('：' not in line and ':' not in line):
+            return
+        for m in _header_pat.finditer(line):
+            field = HEADER_FIELDS[m.group(1)]
+            if field in self.header:
+                continue
+            value = m.group(2).strip()
+            if value:
+                self.header[field] = value
+            else:
+                self._pending_field = field
+
+    def _close_section(self):
+        if self._title is None:
+            return None
+        # 正文逐行已清洗，这里只去引用符并整理空行：连续空行合并为一行，
+        # 项目符号 / 引用行之前的空行去掉（列表紧贴上文），首尾空行去掉
+        body = []
+        blank = False
+        prefix = ""
+        for line in self._lines:
+            if not line:
+                blank = bool(body)
+                continue
+            stripped = line.lstrip()
+            head = stripped[:1]
+            if head == '>':
+                blank = False
+                stripped = stripped[1:].lstrip()
+                if not stripped:
+                    # 单独的 “>” 与下一行合并
+                    continue
+                line = stripped
+            if prefix:
+                line, prefix = prefix + line.lstrip(), ""
+            elif line == '•':
+                prefix = '•'
+                continue
+            if head == '•' or line[:1] == '•':
+                blank = False
+            if blank:
+                body.append("")
+                blank = False
+            body.append(line)
+        if prefix:
+            body.append(prefix)
+        if body:
+            body[0] = body[0].lstrip()
+        value = CleanText("\n".join(body))
+        key = self._title
+        self.sections[key] = value
+        self._title, self._lines = None, []
+        return key, value
+
+
+# —— 结构化报告 ——
+TEXT, BULLET, BLANK = "text", "bullet", "blank"
+REPORT_FORMAT_VERSION = 1
+
+
+def split_blocks(body):
+    """把章节正文拆成 ((类型, 文本), ...)：“•” 与 “- ” 开头的行为项目符号，空行单独一项。"""
+    blocks = []
+    for line in body.split("\n") if body else ():
+        line = line.strip()
+        if not line:
+            blocks.append((BLANK, ""))
+        elif line.startswith('•'):
+            blocks.append((BULLET, line[1:].lstrip()))
+        elif line.startswith('- '):
+            blocks.append((BULLET, line[2:].strip()))
+        else:
+            blocks.append((TEXT, line))
+    return tuple(blocks)
+
+
+class Section(namedtuple("Section", "title blocks")):
+    __slots__ = ()
+
+    @property
+    def content(self):
+        """正文文本（项目符号统一为 “•”）。"""
+        return "\n".join("•" + text if kind == BULLET else text for kind, text in self.blocks)
+
+
+class Report:
+    """
+    一份分析报告：name / date / image_path 为头部信息，sections 为按出现顺序排列的 Section，
+    text 为模型原文（TXT 旁路输出的内容）。
+    """
+
+    def __init__(self, name, date, image_path=None, sections=(), text=""):
+        self.name = name
+        self.date = date
+        self.image_path = image_path
+        self.sections = list(sections)
+        self.text = text
+        self._index = {section.title: section for section in self.sections}
+        # 解析时被选中剖析则为剖析 ID，PDF 渲染写入同一份剖析结果（见 profiling.py）
+        self.profile_id = None
+
+    @classmethod
+    def from_parser(cls, parser, text, name=None):
+        """由已读完全文（已调用 finish）的 IncrementalSectionParser 构造，流式分析结束时不必重新解析。"""
+        header = parser.header
+        return cls(
+            name=name or header.get('name') or "未知",
+            date=header.get('date') or datetime.now().strftime("%Y-%m-%d"),
+            image_path=header.get('image_path'),
+            sections=[Section(title, split_blocks(body)) for title, body in parser.sections.items()],
+            text=text,
+        )
+
+    @classmethod
+    def from_text(cls, text, name=None):
+        """解析模型输出 / TXT 报告；name 非空时覆盖文中的姓名。"""
+        parser = IncrementalSectionParser()
+        parser.feed(text)
+        parser.finish()
+        return cls.from_parser(parser, text, name)
+
+    def section(self, title):
+        return self._index.get(title)
+
+    def to_text(self):
+        return self.text
+
+    def to_dict(self):
+        return {
+            "version": REPORT_FORMAT_VERSION,
+            "name": self.name,
+            "date": self.date,
+            "image_path": self.image_path,
+            "sections": [{"title": s.title, "blocks": [list(block) for block in s.blocks]} for s in self.sections],
+            "text": self.text,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != REPORT_FORMAT_VERSION:
+            raise ValueError(f"不支持的报告格式版本: {data.get('version')}")
+        return cls(
+            name=data["name"],
+            date=data["date"],
+            image_path=data.get("image_path"),
+            sections=[Section(s["title"], tuple((kind, text) for kind, text in s["blocks"])) for s in data["sections"]],
+            text=data.get("text", ""),
+        )
+
+
+def json_path_for(txt_path):
+    return os.path.splitext(txt_path)[0] + ".json"
+
+
+def write_report_json(report, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report.to_dict(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_report_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    try:
+        return Report.from_dict(data)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"报告 JSON 格式不正确: {path}: {e}") from e
+
+
+def load_report(path, name=None):
+    """
+    读取报告文件（.txt 或 .json），返回 Report；name 非空时覆盖报告中的姓名。
+    TXT 旁边有同名 JSON（save_report 写出的）时直接读取 JSON，不再解析。
+    """
+    if path.endswith(".json"):
+        report = read_report_json(path)
+    else:
+        try:
+            report = read_report_json(json_path_for(path))
+        except FileNotFoundError:
+            report = None
+        except ValueError as e:
+            print(f"警告: 报告 JSON 无法读取，改为解析 TXT: {e}")
+            report = None
+        if report is None:
+            with open(path, "r", encoding="utf-8") as f:
+                return Report.from_text(f.read(), name)
+    if name:
+        report.name = name
+    return report
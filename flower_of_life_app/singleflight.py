@@ -0,0 +1,85 @@
+# singleflight.py
+"""
+进行中请求合并（single-flight）。
+
+同一个 key 的调用正在执行时，后到的调用不再重复执行，而是等待第一个调用结束并共享其结果（或异常）。
+用于避免用户重复提交时对同一张图片多次调用模型、多次渲染同一份 PDF。
+
+同一个 SingleFlight 既可以从线程中调用（do，等待时阻塞当前线程），也可以在协程中调用（ado，等待时不占线程）；
+两种调用共用一张进行中的表，互相合并：例如 Web 接口在请求线程内分析、API 任务在事件循环中分析，
+同一张图片同时提交时只调用一次模型。结果经 concurrent.futures.Future 在线程与事件循环之间传递。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self, name=""):
+        self.name = name
+        self._calls = {}  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+        self.executed = 0   # 实际执行次数
+        self.coalesced = 0  # 被合并（等待共享结果）的次数
+
+    def _join(self, key):
+        """返回 (future, leader)：已有进行中的调用时 leader 为 False。"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.executed += 1
+            return future, True
+
+    def _finish(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key, fn, *args, **kwargs):
+        """在当前线程执行 fn(*args, **kwargs)，或等待同一 key 进行中的调用（线程或协程发起的）。"""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key)
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """do 的协程版本：fn 为协程函数；等待其他调用的结果时不占线程。"""
+        future, leader = self._join(key)
+        if not leader:
+            # shield：某个等待者被取消时不影响正在执行的调用与其他等待者
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
@@ -0,0 +1,225 @@
+# task_store.py
+"""
+分析任务状态存储。
+
+- SQLiteTaskStore：默认实现，WAL 模式，多个 gunicorn worker / 进程共享同一个库文件，重启后任务仍可查询。
+- MemoryTaskStore：进程内字典实现，用于测试或单进程调试。
+
+两者接口一致：create / get / update / update_many / list_by_status / purge_expired。
+任务在最后一次更新 ttl 秒后过期，过期任务查询不到，并会被定期清理。
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 24 * 3600
+PURGE_INTERVAL_SECONDS = 60
+
+
+class TaskStore(ABC):
+    """任务存储接口（缺少任一抽象方法的实现在创建时即报错）。fields 为任意可 JSON 序列化的键值。"""
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._last_purge = 0.0
+
+    @abstractmethod
+    def create(self, task_id, **fields):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, task_id):
+        raise NotImplementedError
+
+    def update(self, task_id, **fields):
+        self.update_many({task_id: fields})
+
+    @abstractmethod
+    def update_many(self, updates):
+        """批量合并更新：updates 为 {task_id: {字段: 值}}，在一个事务内完成。"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_by_status(self, status, limit=100):
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge_expired(self):
+        """删除已过期的任务，返回删除条数。"""
+        raise NotImplementedError
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge >= PURGE_INTERVAL_SECONDS:
+            self._last_purge = now
+            self.purge_expired()
+
+
+class MemoryTaskStore(TaskStore):
+    """进程内实现（仅用于测试 / 单进程调试）。"""
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_id, **fields):
+        now = time.time()
+        task = dict(fields, created_at=now, updated_at=now)
+        with self._lock:
+            self._tasks[task_id] = (task, now + self.ttl_seconds)
+        self._maybe_purge()
+
+    def get(self, task_id):
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None or entry[1] < time.time():
+                return None
+            return dict(entry[0])
+
+    def update_many(self, updates):
+        now = time.time()
+        with self._lock:
+            for task_id, fields in updates.items():
+                if task_id not in self._tasks:
+                    continue
+                task = dict(self._tasks[task_id][0], **fields, updated_at=now)
+                self._tasks[task_id] = (task, now + self.ttl_seconds)
+        self._maybe_purge()
+
+    def list_by_status(self, status, limit=100):
+        now = time.time()
+        with self._lock:
+            result = [dict(t, task_id=tid) for tid, (t, exp) in self._tasks.items()
+                      if exp >= now and t.get("status") == status]
+        result.sort(key=lambda t: t.get("created_at", 0))
+        return result[:limit]
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [tid for tid, (_, exp) in self._tasks.items() if exp < now]
+            for tid in expired:
+                del self._tasks[tid]
+        return len(expired)
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    SQLite 实现：WAL 模式下读写互不阻塞，适合多进程共享。
+    任务字段以 JSON 存在 data 列中，status / expires_at 单独成列并建索引。
+    合并更新使用 json_patch 在库内完成，无需先读后写。
+    """
+
+    def __init__(self, db_path, ttl_seconds=DEFAULT_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.db_path = db_path
+        self._local = threading.local()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id    TEXT PRIMARY KEY,
+                status     TEXT,
+                data       TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status  ON tasks(status, created_at);
+            CREATE INDEX IF NOT EXISTS idx_tasks_expires ON tasks(expires_at);
+            """
+        )
+
+    def _conn(self):
+        # sqlite3 连接不能跨线程共享，每个线程各持一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def create(self, task_id, **fields):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO tasks (task_id, status, data, created_at, updated_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (task_id, fields.get("status"), json.dumps(fields, ensure_ascii=False),
+             now, now, now + self.ttl_seconds),
+        )
+        self._maybe_purge()
+
+    def get(self, task_id):
+        row = self._conn().execute(
+            "SELECT data, created_at, updated_at FROM tasks WHERE task_id = ? AND expires_at >= ?",
+            (task_id, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        task = json.loads(row[0])
+        task["created_at"], task["updated_at"] = row[1], row[2]
+        return task
+
+    def update_many(self, updates):
+        if not updates:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        rows = [(json.dumps(fields, ensure_ascii=False), fields.get("status"), now, expires_at, task_id)
+                for task_id, fields in updates.items()]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE tasks SET data = json_patch(data, ?), status = COALESCE(?, status), "
+                "updated_at = ?, expires_at = ? WHERE task_id = ?",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_purge()
+
+    def list_by_status(self, status, limit=100):
+        rows = self._conn().execute(
+            "SELECT task_id, data, created_at, updated_at FROM tasks "
+            "WHERE status = ? AND expires_at >= ? ORDER BY created_at LIMIT ?",
+            (status, time.time(), limit),
+        ).fetchall()
+        result = []
+        for task_id, data, created_at, updated_at in rows:
+            task = json.loads(data)
+            task.update(task_id=task_id, created_at=created_at, updated_at=updated_at)
+            result.append(task)
+        return result
+
+    def purge_expired(self):
+        cur = self._conn().execute("DELETE FROM tasks WHERE expires_at < ?", (time.time(),))
+        return cur.rowcount
+
+
+def create_task_store(backend=None, db_path=None, ttl_seconds=None):
+    """
+    根据配置创建任务存储：
+    - TASK_STORE=sqlite（默认）/ memory
+    - TASK_DB_PATH：SQLite 文件路径，默认 output/tasks.db
+    - TASK_TTL_SECONDS：任务保留时长，默认 24 小时
+    """
+    backend = backend or os.environ.get("TASK_STORE", "sqlite")
+    if ttl_seconds is None:
+        ttl_seconds = int(os.environ.get("TASK_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+    if backend == "memory":
+        return MemoryTaskStore(ttl_seconds)
+    if backend == "sqlite":
+        db_path = db_path or os.environ.get("TASK_DB_PATH", os.path.join("output", "tasks.db"))
+        return SQLiteTaskStore(db_path, ttl_seconds)
+    raise ValueError(f"未知的任务存储类型: {backend}")
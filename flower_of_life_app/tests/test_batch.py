@@ -0,0 +1,68 @@
+# tests/test_batch.py
+"""
+批量任务：结果包的条目名（清单中的姓名不能让 zip 条目跳出解压目录或生成嵌套目录）、批次设置的保存与批次 ID 校验。
+
+运行（在 flower_of_life_app 目录下）：
+    python -m pytest -q tests
+"""
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+os.environ.setdefault("ANALYSIS_CACHE", "0")
+
+import pytest  # noqa: E402
+
+import batch  # noqa: E402
+from artifacts import ArtifactStore  # noqa: E402
+
+HOSTILE_NAMES = ["../../x", "a/b", "..", "/etc/passwd", "..\\..\\evil", "....", "正常姓名"]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path / "artifacts"), sweep_interval=0)
+    monkeypatch.setattr(batch, "artifact_store", store)
+    return store
+
+
+def test_zip_entries_stay_inside_archive(tmp_path, store):
+    items = [{"name": name, "image": f"https://example.com/{i}.png", "prompt": None}
+             for i, name in enumerate(HOSTILE_NAMES)]
+    job = batch.BatchJob.create(items, base_dir=str(tmp_path / "batches"))
+    for i in range(len(items)):
+        pdf_path = tmp_path / f"{i}.pdf"
+        txt_path = tmp_path / f"{i}.txt"
+        pdf_path.write_bytes(b"%PDF-1.4")
+        txt_path.write_text("report", encoding="utf-8")
+        job.progress[str(i)] = {"status": "completed", "pdf_file": str(pdf_path), "txt_file": str(txt_path)}
+
+    with zipfile.ZipFile(job.build_zip()) as zf:
+        names = [info.filename for info in zf.infolist()]
+
+    assert len(names) == 2 * len(items) + 1
+    for name in names:
+        assert "/" not in name and "\\" not in name and ".." not in name, name
+    assert "007_正常姓名.pdf" in names
+    assert "003.pdf" in names  # 只剩 .. 时退回序号
+
+
+def test_zip_entry_prefix():
+    assert batch.zip_entry_prefix(1, "../../x") == "001_x"
+    assert batch.zip_entry_prefix(2, "a/b") == "002_a_b"
+    assert batch.zip_entry_prefix(3, "..") == "003"
+
+
+def test_resume_keeps_parallelism(tmp_path, store):
+    items = [{"name": "a", "image": "https://example.com/a.png", "prompt": None}]
+    job = batch.BatchJob.create(items, base_dir=str(tmp_path), parallelism=3)
+    assert batch.BatchJob.load(job.batch_id, base_dir=str(tmp_path)).parallelism == 3
+
+
+def test_create_rejects_bad_batch_id(tmp_path, store):
+    items = [{"name": "a", "image": "https://example.com/a.png", "prompt": None}]
+    with pytest.raises(ValueError):
+        batch.BatchJob.create(items, batch_id="../x", base_dir=str(tmp_path))
+    assert not (tmp_path.parent / "x").exists()
@@ -0,0 +1,133 @@
+# uploads.py
+"""
+上传图片接收。
+
+旧流程：file.save() 落盘 →（无扩展名时）PIL 重新打开识别格式 → 改名 → 压缩时再读一遍 → 编码 base64 时再读一遍。
+新流程：从请求流中分块读取，用开头几个字节识别格式，边写盘边计算 sha256，
+写完后把文件只读 mmap 进来；后续压缩、规范化、base64 编码都直接使用这块映射（不复制到 Python 堆上），
+缓存键也直接使用这里算好的哈希，不再重复读盘、重复哈希。
+文件按内容寻址存放在 artifacts 存储中（uploads/<aa>/<bb>/<sha256>.<ext>），相同图片只存一份，压缩副本也只生成一次。
+"""
+import hashlib
+import mmap
+import os
+
+import metrics
+from artifacts import store as artifact_store
+from imaging import compress_to_limit, sniff_format  # noqa: F401（sniff_format 也供 remote_images 使用）
+
+CHUNK_SIZE = 256 * 1024
+
+EXTENSIONS = {'png': '.png', 'jpeg': '.jpg', 'gif': '.gif', 'bmp': '.bmp'}
+
+
+class UnsupportedImageError(ValueError):
+    """上传内容不是支持的图片格式。"""
+
+
+class ImageSource:
+    """
+    一张待分析的图片：本地文件（path 为文件路径，data 为文件的只读 mmap 或 bytes，sha256 为内容哈希）
+    或网络图片（path 为 URL，data / sha256 为 None）。
+    """
+    __slots__ = ("path", "data", "sha256", "format")
+
+    def __init__(self, path, data=None, sha256=None, format=None):
+        self.path = path
+        self.data = data
+        self.sha256 = sha256
+        self.format = format
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(url)
+
+    @property
+    def is_remote(self):
+        return self.path.startswith("http://") or self.path.startswith("https://")
+
+    @property
+    def size(self):
+        return len(self.data) if self.data is not None else os.path.getsize(self.path)
+
+    def detach(self):
+        """
+        返回不持有内容的副本（路径、哈希与格式不变）并关闭 mmap；之后需要内容时从文件读取。
+        用于提交到异步分析的任务：排队中的成千上万个任务不各自占用一个映射和文件描述符。
+        """
+        if self.data is None:
+            return self
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        return ImageSource(self.path, None, self.sha256, self.format)
+
+    def read(self):
+        """返回图片内容；内存中没有时从文件读取。"""
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+def receive_upload(file_storage, store=None):
+    """
+    从 werkzeug FileStorage 读取上传内容：识别格式、边写临时文件边计算 sha256，写完后放入内容寻址目录
+    （已有相同内容时直接使用已存的文件）。store 默认为 artifacts.store。
+    不是 PNG / JPEG / GIF / BMP 时抛出 UnsupportedImageError（不落盘）。
+    """
+    store = store or artifact_store
+    stream = file_storage.stream
+    with metrics.span("detect_format"):
+        head = stream.read(CHUNK_SIZE)
+        fmt = sniff_format(head)
+    if fmt is None:
+        raise UnsupportedImageError("不支持的图片格式，只支持 PNG, JPG, JPEG, BMP, GIF 格式")
+
+    tmp_path = store.temp_path(EXTENSIONS[fmt])
+    digest = hashlib.sha256()
+    with metrics.span("upload_save"):
+        with open(tmp_path, 'wb') as f:
+            chunk = head
+            while chunk:
+                digest.update(chunk)
+                f.write(chunk)
+                chunk = stream.read(CHUNK_SIZE)
+        path = store.put_upload(tmp_path, digest.hexdigest(), EXTENSIONS[fmt])
+        data = _map_file(path)
+    metrics.inc("upload_bytes_total", len(data), help="接收的上传图片字节数")
+    return ImageSource(path, data, digest.hexdigest(), fmt)
+
+
+def _map_file(path):
+    """只读 mmap 整个文件（映射在 ImageSource 释放时自动解除）。"""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def compress_upload(image, max_size_bytes=10 * 1024 * 1024, store=None):
+    """
+    超过大小上限时压缩（见 imaging.compress_to_limit），返回新的 ImageSource（<sha256>_compressed.jpg）；
+    同一张图之前压缩过时直接使用已存的副本。未超限、网络图片或压缩失败时原样返回。
+    """
+    if image.is_remote or image.size <= max_size_bytes:
+        return image
+    store = store or artifact_store
+    compressed_path = store.upload_path(f"{image.sha256}_compressed.jpg") if image.sha256 else None
+    if compressed_path and os.path.isfile(compressed_path):
+        data = _map_file(compressed_path)
+        store.touch(compressed_path)
+        return ImageSource(compressed_path, data, hashlib.sha256(data).hexdigest(), 'jpeg')
+    try:
+        with metrics.span("compress"):
+            data, _ = compress_to_limit(image.path, max_size_bytes)
+    except Exception as e:
+        print(f"图片压缩失败: {e}")
+        return image
+    if compressed_path is None:
+        compressed_path = os.path.splitext(image.path)[0] + '_compressed.jpg'
+    tmp_path = store.temp_path('.jpg')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, compressed_path)
+    store.add(compressed_path)
+    return ImageSource(compressed_path, data, hashlib.sha256(data).hexdigest(), 'jpeg')